@@ -0,0 +1,269 @@
+"""
+Offline benchmark for the standup bot. The LLM, Mongo, Slack and GitHub are replaced with the in-process stand-ins
+from tests/fakes.py that sleep for a configurable latency, so it runs without any credentials, network or database:
+
+    python benchmark.py --llm-latency 0.5 --turns 5 --users 100 --output results.json
+
+Reports, as one JSON document:
+- turns: per message type, with the bot's own debounce window and streamed replies: time until the placeholder shows,
+  end-to-end and per-stage latency, LLM calls and Mongo round-trips per turn
+- burst: LLM calls and turns for a user sending one update as several quick messages, with and without the debounce window
+- github: requests, Mongo round-trips and latency of get_github_activity for each backend: cold, served from a fresh
+  activity snapshot, and an incremental sync of a stale snapshot against the warm ETag cache
+- fanout: wall time, per-user p50/p95 and throughput of send_standup_messages for --users users
+
+Compare the output of two commits to spot regressions.
+"""
+import os
+
+# the helpers read these at import time
+for env_var in ["SLACK_BOT_TOKEN", "SLACK_APP_TOKEN", "SLACK_USER_GROUP_ID", "GITHUB_CLIENT_ID", "GITHUB_CLIENT_SECRET", "GITHUB_REDIRECT_URI", "OPENAI_API_KEY"]:
+    os.environ.setdefault(env_var, "benchmark")
+
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import time
+import io
+from collections import defaultdict
+from contextlib import ExitStack, redirect_stdout
+from datetime import timedelta
+from unittest import mock
+
+from tests.fakes import (
+    USER_ID, CHANNEL_ID, MESSAGE_TYPES, FakeChatModel, FakeToolAgent, FakeStore, FakeGitHubServer, FakeSlackClient,
+    install_turn_fakes, install_github_fakes
+)
+import main
+import helpers.llm_helpers as llm_helpers
+import helpers.github_helpers as github_helpers
+import helpers.slack_helpers as slack_helpers
+from helpers.turn_queue_helpers import MESSAGE_DEBOUNCE_SECONDS
+
+# the functions a message goes through in main, timed as the stages of a turn
+TURN_STAGES = {
+    "save_message_to_db": "save_messages",
+    "build_turn_context": "build_context",
+    "execute_agent_with_user_context": "tool_agent",
+    "reply": "reply"
+}
+
+def _install_turn_fakes(stack, store, llm, agent, stage_times):
+    install_turn_fakes(stack, store, llm, agent)
+    # time the stages on top of the fakes, so save_message_to_db includes the fake round-trip
+    for name, stage in TURN_STAGES.items():
+        stack.enter_context(mock.patch.object(main, name, _timed(getattr(main, name), stage, stage_times)))
+
+def _timed(func, stage, stage_times):
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            stage_times[stage] += time.perf_counter() - start
+    return wrapper
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+def _percentile(values, percentile):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[percentile - 1]
+
+async def _say(text=None, **kwargs):
+    pass
+
+async def benchmark_message_type(message_type, turns, llm_latency, mongo_latency, slack_latency):
+    """One message at a time through the queue as configured, so each turn waits out the debounce window after its placeholder."""
+    latencies = []
+    placeholder_latencies = []
+    llm_calls = []
+    round_trips = []
+    stage_latencies = defaultdict(list)
+    for _ in range(turns):
+        store = FakeStore(MESSAGE_TYPES[message_type]["has_update"], latency=mongo_latency)
+        llm = FakeChatModel(llm_latency)
+        agent = FakeToolAgent(llm_latency)
+        slack = FakeSlackClient(slack_latency)
+        stage_times = defaultdict(float)
+        with ExitStack() as stack:
+            _install_turn_fakes(stack, store, llm, agent, stage_times)
+            stack.enter_context(mock.patch.object(slack_helpers, "slack_client", slack))
+            stack.enter_context(mock.patch.object(slack_helpers, "SLACK_STREAMING_REPLIES", True))
+            # keep the bot's diagnostic prints out of the JSON report
+            stack.enter_context(redirect_stdout(io.StringIO()))
+            start = time.perf_counter()
+            await main.respond_to_message({"user": USER_ID, "channel": CHANNEL_ID, "text": message_type}, _say)
+            await main.turn_queue.join()
+            latencies.append(time.perf_counter() - start)
+        placeholder_latencies.append(slack.posted_at[0] - start)
+        llm_calls.append(llm.calls + agent.calls)
+        round_trips.append(store.round_trips)
+        for stage in TURN_STAGES.values():
+            stage_latencies[stage].append(stage_times[stage])
+    return {
+        "tool": MESSAGE_TYPES[message_type]["tool"],
+        "llm_calls_per_turn": statistics.mean(llm_calls),
+        "mongo_round_trips_per_turn": statistics.mean(round_trips),
+        "placeholder_ms_p50": _ms(statistics.median(placeholder_latencies)),
+        "latency_ms_p50": _ms(statistics.median(latencies)),
+        "latency_ms_max": _ms(max(latencies)),
+        "stage_latency_ms_p50": {stage: _ms(statistics.median(times)) for stage, times in stage_latencies.items()}
+    }
+
+async def benchmark_burst(messages, gap, debounce, llm_latency, mongo_latency):
+    """A create-type update sent as several messages gap seconds apart, answered with the given debounce window."""
+    store = FakeStore(False, latency=mongo_latency)
+    llm = FakeChatModel(llm_latency)
+    agent = FakeToolAgent(llm_latency)
+    replies = []
+
+    async def say(text=None, **kwargs):
+        replies.append(time.perf_counter())
+
+    with ExitStack() as stack:
+        _install_turn_fakes(stack, store, llm, agent, defaultdict(float))
+        stack.enter_context(mock.patch.object(main.turn_queue, "debounce_seconds", debounce))
+        # count the replies through say() rather than a streamed Slack message
+        stack.enter_context(mock.patch.object(slack_helpers, "SLACK_STREAMING_REPLIES", False))
+        stack.enter_context(redirect_stdout(io.StringIO()))
+        for index in range(messages):
+            if index:
+                await asyncio.sleep(gap)
+            await main.respond_to_message({"user": USER_ID, "channel": CHANNEL_ID, "text": "create"}, say)
+        last_message_at = time.perf_counter()
+        await main.turn_queue.join()
+    return {
+        "debounce_ms": _ms(debounce),
+        "turns": len(replies),
+        "llm_calls": llm.calls + agent.calls,
+        "mongo_round_trips": store.round_trips,
+        "last_message_to_final_reply_ms": _ms(replies[-1] - last_message_at) if replies else None
+    }
+
+async def benchmark_github(backend, repos, github_latency, mongo_latency):
+    """
+    get_github_activity with nothing stored, then served from the snapshot that call left behind,
+    then once more after the snapshot has gone stale so it is synced incrementally against the warm ETag cache.
+    """
+    store = FakeStore(github_token="benchmark", latency=mongo_latency)
+    server = FakeGitHubServer(repos, github_latency)
+    results = {}
+    with ExitStack() as stack:
+        install_github_fakes(stack, store, server)
+        stack.enter_context(mock.patch.object(github_helpers, "GITHUB_ACTIVITY_BACKEND", backend))
+        stack.enter_context(redirect_stdout(io.StringIO()))
+        for run in ["cold", "snapshot", "incremental"]:
+            if run == "incremental":
+                snapshot = store.github_activity_snapshots[USER_ID]
+                snapshot["synced_at"] -= timedelta(seconds=github_helpers.GITHUB_SNAPSHOT_MAX_AGE_SECONDS)
+            requests_before, not_modified_before, round_trips_before = server.requests, server.not_modified, store.round_trips
+            start = time.perf_counter()
+            activity = await github_helpers.get_github_activity(USER_ID)
+            results[run] = {
+                "latency_ms": _ms(time.perf_counter() - start),
+                "github_requests": server.requests - requests_before,
+                "not_modified": server.not_modified - not_modified_before,
+                "mongo_round_trips": store.round_trips - round_trips_before,
+                "commits": len(activity["commits"]),
+                "pull_requests": len(activity["pull_requests"])
+            }
+    return results
+
+async def benchmark_fanout(users, repos, llm_latency, mongo_latency, github_latency, slack_latency):
+    """send_standup_messages for users with a connected GitHub account and no pre-generated draft, so each one runs the full pipeline."""
+    store = FakeStore(github_token="benchmark", latency=mongo_latency)
+    server = FakeGitHubServer(repos, github_latency)
+    llm = FakeChatModel(llm_latency)
+    slack = FakeSlackClient(slack_latency)
+    user_ids = [f"U_BENCHMARK_{index}" for index in range(users)]
+    with ExitStack() as stack:
+        install_github_fakes(stack, store, server)
+        patches = [
+            (slack_helpers, "slack_client", slack),
+            (slack_helpers, "get_github_token", store.get_github_token),
+            (slack_helpers, "get_standup_draft", store.get_standup_draft),
+            (slack_helpers, "persist_scheduled_message", store.persist_scheduled_message),
+            (slack_helpers, "standup_message_sent", store.standup_message_sent),
+            (slack_helpers, "enqueue_standup_send_jobs", store.enqueue_standup_send_jobs),
+            (slack_helpers, "claim_standup_send_job", store.claim_standup_send_job),
+            (slack_helpers, "complete_standup_send_job", store.complete_standup_send_job),
+            (slack_helpers, "retry_standup_send_job", store.retry_standup_send_job),
+            (llm_helpers, "get_standup_update", store.get_standup_update),
+            (llm_helpers, "llm", llm)
+        ]
+        for module, name, fake in patches:
+            stack.enter_context(mock.patch.object(module, name, fake))
+        stack.enter_context(redirect_stdout(io.StringIO()))
+        fanout_stats = await slack_helpers.send_standup_messages(user_ids)
+    return {
+        "users": users,
+        "max_workers": slack_helpers.STANDUP_FANOUT_MAX_WORKERS,
+        "wall_time_ms": _ms(fanout_stats["wall_time"]),
+        "per_user_ms_p50": _ms(fanout_stats["p50"]),
+        "per_user_ms_p95": _ms(fanout_stats["p95"]),
+        "users_per_second": round(users / fanout_stats["wall_time"], 1) if fanout_stats["wall_time"] else None,
+        "llm_calls": llm.calls,
+        "slack_calls": slack.calls,
+        "github_requests": server.requests,
+        "mongo_round_trips": store.round_trips
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run_benchmarks(args):
+    return {
+        "commit": _git_commit(),
+        "config": {
+            "llm_latency_ms": _ms(args.llm_latency),
+            "mongo_latency_ms": _ms(args.mongo_latency),
+            "github_latency_ms": _ms(args.github_latency),
+            "slack_latency_ms": _ms(args.slack_latency),
+            "turns_per_message_type": args.turns,
+            "debounce_ms": _ms(MESSAGE_DEBOUNCE_SECONDS),
+            "repos": args.repos,
+            "burst_messages": args.burst_messages,
+            "burst_gap_ms": _ms(args.burst_gap)
+        },
+        "turns": {
+            message_type: await benchmark_message_type(message_type, args.turns, args.llm_latency, args.mongo_latency, args.slack_latency)
+            for message_type in MESSAGE_TYPES
+        },
+        "burst": [
+            await benchmark_burst(args.burst_messages, args.burst_gap, debounce, args.llm_latency, args.mongo_latency)
+            for debounce in [0.0, args.burst_debounce]
+        ],
+        "github": {
+            backend: await benchmark_github(backend, args.repos, args.github_latency, args.mongo_latency)
+            for backend in ["rest", "graphql"]
+        },
+        "fanout": await benchmark_fanout(args.users, args.repos, args.llm_latency, args.mongo_latency, args.github_latency, args.slack_latency)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds each fake LLM call takes")
+    parser.add_argument("--mongo-latency", type=float, default=0.002, help="seconds each fake Mongo round-trip takes")
+    parser.add_argument("--github-latency", type=float, default=0.05, help="seconds each fake GitHub request takes")
+    parser.add_argument("--slack-latency", type=float, default=0.05, help="seconds each fake Slack API call takes")
+    parser.add_argument("--turns", type=int, default=3, help="turns to run per message type")
+    parser.add_argument("--users", type=int, default=50, help="users in the standup fan-out")
+    parser.add_argument("--repos", type=int, default=10, help="repos each fake GitHub user has")
+    parser.add_argument("--burst-messages", type=int, default=4, help="messages in the burst benchmark")
+    parser.add_argument("--burst-gap", type=float, default=0.3, help="seconds between the messages of a burst")
+    parser.add_argument("--burst-debounce", type=float, default=1.0, help="debounce window the burst benchmark compares against none")
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args()
+    results = asyncio.run(run_benchmarks(args))
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
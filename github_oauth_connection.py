@@ -1,34 +1,38 @@
 import os
-from datetime import datetime, timedelta
-import requests
-from urllib.parse import urlencode, urlparse, parse_qs
-from http.server import BaseHTTPRequestHandler
 import json
+from datetime import datetime
+import httpx
+from fastapi import FastAPI, BackgroundTasks, Request, Response
+from fastapi.responses import HTMLResponse
 from dotenv import load_dotenv, find_dotenv
 from helpers.mongo_db_helpers import save_github_token
 from helpers.slack_helpers import send_github_oauth_message
+from helpers.github_helpers import sync_github_login, verify_github_webhook_signature, ingest_github_webhook
+from helpers.metrics_helpers import timed, render_metrics, record_handled_error, record_external_error
 
 load_dotenv(find_dotenv())
 
 GITHUB_CLIENT_ID = os.environ["GITHUB_CLIENT_ID"]
 GITHUB_CLIENT_SECRET = os.environ["GITHUB_CLIENT_SECRET"]
 GITHUB_REDIRECT_URI = os.environ["GITHUB_REDIRECT_URI"]
+CALLBACK_SERVER_HOST = os.environ.get("CALLBACK_SERVER_HOST", "localhost")
+CALLBACK_SERVER_PORT = int(os.environ.get("CALLBACK_SERVER_PORT", 3000))
+# when set, every verified webhook delivery is also written here as JSON for replay_github_webhooks.py
+GITHUB_WEBHOOK_RECORD_DIR = os.environ.get("GITHUB_WEBHOOK_RECORD_DIR")
 
-class GitHubCallbackHandler(BaseHTTPRequestHandler):
+# served by uvicorn on the bot's event loop, so callbacks run concurrently and share the async mongo and slack clients
+oauth_app = FastAPI()
+# pooled client for the token exchange; a slow github.com can't hold a callback open for long
+_http_client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, connect=5.0))
 
-    def do_GET(self):
-        """Handle GitHub OAuth callback."""
-        # Parse URL and query parameters
-        parsed_path = urlparse(self.path)
-        if parsed_path.path == '/github/callback':
-            params = parse_qs(parsed_path.query)
-            code = params.get('code', [None])[0]
-            state = params.get('state', [None])[0]
-            channel_id = params.get('channel_id', [None])[0]
-
-            if code and state:
-                # Exchange code for access token
-                response = requests.post(
+@oauth_app.get("/github/callback")
+async def github_callback(background_tasks: BackgroundTasks, code: str = None, state: str = None, channel_id: str = None):
+    """Handle GitHub OAuth callback."""
+    if code and state:
+        # Exchange code for access token
+        try:
+            with timed("github", "oauth_access_token"):
+                response = await _http_client.post(
                     'https://github.com/login/oauth/access_token',
                     headers={'Accept': 'application/json'},
                     data={
@@ -38,28 +42,68 @@ class GitHubCallbackHandler(BaseHTTPRequestHandler):
                         'redirect_uri': GITHUB_REDIRECT_URI
                     }
                 )
-                
-                token_data = response.json()
+            token_data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Error exchanging GitHub OAuth code: {e}")
+            token_data = {}
+
+        if 'access_token' in token_data:
+            # Store the token
+            await save_github_token(state, token_data['access_token'])
+            # Notify user in Slack after the browser has its response
+            background_tasks.add_task(_send_confirmation, channel_id, state)
+            # webhook events are keyed by GitHub login, so find out whose token this is
+            background_tasks.add_task(_sync_login, state, token_data['access_token'])
+            return HTMLResponse("Successfully connected GitHub account! You can close this window.")
+        record_external_error("github", "oauth_access_token")
+
+    # If we get here, something went wrong
+    return HTMLResponse("Error connecting GitHub account", status_code=400)
+
+@oauth_app.post("/github/webhook")
+async def github_webhook(request: Request):
+    """Receive push, pull_request and pull_request_review deliveries and append their activity to the event store."""
+    body = await request.body()
+    if not verify_github_webhook_signature(body, request.headers.get("X-Hub-Signature-256")):
+        record_external_error("github", "webhook_signature")
+        return Response("Invalid signature", status_code=401)
+
+    event_name = request.headers.get("X-GitHub-Event", "")
+    delivery_id = request.headers.get("X-GitHub-Delivery", "")
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        record_external_error("github", "webhook_payload")
+        return Response("Invalid payload", status_code=400)
+    if GITHUB_WEBHOOK_RECORD_DIR:
+        _record_delivery(event_name, delivery_id, payload)
+    stored = await ingest_github_webhook(event_name, payload)
+    print(f"github webhook {event_name} {delivery_id}: {stored} new activity events")
+    return {"stored": stored}
+
+@oauth_app.get("/metrics")
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+def _record_delivery(event_name, delivery_id, payload):
+    os.makedirs(GITHUB_WEBHOOK_RECORD_DIR, exist_ok=True)
+    file_name = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{event_name}-{delivery_id or 'unknown'}.json"
+    with open(os.path.join(GITHUB_WEBHOOK_RECORD_DIR, file_name), "w") as f:
+        json.dump({"event": event_name, "delivery": delivery_id, "payload": payload}, f)
 
-                if 'access_token' in token_data:
-                    # Store the token
-                    save_github_token(state, token_data['access_token'])
-                    
-                    # Notify user in Slack
-                    try:
-                        send_github_oauth_message(channel_id=channel_id, user_id=state)
-                    except Exception as e:
-                        print(f"Error sending Slack message: {e}")
-                    
-                    # Send success response
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html')
-                    self.end_headers()
-                    self.wfile.write(b"Successfully connected GitHub account! You can close this window.")
-                    return
+async def _sync_login(user_id, github_token):
+    try:
+        await sync_github_login(user_id, github_token)
+    except Exception as e:
+        print(f"Error looking up GitHub login: {e}")
+        record_handled_error("github_login")
 
-            # If we get here, something went wrong
-            self.send_response(400)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(b"Error connecting GitHub account")
\ No newline at end of file
+async def _send_confirmation(channel_id, user_id):
+    try:
+        await send_github_oauth_message(channel_id=channel_id, user_id=user_id)
+    except Exception as e:
+        print(f"Error sending Slack message: {e}")
+        record_handled_error("github_oauth_message")
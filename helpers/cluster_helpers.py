@@ -0,0 +1,52 @@
+import asyncio
+import os
+import socket
+from dotenv import find_dotenv, load_dotenv
+from .mongo_db_helpers import acquire_lease, release_lease
+from .metrics_helpers import record_handled_error
+
+load_dotenv(find_dotenv())
+
+# unique per process, so two replicas on one host are still two nodes
+NODE_ID = os.environ.get("NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# a leader that hasn't renewed for this long is considered gone and replaced
+CLUSTER_LEASE_SECONDS = int(os.environ.get("CLUSTER_LEASE_SECONDS", 30))
+CLUSTER_HEARTBEAT_SECONDS = int(os.environ.get("CLUSTER_HEARTBEAT_SECONDS", 10))
+
+LEADER_LEASE = "scheduler-leader"
+
+async def run_leader_election(on_elected, on_deposed, node_id=NODE_ID):
+    """
+    Compete for the leader lease as node_id until cancelled, renewing it every CLUSTER_HEARTBEAT_SECONDS. on_elected runs when
+    this node takes the lease and on_deposed when it loses it, including when mongo can't be reached to renew it.
+    """
+    is_leader = False
+    try:
+        while True:
+            try:
+                leader = await acquire_lease(LEADER_LEASE, node_id, CLUSTER_LEASE_SECONDS)
+            except Exception as e:
+                # without mongo this node can't prove the lease is still its own
+                print(f"Error renewing cluster lease: {e}")
+                record_handled_error("leader_election")
+                leader = False
+            if leader != is_leader:
+                print(f"node {node_id} {'is now' if leader else 'is no longer'} the leader")
+                await _run_callback(on_elected if leader else on_deposed)
+            is_leader = leader
+            await asyncio.sleep(CLUSTER_HEARTBEAT_SECONDS)
+    finally:
+        # hand over right away on shutdown instead of making the others wait out the lease
+        if is_leader:
+            await _run_callback(on_deposed)
+            try:
+                await release_lease(LEADER_LEASE, node_id)
+            except Exception as e:
+                print(f"Error releasing the leader lease: {e}")
+
+async def _run_callback(callback):
+    try:
+        await callback()
+    except Exception as e:
+        print(f"Error handling leadership change: {e}")
+        record_handled_error("leader_election")
@@ -0,0 +1,87 @@
+import asyncio
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import timedelta
+from .mongo_db_helpers import get_messages_from_db, get_standup_update, get_github_token, get_conversation_summary
+from .format_helpers import convert_conversation_history_to_langchain_messages, split_history_for_summary, MAX_HISTORY_TOKENS
+
+# upper bound on the messages loaded per turn; the token budgets decide how many of them a prompt actually gets
+MAX_TURN_HISTORY_MESSAGES = 50
+
+_current_turn_context = ContextVar("current_turn_context", default=None)
+
+@dataclass
+class TurnContext:
+    """
+    Everything one incoming message needs from Mongo, loaded once when the message arrives.
+    The tool agent, the tools and the reply agent all read from this instead of querying again.
+    """
+    user_id: str
+    channel_id: str
+    message: str
+    # today's messages that aren't covered by the summary yet, newest first
+    conversation_history: list
+    summary: str = None
+    update: dict = None
+    github_token: str = None
+    # SlackReplyStreamer for this turn when replies are streamed, None otherwise
+    reply_stream: object = None
+    _langchain_history: dict = field(default_factory=dict, repr=False)
+
+    @property
+    def has_update(self) -> bool:
+        return self.update is not None
+
+    def get_langchain_history(self, max_tokens: int) -> list:
+        """The day's summary plus as many of the newest messages as fit in max_tokens, in chronological order."""
+        if max_tokens not in self._langchain_history:
+            self._langchain_history[max_tokens] = convert_conversation_history_to_langchain_messages(self.conversation_history, max_tokens, self.summary)
+        return self._langchain_history[max_tokens]
+
+    def get_summary_boundary(self):
+        """
+        Messages sent before the returned time have left the largest history window and are due to be folded into the summary,
+        including any the turn didn't load because of MAX_TURN_HISTORY_MESSAGES. None while the whole history still fits.
+        """
+        recent_messages, older_messages = split_history_for_summary(self.conversation_history, MAX_HISTORY_TOKENS)
+        if older_messages and not recent_messages:
+            # not even the newest message fits; mongo keeps milliseconds, so this is just past it
+            return older_messages[0]["timestamp"] + timedelta(milliseconds=1)
+        if older_messages or len(self.conversation_history) >= MAX_TURN_HISTORY_MESSAGES:
+            return recent_messages[-1]["timestamp"]
+        return None
+
+    def set_update(self, update: dict):
+        """Keep the context in step after a tool writes the day's update."""
+        self.update = update
+
+async def build_turn_context(user_id: str, channel_id: str, message: str, reply_stream = None) -> TurnContext:
+    conversation_history, summary, update, github_token = await asyncio.gather(
+        get_messages_from_db(user_id, channel_id, max_number_of_messages_to_fetch=MAX_TURN_HISTORY_MESSAGES),
+        get_conversation_summary(user_id, channel_id),
+        get_standup_update(user_id),
+        get_github_token(user_id)
+    )
+    if summary:
+        conversation_history = [message for message in conversation_history if message["timestamp"] > summary["summarized_until"]]
+    return TurnContext(
+        user_id=user_id,
+        channel_id=channel_id,
+        message=message,
+        conversation_history=conversation_history,
+        summary=summary["summary"] if summary else None,
+        update=update,
+        github_token=github_token,
+        reply_stream=reply_stream
+    )
+
+def set_turn_context(context: TurnContext):
+    """Make the context visible to the tools called during this turn. Each Slack event runs in its own task, so turns don't see each other's context."""
+    _current_turn_context.set(context)
+
+def get_turn_context(user_id: str, channel_id: str):
+    """The current turn's context if it belongs to this user and channel, otherwise None so the caller falls back to Mongo."""
+    context = _current_turn_context.get()
+    if context and context.user_id == user_id and context.channel_id == channel_id:
+        return context
+    return None
@@ -1,3 +1,12 @@
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages.system import SystemMessage
+import tiktoken
+
+MESSAGE_TOKEN_OVERHEAD = 4
+# the largest history window any prompt gets; older messages of the day are folded into the rolling summary
+MAX_HISTORY_TOKENS = 1500
+# set by load_token_encoding at startup; until then, or if it couldn't be loaded, tokens are estimated from characters
+_token_encoding = None
 
 
 # def format_github_activity_to_slack(github_activity):
@@ -53,9 +62,84 @@ def format_github_activity_to_slack(github_activity):
 def format_standup_update_to_slack(standup_update):
     if isinstance(standup_update, str):
         return standup_update
-    if not standup_update.get('updates'):
+    updates = standup_update.get('updates')
+    # a daily_updates document wraps the extracted update, which has its own 'updates' list
+    if isinstance(updates, dict):
+        updates = updates.get('updates')
+    if not updates:
         return "No standup updates for today."
         
     return f"Here's your standup update:\n" + "\n".join([
-        f"- {u['item']} ({u['status']})" for u in standup_update['updates']
-    ])
\ No newline at end of file
+        f"- {u['item']} ({u['status']})" for u in updates
+    ])
+
+def format_team_blockers_to_slack(items):
+    if not items:
+        return "Nothing is blocked across the team right now."
+    lines = []
+    for item in items:
+        blockers = f": {', '.join(item['blockers'])}" if item['blockers'] else ""
+        lines.append(f"- <@{item['user_id']}> {item['item']} ({item['status']} since {item['status_since']}){blockers}")
+    return f"Blocked across the team ({len(items)}):\n" + "\n".join(lines)
+
+def format_stale_items_to_slack(items, status, days):
+    if not items:
+        return f"No items have been {status} for {days} days or more."
+    return f"Items {status} for {days} days or more ({len(items)}):\n" + "\n".join([
+        f"- <@{item['user_id']}> {item['item']} (since {item['status_since']})" for item in items
+    ])
+
+def convert_conversation_history_to_langchain_messages(conversation_history, max_tokens=None, summary=None):
+    """
+    Turn messages from get_messages_from_db (newest first) into LangChain messages in chronological order.
+    With max_tokens, keeps the newest messages that fit the budget and drops the rest. A summary of the
+    earlier part of the day is put in front of them and counts against the same budget.
+    """
+    budget = max_tokens if max_tokens is not None else float("inf")
+    messages = []
+    if summary:
+        summary_message = SystemMessage(content=f"Summary of the earlier conversation with the user today:\n{summary}")
+        budget -= count_message_tokens(summary_message.content)
+    for message in conversation_history:
+        budget -= count_message_tokens(message['message'])
+        if budget < 0:
+            break
+        if message.get('is_bot'):
+            messages.append(AIMessage(content=message['message']))
+        else:
+            messages.append(HumanMessage(content=message['message']))
+    messages.reverse()
+    if summary:
+        messages.insert(0, summary_message)
+    return messages
+
+def split_history_for_summary(conversation_history, keep_tokens):
+    """
+    Split newest-first history into the newest messages that fit keep_tokens and the older ones that should be
+    folded into the day's summary. Both parts stay newest first.
+    """
+    budget = keep_tokens
+    for index, message in enumerate(conversation_history):
+        budget -= count_message_tokens(message['message'])
+        if budget < 0:
+            return conversation_history[:index], conversation_history[index:]
+    return conversation_history, []
+
+def count_message_tokens(text):
+    """Approximate prompt tokens for one chat message, including the few tokens of per-message overhead."""
+    if not _token_encoding:
+        # roughly four characters per token for English text
+        return len(text or "") // 4 + 1 + MESSAGE_TOKEN_OVERHEAD
+    return len(_token_encoding.encode(text or "")) + MESSAGE_TOKEN_OVERHEAD
+
+def load_token_encoding():
+    """
+    Load the gpt-4o token encoding. tiktoken downloads it the first time, so this blocks;
+    run it off the event loop with asyncio.to_thread before the bot starts answering.
+    """
+    global _token_encoding
+    try:
+        _token_encoding = tiktoken.get_encoding("o200k_base") # gpt-4o family
+    except Exception as e:
+        print(f"could not load the token encoding, estimating tokens from characters: {e}")
+        _token_encoding = False
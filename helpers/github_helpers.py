@@ -1,14 +1,89 @@
 import os
-from datetime import datetime, timedelta
-import requests
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+from datetime import datetime, timedelta, timezone
+import httpx
 from urllib.parse import urlencode
 from dotenv import load_dotenv, find_dotenv
-from .mongo_db_helpers import get_github_token
+from .mongo_db_helpers import (
+    get_github_token, get_github_http_cache_entry, save_github_http_cache_entry, get_github_activity_snapshot, save_github_activity_snapshot,
+    get_github_tokens_without_login, save_github_login, get_slack_user_ids_by_github_login, save_github_activity_events, get_github_activity_events
+)
+from .metrics_helpers import timed, record_external_error, record_handled_error, record_github_http_cache
 
 load_dotenv(find_dotenv())
 
 GITHUB_CLIENT_ID = os.environ["GITHUB_CLIENT_ID"]
 GITHUB_REDIRECT_URI = os.environ["GITHUB_REDIRECT_URI"]
+GITHUB_API_URL = "https://api.github.com"
+GITHUB_MAX_CONCURRENT_REQUESTS = int(os.environ.get("GITHUB_MAX_CONCURRENT_REQUESTS", 10))
+# "rest" scans every repo, "graphql" asks contributionsCollection for the repos that actually had activity
+GITHUB_ACTIVITY_BACKEND = os.environ.get("GITHUB_ACTIVITY_BACKEND", "rest")
+GITHUB_MAX_RATE_LIMIT_WAIT = int(os.environ.get("GITHUB_MAX_RATE_LIMIT_WAIT", 60))
+GITHUB_HTTP_CACHE_MAX_ENTRIES = int(os.environ.get("GITHUB_HTTP_CACHE_MAX_ENTRIES", 5000))
+# a snapshot synced within this many seconds is served as is; an older one is synced before it is read
+GITHUB_SNAPSHOT_MAX_AGE_SECONDS = int(os.environ.get("GITHUB_SNAPSHOT_MAX_AGE_SECONDS", 1800))
+# an incremental sync starts this far before the cursor, for commits that are pushed a while after they were authored
+GITHUB_SNAPSHOT_SYNC_OVERLAP_MINUTES = int(os.environ.get("GITHUB_SNAPSHOT_SYNC_OVERLAP_MINUTES", 60))
+GITHUB_SNAPSHOT_SYNC_CONCURRENCY = int(os.environ.get("GITHUB_SNAPSHOT_SYNC_CONCURRENCY", 5))
+GITHUB_ACTIVITY_WINDOW = timedelta(hours=24)
+# "snapshot" polls GitHub into per-user snapshots, "webhooks" reads the events GitHub pushes to /github/webhook
+GITHUB_ACTIVITY_SOURCE = os.environ.get("GITHUB_ACTIVITY_SOURCE", "snapshot")
+GITHUB_WEBHOOK_SECRET = os.environ.get("GITHUB_WEBHOOK_SECRET")
+GITHUB_WEBHOOK_EVENTS = {"push", "pull_request", "pull_request_review"}
+GITHUB_NOT_CONNECTED_MESSAGE = "GitHub account not connected. Use /connect-github to connect your account."
+
+# one connection pool for the whole process so repeated calls reuse connections to api.github.com
+_http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(10.0, connect=5.0),
+    limits=httpx.Limits(max_connections=GITHUB_MAX_CONCURRENT_REQUESTS, max_keepalive_connections=GITHUB_MAX_CONCURRENT_REQUESTS)
+)
+# caps GitHub requests in flight across every user being fetched at once, so requests wait here for a connection
+# instead of queueing in the pool where they would run into its timeout
+_request_slots = asyncio.Semaphore(GITHUB_MAX_CONCURRENT_REQUESTS)
+
+CONTRIBUTIONS_QUERY = """
+query($from: DateTime!) {
+  viewer {
+    id
+    login
+    contributionsCollection(from: $from) {
+      commitContributionsByRepository(maxRepositories: 100) {
+        repository {
+          name
+          owner { login }
+        }
+      }
+      pullRequestContributions(first: 100) {
+        nodes {
+          pullRequest { title state url updatedAt repository { name } }
+        }
+      }
+      pullRequestReviewContributions(first: 100) {
+        nodes {
+          pullRequest { title state url updatedAt repository { name } }
+        }
+      }
+    }
+  }
+}
+"""
+
+REPO_HISTORY_FRAGMENT = """
+  {alias}: repository(owner: {owner}, name: {name}) {{
+    defaultBranchRef {{
+      target {{
+        ... on Commit {{
+          history(since: $since, author: {{id: $author}}, first: 100) {{
+            nodes {{ oid message authoredDate }}
+          }}
+        }}
+      }}
+    }}
+  }}"""
 
 def generate_github_oauth_url(state, channel_id):
     """Generate GitHub OAuth URL with state parameter."""
@@ -21,19 +96,240 @@ def generate_github_oauth_url(state, channel_id):
     }
     return f"https://github.com/login/oauth/authorize?{urlencode(params)}"
 
-def get_github_activity(slack_user_id, date=None):
-    """Get GitHub activity for a connected user."""
-    github_token = get_github_token(slack_user_id)
+async def get_github_activity(slack_user_id, date=None):
+    """
+    Get GitHub activity for a connected user. The last 24 hours come from the user's snapshot while it is fresh,
+    and a stale or missing snapshot is synced first; any other date is fetched live.
+    """
+    if date:
+        github_token = await get_github_token(slack_user_id)
+        if not github_token:
+            return GITHUB_NOT_CONNECTED_MESSAGE
+        return await _fetch_github_activity(github_token, date)
+
+    if GITHUB_ACTIVITY_SOURCE == "webhooks":
+        return await _get_github_activity_from_events(slack_user_id)
+
+    snapshot = await get_github_activity_snapshot(slack_user_id)
+    if snapshot and datetime.utcnow() - snapshot["synced_at"] < timedelta(seconds=GITHUB_SNAPSHOT_MAX_AGE_SECONDS):
+        return _snapshot_activity(snapshot, datetime.utcnow() - GITHUB_ACTIVITY_WINDOW)
+    return await _sync_github_activity_snapshot(slack_user_id, snapshot)
+
+async def sync_github_activity_snapshot(slack_user_id):
+    """Bring a user's activity snapshot up to date. Returns the activity, or why it couldn't be fetched."""
+    return await _sync_github_activity_snapshot(slack_user_id, await get_github_activity_snapshot(slack_user_id))
+
+async def sync_github_activity_snapshots(user_ids):
+    """Sync the snapshots of many users, a few at a time. Returns how many synced and how many failed."""
+    semaphore = asyncio.Semaphore(GITHUB_SNAPSHOT_SYNC_CONCURRENCY)
+
+    async def sync(user_id):
+        async with semaphore:
+            try:
+                return not isinstance(await sync_github_activity_snapshot(user_id), str)
+            except Exception as e:
+                print(f"Error syncing GitHub activity for {user_id}: {e}")
+                record_handled_error("github_snapshot_sync")
+                return False
+
+    results = await asyncio.gather(*[sync(user_id) for user_id in user_ids])
+    return {"synced": sum(results), "failed": len(results) - sum(results)}
+
+async def _sync_github_activity_snapshot(slack_user_id, snapshot):
+    """
+    Fetch only the activity since the snapshot's cursor, the newest commit time or PR updated_at seen so far,
+    merge it into the snapshot and drop whatever has fallen out of the last 24 hours.
+    """
+    github_token = await get_github_token(slack_user_id)
     if not github_token:
-        return "GitHub account not connected. Use /connect-github to connect your account."
-    
+        return GITHUB_NOT_CONNECTED_MESSAGE
+
+    now = datetime.utcnow()
+    window_start = now - GITHUB_ACTIVITY_WINDOW
+    since = window_start
+    if snapshot and snapshot.get("cursor"):
+        since = max(since, snapshot["cursor"] - timedelta(minutes=GITHUB_SNAPSHOT_SYNC_OVERLAP_MINUTES))
+    # truncate to the hour so the commits URL stays the same between syncs and can be served from the ETag cache
+    since = since.replace(minute=0, second=0, microsecond=0)
+
+    try:
+        activity = await _fetch_github_activity(github_token, since.strftime('%Y-%m-%dT%H:%M:%SZ'))
+    except httpx.HTTPError as e:
+        # a timeout or connection error is handled like an error response
+        print(f"Error syncing GitHub activity for {slack_user_id}: {e!r}")
+        record_handled_error("github_snapshot_sync")
+        activity = "Error accessing GitHub account"
+    if isinstance(activity, str):
+        # an older snapshot still beats no activity at all
+        return _snapshot_activity(snapshot, window_start) if snapshot else activity
+
+    previous = _snapshot_activity(snapshot, window_start) if snapshot else {'commits': [], 'pull_requests': []}
+    commits = _merge_activity(previous['commits'], activity['commits'], lambda commit: commit['sha'])
+    pull_requests = _merge_activity(previous['pull_requests'], activity['pull_requests'], lambda pr: pr['url'])
+
+    seen = [_parse_github_time(commit['timestamp']) for commit in commits] + [_parse_github_time(pr['updated_at']) for pr in pull_requests]
+    cursor = max(seen + ([snapshot["cursor"]] if snapshot and snapshot.get("cursor") else []), default=now)
+    await save_github_activity_snapshot(slack_user_id, commits, pull_requests, cursor, now)
+    return {
+        'commits': commits,
+        'pull_requests': pull_requests
+    }
+
+async def _get_github_activity_from_events(slack_user_id):
+    """The last 24 hours of webhook events for a user, in the shape get_github_activity returns, from one indexed range query."""
+    events = await get_github_activity_events(slack_user_id, datetime.utcnow() - GITHUB_ACTIVITY_WINDOW)
+    if not events and not await get_github_token(slack_user_id):
+        return GITHUB_NOT_CONNECTED_MESSAGE
+
+    commits = {}
+    pull_requests = {}
+    # oldest first, so the latest event for a PR decides its state
+    for event in events:
+        if event['type'] == 'commit':
+            commits[event['sha']] = {
+                'repo': event['repo'],
+                'sha': event['sha'],
+                'message': event['message'],
+                'timestamp': event['timestamp']
+            }
+        else:
+            pull_requests[event['url']] = {
+                'repo': event['repo'],
+                'title': event['title'],
+                'state': event['state'],
+                'url': event['url'],
+                'updated_at': event['timestamp']
+            }
+    return {
+        'commits': list(commits.values()),
+        'pull_requests': list(pull_requests.values())
+    }
+
+def verify_github_webhook_signature(body: bytes, signature: str) -> bool:
+    """Check the X-Hub-Signature-256 header against the HMAC of the raw body with GITHUB_WEBHOOK_SECRET."""
+    if not GITHUB_WEBHOOK_SECRET or not signature:
+        return False
+    expected = "sha256=" + hmac.new(GITHUB_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+async def ingest_github_webhook(event_name: str, payload: dict) -> int:
+    """Store the activity in a push, pull_request or pull_request_review delivery. Returns how many events were new."""
+    events = _parse_github_webhook(event_name, payload)
+    if not events:
+        return 0
+    slack_user_ids = await get_slack_user_ids_by_github_login({event['github_login'] for event in events})
+    for event in events:
+        event['slack_user_id'] = slack_user_ids.get(event['github_login'])
+    return await save_github_activity_events(events)
+
+def _parse_github_webhook(event_name, payload):
+    """
+    One activity event per commit, PR change or review in a delivery. The _id is derived from the activity itself
+    rather than the delivery, so the same commit pushed to two branches or a redelivered webhook is stored once.
+    """
+    if event_name not in GITHUB_WEBHOOK_EVENTS or 'repository' not in payload:
+        return []
+    repo = payload['repository']['name']
+    sender = payload.get('sender', {}).get('login')
+
+    if event_name == 'push':
+        return [{
+            '_id': f"commit:{commit['id']}",
+            'type': 'commit',
+            # the pusher isn't always the author; fall back to them when the author has no GitHub account
+            'github_login': (commit.get('author') or {}).get('username') or sender,
+            'repo': repo,
+            'sha': commit['id'],
+            'message': commit['message'],
+            'timestamp': commit['timestamp'],
+            'occurred_at': _parse_github_time(commit['timestamp'])
+        } for commit in payload.get('commits', [])]
+
+    pr = payload['pull_request']
+    if event_name == 'pull_request':
+        timestamp = pr['updated_at']
+        event_id = f"pull_request:{pr['id']}:{payload['action']}:{timestamp}"
+        # credit the PR's author; the sender is whoever triggered the change, e.g. a reviewer closing or merging it
+        github_login = (pr.get('user') or {}).get('login') or sender
+    else:
+        review = payload['review']
+        timestamp = review.get('submitted_at') or pr['updated_at']
+        event_id = f"pull_request_review:{review['id']}:{payload['action']}"
+        github_login = review['user']['login']
+    return [{
+        '_id': event_id,
+        'type': event_name,
+        'action': payload['action'],
+        'github_login': github_login,
+        'repo': repo,
+        'title': pr['title'],
+        'state': pr['state'],
+        'url': pr['html_url'],
+        'timestamp': timestamp,
+        'occurred_at': _parse_github_time(timestamp)
+    }]
+
+async def sync_github_login(slack_user_id, github_token):
+    """
+    Look up and store the GitHub login behind a token, so webhook events can be matched to the Slack user.
+    Returns None if it couldn't be looked up, including on a timeout or connection error, so one slow token doesn't fail a backfill.
+    """
+    headers = {
+        'Authorization': f'token {github_token}',
+        'Accept': 'application/vnd.github.v3+json'
+    }
+    try:
+        response = await _cached_get(f'{GITHUB_API_URL}/user', headers)
+    except httpx.HTTPError as e:
+        print(f"Error looking up the GitHub login for {slack_user_id}: {e!r}")
+        record_handled_error("github_login")
+        return None
+    if response.status_code != 200:
+        print(f"Error looking up the GitHub login for {slack_user_id}: {response.status_code}")
+        return None
+    github_login = response.json()['login']
+    await save_github_login(slack_user_id, github_login)
+    return github_login
+
+async def backfill_github_logins():
+    """Look up the GitHub login of every token stored before logins were. Returns how many were found."""
+    tokens = await get_github_tokens_without_login()
+    semaphore = asyncio.Semaphore(GITHUB_SNAPSHOT_SYNC_CONCURRENCY)
+
+    async def sync(token):
+        async with semaphore:
+            return await sync_github_login(token['slack_user_id'], token['github_token'])
+
+    logins = await asyncio.gather(*[sync(token) for token in tokens])
+    return sum(1 for login in logins if login)
+
+def _snapshot_activity(snapshot, window_start):
+    """The snapshot's commits and PRs that are still inside the window."""
+    return {
+        'commits': [commit for commit in snapshot['commits'] if _parse_github_time(commit['timestamp']) >= window_start],
+        'pull_requests': [pr for pr in snapshot['pull_requests'] if _parse_github_time(pr['updated_at']) >= window_start]
+    }
+
+def _merge_activity(previous, new, key):
+    """previous with new added; an item already in previous is replaced by its newer copy."""
+    merged = {key(item): item for item in previous}
+    merged.update((key(item), item) for item in new)
+    return list(merged.values())
+
+async def _fetch_github_activity(github_token, date=None):
     headers = {
         'Authorization': f'token {github_token}',
         'Accept': 'application/vnd.github.v3+json'
     }
     
+    if GITHUB_ACTIVITY_BACKEND == "graphql":
+        return await _get_github_activity_graphql(headers, date)
+    return await _get_github_activity_rest(headers, date)
+
+async def _get_github_activity_rest(headers, date=None):
+    """Scan every repo the user can access through the REST API."""
     # Get user information
-    user_response = requests.get('https://api.github.com/user', headers=headers)
+    user_response = await _cached_get(f'{GITHUB_API_URL}/user', headers)
     if user_response.status_code != 200:
         return "Error accessing GitHub account"
     
@@ -41,55 +337,249 @@ def get_github_activity(slack_user_id, date=None):
     username = user_data['login']
     
     # Get user's repositories
-    repos_response = requests.get('https://api.github.com/user/repos', headers=headers)
-    if repos_response.status_code != 200:
+    repos = await _get_all_pages(f'{GITHUB_API_URL}/user/repos', headers, {'per_page': 100})
+    if repos is None:
         return "Error accessing repositories"
     
-    recent_commits = []
-    recent_prs = []
-    since_date = date if date else (datetime.now() - timedelta(hours=24)).isoformat()
+    # truncate to the hour so the commits URL stays the same between calls and can be served from the cache
+    since_date = date if date else (datetime.utcnow() - GITHUB_ACTIVITY_WINDOW).replace(minute=0, second=0, microsecond=0).strftime('%Y-%m-%dT%H:%M:%SZ')
+    # fan out per repo; _request_slots keeps the number of requests in flight bounded
+    repo_activity = await asyncio.gather(*[
+        _get_repo_activity(repo, username, since_date, headers) for repo in repos
+    ])
     
-    for repo in repos_response.json():
-        repo_name = repo['name']
-        repo_full_name = repo['full_name']
-        
-        # Get commits
-        commits_url = f'https://api.github.com/repos/{repo_full_name}/commits'
-        commits_params = {
-            'author': username,
-            'since': since_date
-        }
-        commits_response = requests.get(commits_url, headers=headers, params=commits_params)
-        
-        if commits_response.status_code == 200:
-            for commit in commits_response.json():
-                recent_commits.append({
-                    'repo': repo_name,
-                    'message': commit['commit']['message'],
-                    'timestamp': commit['commit']['author']['date']
-                })
-        
-        # Get PRs
-        prs_url = f'https://api.github.com/repos/{repo_full_name}/pulls'
-        prs_params = {
-            'state': 'all',
-            'sort': 'updated',
-            'direction': 'desc'
-        }
-        prs_response = requests.get(prs_url, headers=headers, params=prs_params)
-        
-        if prs_response.status_code == 200:
-            for pr in prs_response.json():
-                pr_updated = datetime.strptime(pr['updated_at'], '%Y-%m-%dT%H:%M:%SZ')
-                if pr_updated > datetime.now() - timedelta(days=1):
-                    recent_prs.append({
-                        'repo': repo_name,
-                        'title': pr['title'],
-                        'state': pr['state'],
-                        'url': pr['html_url']
-                    })
+    recent_commits = [commit for commits, _ in repo_activity for commit in commits]
+    recent_prs = [pr for _, prs in repo_activity for pr in prs]
     
     return {
         'commits': recent_commits,
         'pull_requests': recent_prs
-    }
\ No newline at end of file
+    }
+
+async def _get_github_activity_graphql(headers, date=None):
+    """
+    Get the user's activity from contributionsCollection in at most two GraphQL round-trips:
+    one for the repos with commits and the PRs opened or reviewed, and one for the commit messages of those repos.
+    """
+    since_date = date if date else (datetime.utcnow() - GITHUB_ACTIVITY_WINDOW).replace(microsecond=0).isoformat() + "Z"
+    contributions = await _graphql(CONTRIBUTIONS_QUERY, {"from": since_date}, headers)
+    if contributions is None:
+        return "Error accessing GitHub account"
+
+    viewer = contributions["viewer"]
+    collection = viewer["contributionsCollection"]
+
+    recent_prs = []
+    seen_pr_urls = set()
+    for contribution in collection["pullRequestContributions"]["nodes"] + collection["pullRequestReviewContributions"]["nodes"]:
+        pr = contribution["pullRequest"]
+        if pr["url"] in seen_pr_urls:
+            continue
+        seen_pr_urls.add(pr["url"])
+        recent_prs.append({
+            'repo': pr["repository"]["name"],
+            'title': pr["title"],
+            # match the REST states, where a merged PR is just closed
+            'state': "open" if pr["state"] == "OPEN" else "closed",
+            'url': pr["url"],
+            'updated_at': pr["updatedAt"]
+        })
+
+    repos = [contribution["repository"] for contribution in collection["commitContributionsByRepository"]]
+    if not repos:
+        return {
+            'commits': [],
+            'pull_requests': recent_prs
+        }
+
+    # alias one history lookup per repo so all commit messages come back in a single request
+    history_query = "query($since: GitTimestamp!, $author: ID!) {\n" + "\n".join(
+        REPO_HISTORY_FRAGMENT.format(alias=f"repo{index}", owner=json.dumps(repo["owner"]["login"]), name=json.dumps(repo["name"]))
+        for index, repo in enumerate(repos)
+    ) + "\n}"
+    histories = await _graphql(history_query, {"since": since_date, "author": viewer["id"]}, headers)
+    if histories is None:
+        return "Error accessing repositories"
+
+    recent_commits = []
+    for index, repo in enumerate(repos):
+        branch = (histories.get(f"repo{index}") or {}).get("defaultBranchRef")
+        if not branch:
+            continue
+        for commit in branch["target"]["history"]["nodes"]:
+            recent_commits.append({
+                'repo': repo["name"],
+                'sha': commit["oid"],
+                'message': commit["message"],
+                'timestamp': commit["authoredDate"]
+            })
+
+    return {
+        'commits': recent_commits,
+        'pull_requests': recent_prs
+    }
+
+async def _graphql(query, variables, headers):
+    """POST a GraphQL query and return its data, or None if the request or the query failed."""
+    try:
+        async with _request_slots:
+            with timed("github", "graphql"):
+                response = await _http_client.post(f'{GITHUB_API_URL}/graphql', headers=headers, json={"query": query, "variables": variables})
+    except httpx.HTTPError as e:
+        print(f"Error querying GitHub GraphQL: {e!r}")
+        return None
+    if response.status_code != 200:
+        record_external_error("github", "graphql")
+        return None
+    payload = response.json()
+    if payload.get("errors"):
+        print("GitHub GraphQL errors: ", payload["errors"])
+        return None
+    return payload["data"]
+
+async def _get_repo_activity(repo, username, since_date, headers):
+    """Get the commits and PRs for a single repo since the given date."""
+    repo_name = repo['name']
+    repo_full_name = repo['full_name']
+    
+    # Get commits
+    commits_url = f'{GITHUB_API_URL}/repos/{repo_full_name}/commits'
+    commits_params = {
+        'author': username,
+        'since': since_date,
+        'per_page': 100
+    }
+    
+    # Get PRs
+    prs_url = f'{GITHUB_API_URL}/repos/{repo_full_name}/pulls'
+    prs_params = {
+        'state': 'all',
+        'sort': 'updated',
+        'direction': 'desc',
+        'per_page': 100
+    }
+    cutoff = _parse_github_time(since_date)
+    
+    commits, prs = await asyncio.gather(
+        _get_all_pages(commits_url, headers, commits_params),
+        # PRs come back newest first, so stop paging once a page reaches PRs older than the cutoff
+        _get_all_pages(prs_url, headers, prs_params, stop=lambda page: _pr_updated_at(page[-1]) <= cutoff)
+    )
+    
+    recent_commits = [{
+        'repo': repo_name,
+        'sha': commit['sha'],
+        'message': commit['commit']['message'],
+        'timestamp': commit['commit']['author']['date']
+    } for commit in commits or []]
+    
+    # the pulls endpoint lists everyone's PRs in the repo; only the user's own are their activity, as in contributionsCollection
+    recent_prs = [{
+        'repo': repo_name,
+        'title': pr['title'],
+        'state': pr['state'],
+        'url': pr['html_url'],
+        'updated_at': pr['updated_at']
+    } for pr in prs or [] if _pr_updated_at(pr) > cutoff and _pr_author(pr) == username.lower()]
+    
+    return recent_commits, recent_prs
+
+async def _get_all_pages(url, headers, params=None, stop=None):
+    """
+    GET a GitHub list endpoint and follow its Link rel="next" pagination.
+    Returns None if the first page fails, otherwise the items of every page fetched.
+    A timeout or connection error counts as a failed page, so one slow repo doesn't fail the whole fetch.
+    """
+    items = []
+    while url:
+        try:
+            response = await _cached_get(url, headers, params)
+        except httpx.HTTPError as e:
+            print(f"Error fetching {httpx.URL(url).path} from GitHub: {e!r}")
+            record_handled_error("github_page")
+            return items if items else None
+        if response.status_code != 200:
+            return items if items else None
+        page = response.json()
+        items.extend(page)
+        if not page or (stop and stop(page)):
+            break
+        # the next link already carries the query string
+        url = response.links.get('next', {}).get('url')
+        params = None
+    return items
+
+async def _cached_get(url, headers, params=None):
+    """
+    GET a GitHub URL, revalidating any cached copy with If-None-Match / If-Modified-Since.
+    A 304 is turned back into a 200 built from the cached body so callers don't need to know about the cache.
+    """
+    url = httpx.URL(url, params=params)
+    token_hash = hashlib.sha256(headers['Authorization'].encode()).hexdigest()
+    cache_key = hashlib.sha256(f"{token_hash}:{url}".encode()).hexdigest()
+    cached = await get_github_http_cache_entry(cache_key)
+
+    request_headers = dict(headers)
+    if cached and cached.get("etag"):
+        request_headers['If-None-Match'] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        request_headers['If-Modified-Since'] = cached["last_modified"]
+
+    # label by the last path segment (user, repos, commits, pulls) so repo names don't become labels
+    operation = url.path.rsplit('/', 1)[-1]
+    async with _request_slots:
+        with timed("github", operation):
+            response = await _http_client.get(url, headers=request_headers)
+    # each token has its own rate limit; wait out a secondary or exhausted limit once instead of failing the user
+    retry_after = _get_rate_limit_wait(response)
+    if retry_after is not None:
+        print(f"GitHub rate limit hit for {url.path}, retrying in {retry_after}s")
+        await asyncio.sleep(retry_after)
+        async with _request_slots:
+            with timed("github", operation):
+                response = await _http_client.get(url, headers=request_headers)
+    if response.status_code >= 400:
+        record_external_error("github", operation)
+
+    if response.status_code == 304 and cached:
+        record_github_http_cache(True, cached["size"])
+        return httpx.Response(200, json=cached["body"], headers={'Link': cached["link"]} if cached["link"] else None)
+
+    record_github_http_cache(False)
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if response.status_code == 200 and (etag or last_modified):
+        await save_github_http_cache_entry(
+            cache_key,
+            etag,
+            last_modified,
+            response.headers.get('Link'),
+            response.json(),
+            len(response.content),
+            GITHUB_HTTP_CACHE_MAX_ENTRIES
+        )
+    return response
+
+def _get_rate_limit_wait(response):
+    """Seconds to wait before retrying a rate limited response, or None if it wasn't rate limited or the wait is too long."""
+    if response.status_code not in (403, 429):
+        return None
+    if 'Retry-After' in response.headers:
+        wait = int(response.headers['Retry-After'])
+    elif response.headers.get('X-RateLimit-Remaining') == '0' and 'X-RateLimit-Reset' in response.headers:
+        wait = max(int(response.headers['X-RateLimit-Reset']) - int(time.time()), 0) + 1
+    else:
+        return None
+    return wait if wait <= GITHUB_MAX_RATE_LIMIT_WAIT else None
+
+def _pr_updated_at(pr):
+    return _parse_github_time(pr['updated_at'])
+
+def _pr_author(pr):
+    # logins are case-insensitive
+    return ((pr.get('user') or {}).get('login') or '').lower()
+
+def _parse_github_time(value):
+    """A GitHub timestamp as a naive UTC datetime, the form mongo hands datetimes back in."""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None) if parsed.tzinfo else parsed
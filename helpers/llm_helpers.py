@@ -1,4 +1,4 @@
-from langchain_core.prompts.chat import ChatPromptTemplate
+from langchain_core.prompts.chat import ChatPromptTemplate, MessagesPlaceholder
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
 from langchain_core.messages import HumanMessage, AIMessage
@@ -7,21 +7,85 @@ from dotenv import find_dotenv, load_dotenv
 import os
 import json
 from datetime import datetime, timedelta
-from .mongo_db_helpers import get_standup_updates_by_user_id, get_messages_from_db, update_exists
+from langchain_core.caches import BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration
+import asyncio
+import hashlib
+import time
+from contextvars import ContextVar
+from .mongo_db_helpers import get_standup_updates_by_user_id, get_standup_update, get_messages_from_db, get_llm_cache_entry, save_llm_cache_entry, clear_llm_cache, get_conversation_summary, save_conversation_summary, get_messages_to_summarize
 from .github_helpers import get_github_activity, get_github_token
-from .format_helpers import format_github_activity_to_slack, format_standup_update_to_slack
+from .format_helpers import format_github_activity_to_slack, format_standup_update_to_slack, convert_conversation_history_to_langchain_messages
+from .context_helpers import get_turn_context, MAX_TURN_HISTORY_MESSAGES
+from .metrics_helpers import timed, record_handled_error, record_llm_usage, record_llm_cache
 
 load_dotenv(find_dotenv())
 
+STANDUP_DRAFT_MAX_CONCURRENCY = int(os.environ.get("STANDUP_DRAFT_MAX_CONCURRENCY", 10))
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() == "true"
+# messages folded into the conversation summary per LLM call
+CONVERSATION_SUMMARY_BATCH_MESSAGES = int(os.environ.get("CONVERSATION_SUMMARY_BATCH_MESSAGES", 50))
+
+# when the current call's cache lookup missed, so aupdate can record how long the real call took. LangChain looks up and
+# updates the cache in the same coroutine, and a call that raises leaves nothing behind for the next call to trip over
+_cache_miss_started_at = ContextVar("cache_miss_started_at", default=None)
+
+class MongoLLMCache(BaseCache):
+    """
+    LangChain cache backed by the llm_cache collection. The model runs at temperature 0, so identical prompts give identical answers.
+    LangChain builds the key from the serialized messages and an llm_string that carries the model params and any bound tool schemas.
+    Entries expire through the collection's TTL index. Only the async methods are implemented since the bot only calls ainvoke.
+    Hits, misses and the LLM latency saved by hits are served from /metrics.
+    """
+
+    def _cache_key(self, prompt, llm_string):
+        return hashlib.sha256(f"{llm_string}:{prompt}".encode()).hexdigest()
+
+    def lookup(self, prompt, llm_string):
+        return None
+
+    def update(self, prompt, llm_string, return_val):
+        pass
+
+    def clear(self, **kwargs):
+        pass
+
+    async def alookup(self, prompt, llm_string):
+        entry = await get_llm_cache_entry(self._cache_key(prompt, llm_string))
+        if entry is None:
+            record_llm_cache(False)
+            _cache_miss_started_at.set(time.perf_counter())
+            return None
+        record_llm_cache(True, entry["latency"])
+        return [ChatGeneration(message=message) for message in messages_from_dict(entry["generations"])]
+
+    async def aupdate(self, prompt, llm_string, return_val):
+        start = _cache_miss_started_at.get()
+        _cache_miss_started_at.set(None)
+        latency = time.perf_counter() - start if start else 0.0
+        await save_llm_cache_entry(self._cache_key(prompt, llm_string), [message_to_dict(generation.message) for generation in return_val], latency)
+
+    async def aclear(self, **kwargs):
+        await clear_llm_cache()
+
+llm_cache = MongoLLMCache()
+
 llm = ChatOpenAI(
     model="gpt-4o-mini",
     temperature=0,
     max_tokens=None,
     timeout=None,
     max_retries=2,
-    api_key=os.environ["OPENAI_API_KEY"]
+    api_key=os.environ["OPENAI_API_KEY"],
+    # include token usage in streamed responses too, so cached prompt tokens can be reported for streamed replies
+    stream_usage=True,
+    cache=llm_cache if LLM_CACHE_ENABLED else None
 )
 
+# same model with the cache switched off, for calls made with use_cache=False
+uncached_llm = llm.model_copy(update={"cache": False})
+
 # llm = ChatAnthropic(
 #     model="claude-3-5-sonnet-20240620",
 #     temperature=0,
@@ -30,38 +94,10 @@ llm = ChatOpenAI(
 #     max_retries=2
 # )
 
-def create_standup_update(text: str, user_id: str, channel_id: str) -> dict:
-    """
-    Given a user's standup update and conversation history, extract the key insights from the update if and only ifthe update has sufficient information.
-    Uses the conversation history if needed to piece together the user's standup update.
-    Only use this tool if there is no update already in the database and if there is sufficient information to update, delete, or add a given item.
-    """
-    prompt_with_day_differentiation = """
-        You are a project manager that listens to standup updates from developers and extracts their key insights.
-            
-        Your goal is to take what developers are saying about their tasks and extract all updates. You will be given a conversation history between you and the user.
-            
-        Here are some important rules to follow:
-        1. You may be given github activity and linear activity within your conversation history. Use either the PR number, ticket number, or linear ticket number to define the item field.
-        2. You can use the linear ticket status or github PR status to define the status field. The status should be one of NOT_STARTED, IN_PROGRESS, REJECTED, COMPLETED, IN_REVIEW, OR BLOCKED. Use your best judgment to determine.
-        3. Identify the user's writing style and tone and summarize it in one word (e.g. Paragraph, Bullet points, etc.)
-        4. If the user's update applies to the previous day, add it to the "yesterday" field. If the user's update applies to the current day, add it to the "today" field.
-        5. If no update exists for either today or yesterday, add set that corresponding "today" or "yesterday" field to an empty array.
-        6. You are given conversation history between you and the user. Use this conversation history to determine if the user has provided sufficient information to craft a response.
-        7. Return your response in JSON with the following structure: {{\"preferred_style\": \"Paragraph\", \"updates\": {\"yesterday\": [{{\"item\": \"task-1\", \"status\": \"IN_PROGRESS\", \"identified_blockers\": []}}, {{\"item\": \"task-2\", \"status\": \"BLOCKED\", \"identified_blockers\": [\"waiting on team-1\", \"task-4\"]}}], \"today\": [{{\"item\": \"task-3\", \"status\": \"IN_PROGRESS\", \"identified_blockers\": []}}, {{\"item\": \"task-4\", \"status\": \"REJECTED\", \"identified_blockers\": []}}]}}}
-        8. Only use valid JSON. Do not format it with ```json.
-
-        Example:
-        INPUT
-        - I raised a PR for task-1. I am working on raising a PR for fixing the counter button bug. 
-        - I pushed the fix for task-3 to production so we can close that out.
-        - Task-4 is currently blocked while we wait for task-5 to be completed
+# prompts are compiled once at import. Static instructions go first and the user's history, data and message last,
+# so calls share the longest possible prefix and the provider's prompt caching can serve it
 
-        OUTPUT
-        {{\"preferred_style\": \"Bullet points\", \"updates\": {{\"yesterday\": [{{\"item\": \"task-1\", \"status\": \"IN_REVIEW\", \"identified_blockers\": []}}, {{\"item\": \"task-3\", \"status\": \"COMPLETED\", \"identified_blockers\": []}}], \"today\": [{{\"item\": \"counter button bug\", \"status\": \"IN_PROGRRESS\", \"identified_blockers\": []}}, {{\"item\": \"task-4\", \"status\": \"BLOCKED\", \"identified_blockers\": [\"task-5\"]}}]}}}}
-        """
-
-    prompt_without_day_differentiation = """
+CREATE_STANDUP_UPDATE_INSTRUCTIONS = """
             You are a project manager that listens to standup updates from developers and extracts their key insights.
                 
             Your goal is to take what developers are saying and extract all updates.
@@ -103,70 +139,24 @@ def create_standup_update(text: str, user_id: str, channel_id: str) -> dict:
                 ]
             }}
             """
-    messages = [
-        # TODO: add conversation history if the user does not have an update in the database
-        # TODO: Update this to only give the standup update scheduled message and the user's reply after that?
-        *convert_conversation_history_to_langchain_messages(get_messages_from_db(user_id, channel_id, max_number_of_messages_to_fetch=4)),
-        SystemMessage(prompt_without_day_differentiation),
-        HumanMessage(content=text)
-    ]
-    prompt = ChatPromptTemplate.from_messages(messages)
-    formatted_prompt = prompt.format(user_id=user_id, text=text)
-    response = llm.invoke(formatted_prompt)
-    print("response from create standup update: ", response)
-    return json.loads(response.content)
-
-def make_edits_to_update(update_exists: bool, text: str, user_id: str, channel_id: str) -> dict:
-    """
-    Make edits to the user's standup update based on the conversation history and the user's reply. Uses conversation history to make inferences on the user's desired updates. Only make edits if there is sufficient information to make edits.
-    """
-    update = get_standup_updates_by_user_id(user_id)[0]["updates"] if update_exists else False
-    if not update:
-        print("make edits to update called but no update exists")
-        return ask_question_response(user_id, channel_id, text)
-    chat_history = get_messages_from_db(user_id, channel_id, max_number_of_messages_to_fetch=4)
-    formatted_chat_history = convert_conversation_history_to_langchain_messages(chat_history)
-    prompt_with_day_differentiation = """
-        You are a project manager that listens to standup updates from developers and makes edits to their updates.
-            
-        Your goal is to take what developers are saying and make edits to an update that you will be provided.
-            
-        Here are some important rules to follow:
-        1. Make edits to the user's standup update. You can make any changes you see fit.
-        2. Analyze whether the user's update applies to the previous day or is an update for the current day. You can use the conversation context and even their grammar to determine this.
-        3. If you notice changes in their preferred writing style, update the preferred style in the provided update. (Something like Paragraph, Bullet points, etc.)
-        4. Valid statuses are NOT_STARTED, IN_PROGRESS, REJECTED, IN_REVIEW, COMPLETED, BLOCKED. Use your best judgment to determine the status.
-        5. Return the response in JSON format, following the same structure as the update provided below.
-        6. Do not make up any information or tasks. Only make edits to the information provided.
-        7. Only update tasks that need updating. Do not edit any other tasks that the user has not mentioned.
-
-        START EXAMPLE:
-        INPUT
-        Update: {{\"preferred_style\": \"Paragraph\", \"updates\": {{\"yesterday\": [{{\"item\": \"task-1\", \"status\": \"IN_PROGRESS\", \"identified_blockers\": []}}, {{\"item\": \"task-2\", \"status\": \"BLOCKED\", \"identified_blockers\": [\"waiting on team-1\", \"task-4\"]}}], \"today\": []}}}}
-        Human: I actually finished task-1. task-2 is also unblocked now because team-1 has responded. I have also picked up task-3 now. task-4 is on my board but isn't our problem.
-            
-        OUTPUT
-        {{\"preferred_style\": \"Paragraph\", \"updates\": {{\"yesterday\": [{{\"item\": \"task-1\", \"status\": \"COMPLETED\", \"identified_blockers\": []}}, {{\"item\": \"task-2\", \"status\": \"IN_PROGRESS\", \"identified_blockers\": []}}], \"today\": [{{\"item\": \"task-3\", \"status\": \"IN_PROGRESS\", \"identified_blockers\": []}}, {{\"item\": \"task-4\", \"status\": \"REJECTED\", \"identified_blockers\": []}}]}}}}
-
-        END EXAMPLE
 
-        Update: 
-        {update}
-
-        Remember to ensure the response is in JSON format and do not format it with ```json.
-        """
+CREATE_STANDUP_UPDATE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", CREATE_STANDUP_UPDATE_INSTRUCTIONS),
+    MessagesPlaceholder("history"),
+    ("human", "{text}")
+])
 
-    prompt_without_day_differentiation = """
+MAKE_EDITS_TO_UPDATE_INSTRUCTIONS = """
         You are a project manager that listens to standup updates from developers and makes edits to their updates.
             
-        Your goal is to take what developers are saying and make edits to an update that you will be provided.
+        Your goal is to take what developers are saying and make edits to an update that you will be provided after the conversation history.
             
         Here are some important rules to follow:
         1. Identify tasks that need updating or add new tasks if they are not already in the update.
         2. If you notice changes in their preferred writing style, update the preferred style in the provided update. (Something like Paragraph, Bullet points, etc.)
         3. Add or remove any information that you deem necessary given the user's reply.
         4. Valid statuses are NOT_STARTED, IN_PROGRESS, IN_REVIEW, REJECTED, COMPLETED, and BLOCKED. Use your best judgment to determine the status.
-        5. Return the response in JSON format, following the same structure as the update provided below.
+        5. Return the response in JSON format, following the same structure as the update provided.
         6. Do not make up any information or tasks. Only make edits to the information provided.
 
         START EXAMPLE:
@@ -178,37 +168,16 @@ def make_edits_to_update(update_exists: bool, text: str, user_id: str, channel_i
         {{\"preferred_style\": \"Paragraph\", \"updates\": [{{\"item\": \"task-1\",\"status\": \"COMPLETED\",\"identified_blockers\": []}}, {{\"item\": \"task-2\",\"status\": \"IN_PROGRESS\",\"identified_blockers\": []}}, {{\"item\": \"task-3\",\"status\": \"IN_PROGRESS\",\"identified_blockers\": []}}, {{\"item\": \"task-4\",\"status\": \"REJECTED\",\"identified_blockers\": []}}]}}
         
         END EXAMPLE
+        """
 
-        Here is the current standup update that you will be editing as needed:
-        {update}
-
-        Remember to ensure the response is in JSON format and do not format it with ```json.
-        """.format(update=update)
-    messages = [
-        *formatted_chat_history,
-        SystemMessage(
-            prompt_without_day_differentiation
-        ),
-        HumanMessage(content=text)
-    ]
-    prompt = ChatPromptTemplate.from_messages(messages)
-    formatted_prompt = prompt.format(update=update, user_id=user_id, text=text)
-    response = llm.invoke(formatted_prompt)
-    return json.loads(response.content)
+MAKE_EDITS_TO_UPDATE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", MAKE_EDITS_TO_UPDATE_INSTRUCTIONS),
+    MessagesPlaceholder("history"),
+    ("system", "Here is the current standup update that you will be editing as needed:\n{update}\n\nRemember to ensure the response is in JSON format and do not format it with ```json."),
+    ("human", "{text}")
+])
 
-def ask_question_response(user_id: str, channel_id: str, message: str) -> str:
-    """
-    Responds to the user with appropriate clarifying questions when their standup update is missing information, is vague or unclear, or if more details are needed to understand the update.
-    """
-    # """
-    # Responds to the user with appropriate clarifying questions when their standup update is missing information, is vague or unclear, or if more details are needed to understand the update.
-    # Use this tool when there is missing updates about about the current day or if the user is starting a conversation and no standup update exists.
-    # """
-    conversation_history = get_messages_from_db(user_id, channel_id, max_number_of_messages_to_fetch=6)
-    formatted_conversation_history = convert_conversation_history_to_langchain_messages(conversation_history)
-    messages = [
-        SystemMessage(
-            """
+ASK_QUESTION_INSTRUCTIONS = """
             You are a project manager whose goal is to read a standup update from a software developer and respond to the message in a professional manner.
             For example, if the user says "Can you update task-1 and task-2", you should respond with "Can you provide more details about the status of task-1 and task-2?"
 
@@ -224,23 +193,14 @@ def ask_question_response(user_id: str, channel_id: str, message: str) -> str:
 
             You may use your own judgment to help you determine if the user has provided a sufficient standup update. Keep your response concise and to the point.
             """
-        ),
-        *formatted_conversation_history,
-        HumanMessage(content=message)
-    ]
-    response = llm.invoke(messages)
-    return response.content
 
-def friendly_conversation_response(user_id: str, channel_id: str, message: str) -> str:
-    """
-    Responds to generic messages from the user that are not standup updates only if the user has provided a standup update, such as common replies that end a conversation.
-    Only use this tool if the user already has a standup update for the day. Otherwise, use the ask_question_response tool.
-    """
-    conversation_history = get_messages_from_db(user_id, channel_id, max_number_of_messages_to_fetch=2)
-    formatted_conversation_history = convert_conversation_history_to_langchain_messages(conversation_history)
-    messages = [
-        SystemMessage(
-            """
+ASK_QUESTION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", ASK_QUESTION_INSTRUCTIONS),
+    MessagesPlaceholder("history"),
+    ("human", "{message}")
+])
+
+FRIENDLY_CONVERSATION_INSTRUCTIONS = """
             You are a project manager whose goal is to read a standup update from a software developer and respond to the message in a professional manner.
             For example, if the user says "Can you update task-1 and task-2", you should respond with "Can you provide more details about the status of task-1 and task-2?"
 
@@ -249,12 +209,168 @@ def friendly_conversation_response(user_id: str, channel_id: str, message: str)
 
             You may use your own judgment, but please respond to the user asking the information you would need for a sufficient standup update. Keep your response concise and to the point.
             """
-        ),
-        *formatted_conversation_history,
-        HumanMessage(content=message)
-    ]
-    response = llm.invoke(messages)
-    return response.content
+
+FRIENDLY_CONVERSATION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", FRIENDLY_CONVERSATION_INSTRUCTIONS),
+    MessagesPlaceholder("history"),
+    ("human", "{message}")
+])
+
+async def invoke_llm(operation: str, messages, model=None, use_cache=True):
+    """
+    ainvoke the model as one llm span and record its prompt and cached token usage. model defaults to llm,
+    or to uncached_llm when use_cache is False; a caller passing its own model (e.g. with bound tools) picks its cache with it.
+    """
+    if model is None:
+        model = llm if use_cache else uncached_llm
+    with timed("llm", operation):
+        response = await model.ainvoke(messages)
+    _log_llm_usage(operation, response)
+    return response
+
+def _log_llm_usage(operation, response):
+    prompt_tokens, cached_tokens = record_llm_usage(operation, response)
+    if prompt_tokens:
+        print(f"{operation} used {prompt_tokens} prompt tokens, {cached_tokens} from the provider's prompt cache")
+
+async def create_standup_update(text: str, user_id: str, channel_id: str) -> dict:
+    """
+    Given a user's standup update and conversation history, extract the key insights from the update if and only ifthe update has sufficient information.
+    Uses the conversation history if needed to piece together the user's standup update.
+    Only use this tool if there is no update already in the database and if there is sufficient information to update, delete, or add a given item.
+    """
+    # TODO: add conversation history if the user does not have an update in the database
+    # TODO: Update this to only give the standup update scheduled message and the user's reply after that?
+    messages = CREATE_STANDUP_UPDATE_PROMPT.format_messages(
+        history=await _get_langchain_history(user_id, channel_id, max_tokens=800),
+        text=text
+    )
+    response = await invoke_llm("create_standup_update", messages)
+    print("response from create standup update: ", response)
+    return json.loads(response.content)
+
+async def make_edits_to_update(update_exists: bool, text: str, user_id: str, channel_id: str) -> dict:
+    """
+    Make edits to the user's standup update based on the conversation history and the user's reply. Uses conversation history to make inferences on the user's desired updates. Only make edits if there is sufficient information to make edits.
+    """
+    context = get_turn_context(user_id, channel_id)
+    if context:
+        update = context.update["updates"] if update_exists and context.has_update else False
+    else:
+        update = (await get_standup_updates_by_user_id(user_id))[0]["updates"] if update_exists else False
+    if not update:
+        print("make edits to update called but no update exists")
+        return await ask_question_response(user_id, channel_id, text)
+    messages = MAKE_EDITS_TO_UPDATE_PROMPT.format_messages(
+        history=await _get_langchain_history(user_id, channel_id, max_tokens=800),
+        update=json.dumps(update),
+        text=text
+    )
+    response = await invoke_llm("make_edits_to_update", messages)
+    return json.loads(response.content)
+
+async def ask_question_response(user_id: str, channel_id: str, message: str) -> str:
+    """
+    Responds to the user with appropriate clarifying questions when their standup update is missing information, is vague or unclear, or if more details are needed to understand the update.
+    """
+    # """
+    # Responds to the user with appropriate clarifying questions when their standup update is missing information, is vague or unclear, or if more details are needed to understand the update.
+    # Use this tool when there is missing updates about about the current day or if the user is starting a conversation and no standup update exists.
+    # """
+    messages = ASK_QUESTION_PROMPT.format_messages(
+        history=await _get_langchain_history(user_id, channel_id, max_tokens=1200),
+        message=message
+    )
+    return await generate_reply(messages, get_turn_context(user_id, channel_id), "ask_question_response")
+
+async def friendly_conversation_response(user_id: str, channel_id: str, message: str) -> str:
+    """
+    Responds to generic messages from the user that are not standup updates only if the user has provided a standup update, such as common replies that end a conversation.
+    Only use this tool if the user already has a standup update for the day. Otherwise, use the ask_question_response tool.
+    """
+    messages = FRIENDLY_CONVERSATION_PROMPT.format_messages(
+        history=await _get_langchain_history(user_id, channel_id, max_tokens=400),
+        message=message
+    )
+    return await generate_reply(messages, get_turn_context(user_id, channel_id), "friendly_conversation_response")
+
+async def generate_reply(messages, context = None, operation = "reply", use_cache=True) -> str:
+    """
+    Run an LLM call whose output is the reply the user will see. operation labels the call in the metrics.
+    When the turn streams its reply, tokens are pushed into the Slack message as they arrive; streamed replies never hit the cache.
+    """
+    if not context or not context.reply_stream:
+        response = await invoke_llm(operation, messages, use_cache=use_cache)
+        return response.content
+    context.reply_stream.reset()
+    response = None
+    with timed("llm", operation):
+        async for chunk in llm.astream(messages):
+            # adding chunks merges their content and the usage metadata sent with the last one
+            response = chunk if response is None else response + chunk
+            context.reply_stream.append(chunk.content)
+    _log_llm_usage(operation, response)
+    return response.content if response else ""
+
+async def _get_langchain_history(user_id: str, channel_id: str, max_tokens: int):
+    """
+    Conversation history for a tool, capped at max_tokens. Taken from the current turn's context when there is one so the tool doesn't query Mongo again.
+    """
+    context = get_turn_context(user_id, channel_id)
+    if context:
+        return context.get_langchain_history(max_tokens)
+    conversation_history, summary = await asyncio.gather(
+        get_messages_from_db(user_id, channel_id, max_number_of_messages_to_fetch=MAX_TURN_HISTORY_MESSAGES),
+        get_conversation_summary(user_id, channel_id)
+    )
+    if summary:
+        conversation_history = [message for message in conversation_history if message["timestamp"] > summary["summarized_until"]]
+    return convert_conversation_history_to_langchain_messages(conversation_history, max_tokens, summary["summary"] if summary else None)
+
+CONVERSATION_SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """
+            You keep a running summary of a standup conversation between a project manager assistant and a developer.
+            Update the existing summary with the new messages. Keep every task, its status, any blockers and anything the developer asked for.
+            Leave out greetings and small talk. Reply with the updated summary only, in a few short bullet points.
+            """),
+    ("human", "Existing summary:\n{summary}\n\nNew messages:\n{transcript}")
+])
+
+async def refresh_conversation_summary(context):
+    """
+    Fold the messages that have left the largest history window into the day's stored summary, oldest first and
+    CONVERSATION_SUMMARY_BATCH_MESSAGES at a time. They are read from mongo rather than the context, so messages older than
+    the turn loaded are covered too. Does nothing unless messages left the window, so most turns cost no extra LLM call.
+    Run it in the user's turn queue so the next turn reads the new summary. A refresh that finds the summary moved on
+    under it, e.g. on another replica, stops rather than fold the same messages in twice.
+    """
+    boundary = context.get_summary_boundary()
+    if not boundary:
+        return
+    try:
+        stored = await get_conversation_summary(context.user_id, context.channel_id)
+        summary = stored["summary"] if stored else None
+        summarized_until = stored["summarized_until"] if stored else None
+        while True:
+            messages_to_summarize = await get_messages_to_summarize(
+                context.user_id, context.channel_id, summarized_until, boundary, CONVERSATION_SUMMARY_BATCH_MESSAGES
+            )
+            if not messages_to_summarize:
+                return
+            transcript = "\n".join(
+                f"{'Assistant' if message.get('is_bot') else 'Developer'}: {message['message']}" for message in messages_to_summarize
+            )
+            messages = CONVERSATION_SUMMARY_PROMPT.format_messages(summary=summary or "None", transcript=transcript)
+            response = await invoke_llm("conversation_summary", messages)
+            # messages are oldest first, so the last one is the newest the summary now covers
+            newest = messages_to_summarize[-1]["timestamp"]
+            if not await save_conversation_summary(context.user_id, context.channel_id, response.content, newest, summarized_until):
+                print(f"conversation summary for {context.user_id} was refreshed elsewhere, leaving it to that refresh")
+                return
+            summary, summarized_until = response.content, newest
+    except Exception as e:
+        print("Error refreshing conversation summary: ", e)
+        record_handled_error("conversation_summary")
 
 def convert_slack_history_to_langchain_messages(slack_conversation_history):
     """
@@ -268,31 +384,52 @@ def convert_slack_history_to_langchain_messages(slack_conversation_history):
             messages.append(HumanMessage(content=message['text']))
     return messages
 
-def convert_conversation_history_to_langchain_messages(conversation_history):
-    messages = []
-    for message in conversation_history:
-        if message.get('is_bot'):
-            messages.append(AIMessage(content=message['message']))
-        else:
-            messages.append(HumanMessage(content=message['message']))
-    return messages
-
-def derive_standup_message(user_id: str) -> str:
+async def derive_standup_message(user_id: str) -> str:
     """
     Uses github and linear to generate a well-formatted standup message for a user.
     """
-    github_activity = get_github_activity(user_id) if get_github_token(user_id) else "No github activity"
-    formatted_github_activity = format_github_activity_to_slack(github_activity)
-    yesterday = datetime.now() - timedelta(days=1)
-    previous_standup_update = get_standup_updates_by_user_id(user_id, yesterday.strftime("%Y-%m-%d"))[0] if update_exists(user_id, yesterday.strftime("%Y-%m-%d")) else "No updates provided"
+    messages = await _build_standup_message_prompt(user_id)
+    response = await invoke_llm("standup_message", messages)
+    return response.content
 
-    print("previous standup update: ", previous_standup_update)
-    print()
-    print()
+async def derive_standup_messages(user_ids) -> dict:
+    """
+    Batch version of derive_standup_message. Gathers every user's github activity and previous update first,
+    then generates all the messages with one abatch capped at STANDUP_DRAFT_MAX_CONCURRENCY concurrent LLM calls.
+    Returns a dict of user id to message, leaving out users whose generation failed.
+    """
+    user_ids = list(user_ids)
+    semaphore = asyncio.Semaphore(STANDUP_DRAFT_MAX_CONCURRENCY)
+
+    async def build_with_limit(user_id):
+        async with semaphore:
+            return await _build_standup_message_prompt(user_id)
+
+    prompts = await asyncio.gather(*[build_with_limit(user_id) for user_id in user_ids], return_exceptions=True)
+    ready = [(user_id, prompt) for user_id, prompt in zip(user_ids, prompts) if not isinstance(prompt, Exception)]
+    with timed("llm", "standup_message_batch"):
+        responses = await llm.abatch(
+            [prompt for _, prompt in ready],
+            config={"max_concurrency": STANDUP_DRAFT_MAX_CONCURRENCY},
+            return_exceptions=True
+        )
 
-    messages = [
-        SystemMessage(
-            """
+    standup_messages = {}
+    for (user_id, _), response in zip(ready, responses):
+        if isinstance(response, Exception):
+            print(f"Error generating standup message for {user_id}: {response}")
+            record_handled_error("standup_draft")
+            continue
+        _log_llm_usage("standup_message_batch", response)
+        standup_messages[user_id] = response.content
+    for user_id, prompt in zip(user_ids, prompts):
+        if isinstance(prompt, Exception):
+            print(f"Error gathering standup context for {user_id}: {prompt}")
+            record_handled_error("standup_draft")
+    return standup_messages
+
+STANDUP_MESSAGE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """
             You are a project manager whose job is to create a well-formatted standup message in slack for a software developer given their github activity and previous standup updates.
 
             Here are some important things to keep in mind when crafting the standup message:
@@ -303,25 +440,27 @@ def derive_standup_message(user_id: str) -> str:
             5. Since you are only going to be given previous data, try to make inferences on what the user is going to do for the current day based on the github activity and previous standup update.
             6. If there are no inferences you can make on their current day plans, ask them what they plan on doing for the current day.
             7. Also ask them to confirm if the update looks good to them.
+            """),
+    ("system", "{formatted_github_activity}\n\n{formatted_previous_standup_update}")
+])
 
+async def _build_standup_message_prompt(user_id: str) -> list:
+    # get_github_activity looks up the token itself and says so when there isn't one
+    github_activity = await get_github_activity(user_id)
+    formatted_github_activity = format_github_activity_to_slack(github_activity)
+    yesterday = datetime.now() - timedelta(days=1)
+    previous_standup_update = await get_standup_update(user_id, yesterday.strftime("%Y-%m-%d")) or "No updates provided"
 
-            {formatted_github_activity}
-
-            {formatted_previous_standup_update}
-
-            """.format(formatted_github_activity=format_github_activity_to_slack(github_activity), formatted_previous_standup_update=format_standup_update_to_slack(previous_standup_update))
-        )
-    ]
-    response = llm.invoke(messages)
-    return response.content
+    print("previous standup update: ", previous_standup_update)
+    print()
+    print()
 
-def create_standup_update_from_conversation_history(text: str, user_id: str, channel_id: str) -> dict:
-    """
-    Given a user's github activity and previous standup update, create a standup update for the user.
-    Use this tool only if a user does not have a standup update for the day and if the user likes the drafted standup update inferred from github activity.
-    """
+    return STANDUP_MESSAGE_PROMPT.format_messages(
+        formatted_github_activity=formatted_github_activity,
+        formatted_previous_standup_update=format_standup_update_to_slack(previous_standup_update)
+    )
 
-    prompt_without_day_differentiation = """
+CREATE_STANDUP_UPDATE_FROM_HISTORY_INSTRUCTIONS = """
             You are a project manager that creates standup updates for developers based on their github activity.
                 
             Your goal is to take what developers are saying and extract all updates.
@@ -368,18 +507,27 @@ def create_standup_update_from_conversation_history(text: str, user_id: str, cha
                 ]
             }}
             """
-    github_activity = get_github_activity(user_id) if get_github_token(user_id) else "No github activity"
-    formatted_github_activity = format_github_activity_to_slack(github_activity)
-    messages = [
-        # TODO: add conversation history if the user does not have an update in the database
-        # TODO: Update this to only give the standup update scheduled message and the user's reply after that?
-        *convert_conversation_history_to_langchain_messages(get_messages_from_db(user_id, channel_id, max_number_of_messages_to_fetch=3)),
-        SystemMessage(prompt_without_day_differentiation),
-        SystemMessage(formatted_github_activity),
-        HumanMessage(content=text)
-    ]
-    prompt = ChatPromptTemplate.from_messages(messages)
-    formatted_prompt = prompt.format(user_id=user_id, text=text)
-    response = llm.invoke(formatted_prompt)
+
+CREATE_STANDUP_UPDATE_FROM_HISTORY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", CREATE_STANDUP_UPDATE_FROM_HISTORY_INSTRUCTIONS),
+    MessagesPlaceholder("history"),
+    ("system", "{github_activity}"),
+    ("human", "{text}")
+])
+
+async def create_standup_update_from_conversation_history(text: str, user_id: str, channel_id: str) -> dict:
+    """
+    Given a user's github activity and previous standup update, create a standup update for the user.
+    Use this tool only if a user does not have a standup update for the day and if the user likes the drafted standup update inferred from github activity.
+    """
+    github_activity = await get_github_activity(user_id) if await get_github_token(user_id) else "No github activity"
+    # TODO: add conversation history if the user does not have an update in the database
+    # TODO: Update this to only give the standup update scheduled message and the user's reply after that?
+    messages = CREATE_STANDUP_UPDATE_FROM_HISTORY_PROMPT.format_messages(
+        history=await _get_langchain_history(user_id, channel_id, max_tokens=600),
+        github_activity=format_github_activity_to_slack(github_activity),
+        text=text
+    )
+    response = await invoke_llm("create_standup_update_from_conversation_history", messages)
     print("response from create standup update: ", response)
     return json.loads(response.content)
@@ -0,0 +1,211 @@
+from contextlib import contextmanager
+from dotenv import find_dotenv, load_dotenv
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from pymongo import monitoring
+import json
+import os
+import time
+
+load_dotenv(find_dotenv())
+
+# print one JSON line per span as well as recording it, for following a single turn in the logs
+METRICS_LOG_SPANS = os.environ.get("METRICS_LOG_SPANS", "false").lower() == "true"
+# LLM calls take seconds, mongo queries milliseconds; one set of buckets covers both
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# driver housekeeping that isn't a query the bot made
+MONGO_IGNORED_COMMANDS = {"hello", "ismaster", "ping", "endsessions", "buildinfo", "saslstart", "saslcontinue", "killcursors"}
+
+EXTERNAL_CALL_SECONDS = Histogram(
+    "standup_bot_external_call_seconds",
+    "Time spent in calls to the LLM, Mongo, GitHub and Slack",
+    ["service", "operation"],
+    buckets=LATENCY_BUCKETS
+)
+EXTERNAL_CALL_ERRORS = Counter(
+    "standup_bot_external_call_errors_total",
+    "Calls to the LLM, Mongo, GitHub and Slack that raised or returned an error",
+    ["service", "operation"]
+)
+TOOL_CALLS = Counter(
+    "standup_bot_tool_calls_total",
+    "Tools picked by the tool agent",
+    ["tool"]
+)
+HANDLED_ERRORS = Counter(
+    "standup_bot_handled_errors_total",
+    "Errors that were caught and logged instead of failing the caller",
+    ["where"]
+)
+LLM_PROMPT_TOKENS = Counter(
+    "standup_bot_llm_prompt_tokens_total",
+    "Prompt tokens sent to the LLM",
+    ["operation"]
+)
+LLM_CACHED_PROMPT_TOKENS = Counter(
+    "standup_bot_llm_cached_prompt_tokens_total",
+    "Prompt tokens the provider served from its prompt prefix cache",
+    ["operation"]
+)
+COALESCED_MESSAGES = Counter(
+    "standup_bot_coalesced_messages_total",
+    "Messages merged into another message's turn instead of getting a turn of their own"
+)
+LLM_CACHE_LOOKUPS = Counter(
+    "standup_bot_llm_cache_lookups_total",
+    "LLM response cache lookups by result: hit or miss",
+    ["result"]
+)
+LLM_CACHE_LATENCY_SAVED_SECONDS = Counter(
+    "standup_bot_llm_cache_latency_saved_seconds_total",
+    "Seconds the cached LLM calls took when they were first made, saved by serving them from the cache"
+)
+GITHUB_HTTP_CACHE_REQUESTS = Counter(
+    "standup_bot_github_http_cache_requests_total",
+    "GitHub GETs by cache result: hit for a 304 served from the cached body, which doesn't count against the rate limit, or miss",
+    ["result"]
+)
+GITHUB_HTTP_CACHE_BYTES_SAVED = Counter(
+    "standup_bot_github_http_cache_bytes_saved_total",
+    "Response bytes GitHub didn't have to send because a cached copy was still valid"
+)
+STANDUP_SEND_JOBS = Counter(
+    "standup_bot_standup_send_jobs_total",
+    "Standup send job attempts by outcome: sent, retried or failed",
+    ["outcome"]
+)
+STANDUP_SEND_QUEUE_DEPTH = Gauge(
+    "standup_bot_standup_send_queue_depth",
+    "Standup send jobs waiting in the queue or being worked on",
+    ["status"]
+)
+STANDUP_SEND_QUEUE_OLDEST_AGE_SECONDS = Gauge(
+    "standup_bot_standup_send_queue_oldest_age_seconds",
+    "Age of the oldest standup send job still waiting in the queue"
+)
+MONGO_COLLECTION_BYTES = Gauge(
+    "standup_bot_mongo_collection_bytes",
+    "Size of a mongo collection as of the last nightly rollup: data, storage or indexes",
+    ["collection", "kind"]
+)
+MONGO_COLLECTION_DOCUMENTS = Gauge(
+    "standup_bot_mongo_collection_documents",
+    "Documents in a mongo collection as of the last nightly rollup",
+    ["collection"]
+)
+TURN_SECONDS = Histogram(
+    "standup_bot_turn_seconds",
+    "Time from receiving a Slack message to sending the reply",
+    buckets=LATENCY_BUCKETS
+)
+TIME_TO_FIRST_VISIBLE_TOKEN_SECONDS = Histogram(
+    "standup_bot_time_to_first_visible_token_seconds",
+    "Time from receiving a Slack message until streamed reply text was visible in Slack",
+    buckets=LATENCY_BUCKETS
+)
+
+@contextmanager
+def timed(service: str, operation: str):
+    """Record the wrapped block as one span of service/operation. An exception counts as an error and is re-raised."""
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record_span(service, operation, time.perf_counter() - start, error)
+
+def record_span(service: str, operation: str, duration: float, error: bool = False):
+    EXTERNAL_CALL_SECONDS.labels(service, operation).observe(duration)
+    if error:
+        EXTERNAL_CALL_ERRORS.labels(service, operation).inc()
+    if METRICS_LOG_SPANS:
+        print(json.dumps({"span": f"{service}.{operation}", "duration_ms": round(duration * 1000, 1), "error": error}))
+
+def record_external_error(service: str, operation: str):
+    """Count a call that completed but returned an error status."""
+    EXTERNAL_CALL_ERRORS.labels(service, operation).inc()
+
+def record_handled_error(where: str):
+    HANDLED_ERRORS.labels(where).inc()
+
+def record_tool_call(tool: str):
+    TOOL_CALLS.labels(tool).inc()
+
+def record_llm_usage(operation: str, message):
+    """Count the prompt and cached prompt tokens from a response's usage metadata. Returns (prompt tokens, cached tokens)."""
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return 0, 0
+    prompt_tokens = usage.get("input_tokens", 0)
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+    LLM_PROMPT_TOKENS.labels(operation).inc(prompt_tokens)
+    LLM_CACHED_PROMPT_TOKENS.labels(operation).inc(cached_tokens)
+    return prompt_tokens, cached_tokens
+
+def record_coalesced_messages(count: int):
+    COALESCED_MESSAGES.inc(count)
+
+def record_llm_cache(hit: bool, latency_saved: float = 0.0):
+    LLM_CACHE_LOOKUPS.labels("hit" if hit else "miss").inc()
+    if hit:
+        LLM_CACHE_LATENCY_SAVED_SECONDS.inc(latency_saved)
+
+def record_github_http_cache(hit: bool, bytes_saved: int = 0):
+    GITHUB_HTTP_CACHE_REQUESTS.labels("hit" if hit else "miss").inc()
+    if hit:
+        GITHUB_HTTP_CACHE_BYTES_SAVED.inc(bytes_saved)
+
+def record_standup_send_job(outcome: str):
+    STANDUP_SEND_JOBS.labels(outcome).inc()
+
+def record_standup_send_queue(depth: dict, oldest_age_seconds: float):
+    for status, count in depth.items():
+        STANDUP_SEND_QUEUE_DEPTH.labels(status).set(count)
+    STANDUP_SEND_QUEUE_OLDEST_AGE_SECONDS.set(oldest_age_seconds)
+
+def record_collection_stats(stats: dict):
+    """Record the output of get_collection_storage_stats."""
+    for collection, collection_stats in stats.items():
+        MONGO_COLLECTION_DOCUMENTS.labels(collection).set(collection_stats["count"])
+        MONGO_COLLECTION_BYTES.labels(collection, "data").set(collection_stats["size"])
+        MONGO_COLLECTION_BYTES.labels(collection, "storage").set(collection_stats["storage_size"])
+        MONGO_COLLECTION_BYTES.labels(collection, "indexes").set(collection_stats["index_size"])
+
+def record_turn(duration: float, time_to_first_visible_token: float = None):
+    TURN_SECONDS.observe(duration)
+    if time_to_first_visible_token is not None:
+        TIME_TO_FIRST_VISIBLE_TOKEN_SECONDS.observe(time_to_first_visible_token)
+
+def render_metrics():
+    """The current metrics in the Prometheus text format, with the content type to serve them with."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """
+    pymongo command listener that records every query as a mongo span labelled with the command and collection,
+    e.g. "find messages", so no helper in mongo_db_helpers needs its own timing code.
+    """
+
+    def __init__(self):
+        self._operations = {}
+
+    def started(self, event):
+        if event.command_name.lower() in MONGO_IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            # getMore names its collection separately
+            collection = event.command.get("collection", "")
+        self._operations[(event.connection_id, event.request_id)] = f"{event.command_name} {collection}".strip()
+
+    def succeeded(self, event):
+        operation = self._operations.pop((event.connection_id, event.request_id), None)
+        if operation:
+            record_span("mongo", operation, event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        operation = self._operations.pop((event.connection_id, event.request_id), None)
+        if operation:
+            record_span("mongo", operation, event.duration_micros / 1_000_000, error=True)
@@ -1,13 +1,177 @@
-from pymongo import MongoClient
-from datetime import datetime
+from pymongo import AsyncMongoClient, ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from datetime import datetime, timedelta
+import os
+from .metrics_helpers import MongoCommandTimer, record_handled_error
 
-client = MongoClient("mongodb://localhost:27017/")
-db = client["standup_db"]
+MONGO_URI = "mongodb://localhost:27017/"
+MONGO_DB_NAME = "standup_db"
+LLM_CACHE_TTL_SECONDS = int(os.environ.get("LLM_CACHE_TTL_SECONDS", 24 * 60 * 60))
+GITHUB_ACTIVITY_EVENT_RETENTION_DAYS = int(os.environ.get("GITHUB_ACTIVITY_EVENT_RETENTION_DAYS", 30))
+STANDUP_SEND_JOB_RETENTION_DAYS = int(os.environ.get("STANDUP_SEND_JOB_RETENTION_DAYS", 14))
+# raw messages are only read for the current day; older days live on as one message_rollups document per user and channel
+MESSAGE_RETENTION_DAYS = int(os.environ.get("MESSAGE_RETENTION_DAYS", 30))
+# team-wide queries look at each user's most recent update from the last this many days
+TEAM_STATUS_LOOKBACK_DAYS = int(os.environ.get("TEAM_STATUS_LOOKBACK_DAYS", 7))
+UPDATE_ITEMS_BACKFILL_BATCH_SIZE = int(os.environ.get("UPDATE_ITEMS_BACKFILL_BATCH_SIZE", 100))
+# server error codes for an existing index on the same keys with different options
+INDEX_CONFLICT_CODES = {85, 86}
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+# every query is recorded as a mongo span by the command listener
+client = AsyncMongoClient(MONGO_URI, event_listeners=[MongoCommandTimer()])
+db = client[MONGO_DB_NAME]
 updates_collection = db["daily_updates"]
+# one document per item of a daily update, kept in sync by insert_item, for queries across the team
+update_items_collection = db["update_items"]
 messages_collection = db["messages"]
 github_tokens_collection = db["github_tokens"]
+github_http_cache_collection = db["github_http_cache"]
+standup_schedules_collection = db["standup_schedules"]
+llm_cache_collection = db["llm_cache"]
+standup_drafts_collection = db["standup_drafts"]
+conversation_summaries_collection = db["conversation_summaries"]
+github_activity_snapshots_collection = db["github_activity_snapshots"]
+github_activity_events_collection = db["github_activity_events"]
+leases_collection = db["leases"]
+standup_send_jobs_collection = db["standup_send_jobs"]
+message_rollups_collection = db["message_rollups"]
+
+# indexes backing the hot queries below, created at startup by ensure_indexes
+INDEXES = {
+    updates_collection: [
+        # one document per user per day; insert_item's upsert relies on it to never create a second one
+        {"keys": [("user_id", ASCENDING), ("date", ASCENDING)], "unique": True}
+    ],
+    update_items_collection: [
+        # covers finding each user's latest update date in the team queries
+        {"keys": [("date", ASCENDING), ("user_id", ASCENDING)]},
+        # the items of one user's update, and an item's previous days for status_since
+        {"keys": [("user_id", ASCENDING), ("date", ASCENDING)]},
+        {"keys": [("user_id", ASCENDING), ("item", ASCENDING), ("date", DESCENDING)]}
+    ],
+    messages_collection: [
+        {"keys": [("user_id", ASCENDING), ("channel_id", ASCENDING), ("timestamp", DESCENDING)]},
+        # TTL index: mongo deletes messages MESSAGE_RETENTION_DAYS after they were sent, after the nightly rollup has copied them
+        {"keys": [("timestamp", ASCENDING)], "expire_after_seconds": MESSAGE_RETENTION_DAYS * 24 * 60 * 60}
+    ],
+    github_tokens_collection: [
+        {"keys": [("slack_user_id", ASCENDING)], "unique": True},
+        {"keys": [("github_login", ASCENDING)]}
+    ],
+    github_http_cache_collection: [
+        {"keys": [("last_used", ASCENDING)]}
+    ],
+    github_activity_snapshots_collection: [
+        {"keys": [("slack_user_id", ASCENDING)], "unique": True}
+    ],
+    github_activity_events_collection: [
+        {"keys": [("slack_user_id", ASCENDING), ("occurred_at", ASCENDING)]},
+        # events from people who haven't connected yet are picked up by login once they do
+        {"keys": [("github_login", ASCENDING), ("slack_user_id", ASCENDING)]},
+        # TTL index: mongo deletes events GITHUB_ACTIVITY_EVENT_RETENTION_DAYS after they happened
+        {"keys": [("occurred_at", ASCENDING)], "expire_after_seconds": GITHUB_ACTIVITY_EVENT_RETENTION_DAYS * 24 * 60 * 60}
+    ],
+    standup_schedules_collection: [
+        {"keys": [("user_id", ASCENDING)], "unique": True},
+        {"keys": [("timezone", ASCENDING), ("send_time", ASCENDING)]}
+    ],
+    standup_drafts_collection: [
+        {"keys": [("user_id", ASCENDING), ("date", ASCENDING)], "unique": True}
+    ],
+    standup_send_jobs_collection: [
+        # one index per way a job becomes claimable: queued and due, or running past its visibility timeout
+        {"keys": [("status", ASCENDING), ("run_at", ASCENDING)]},
+        {"keys": [("status", ASCENDING), ("lease_expires_at", ASCENDING)]},
+        # TTL index: finished jobs are kept STANDUP_SEND_JOB_RETENTION_DAYS for inspection; unfinished ones have no finished_at
+        {"keys": [("finished_at", ASCENDING)], "expire_after_seconds": STANDUP_SEND_JOB_RETENTION_DAYS * 24 * 60 * 60}
+    ],
+    conversation_summaries_collection: [
+        {"keys": [("user_id", ASCENDING), ("channel_id", ASCENDING), ("date", ASCENDING)], "unique": True}
+    ],
+    llm_cache_collection: [
+        # TTL index: mongo deletes cached responses LLM_CACHE_TTL_SECONDS after they were stored
+        {"keys": [("created_at", ASCENDING)], "expire_after_seconds": LLM_CACHE_TTL_SECONDS}
+    ]
+}
+
+async def ensure_indexes():
+    """Create any missing indexes. create_index is a no-op for indexes that already exist."""
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            options = {"unique": index.get("unique", False)}
+            if "expire_after_seconds" in index:
+                options["expireAfterSeconds"] = index["expire_after_seconds"]
+            try:
+                await collection.create_index(index["keys"], **options)
+            except OperationFailure as e:
+                if e.code not in INDEX_CONFLICT_CODES and not isinstance(e, DuplicateKeyError):
+                    raise
+                # an older index on the same keys with other options (e.g. not unique yet), or duplicates that block a unique one
+                print(f"rebuilding index {index['keys']} on {collection.name}: {e}")
+                if e.code in INDEX_CONFLICT_CODES:
+                    await collection.drop_index(index["keys"])
+                if options["unique"]:
+                    await _remove_duplicates(collection, [key for key, _ in index["keys"]])
+                await collection.create_index(index["keys"], **options)
+
+async def _remove_duplicates(collection, fields):
+    """Keep only the newest document for each combination of fields so a unique index can be built."""
+    duplicates = await (await collection.aggregate([
+        {"$sort": {"_id": -1}},
+        {"$group": {"_id": {field: f"${field}" for field in fields}, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ])).to_list()
+    stale_ids = [stale_id for duplicate in duplicates for stale_id in duplicate["ids"][1:]]
+    if stale_ids:
+        await collection.delete_many({"_id": {"$in": stale_ids}})
+        print(f"removed {len(stale_ids)} duplicate documents from {collection.name}")
 
-def get_standup_updates_by_user_id(user_id: str, date = None):
+async def check_hot_query_plans():
+    """
+    Explain every hot query and raise if any of them would fall back to a collection scan.
+    Run after ensure_indexes so a missing or mistyped index fails loudly at startup instead of slowly in production.
+    """
+    today = datetime.now().strftime("%Y-%m-%d")
+    hot_queries = [
+        (updates_collection, {"user_id": "", "date": today}, None),
+        (updates_collection, {"user_id": "", "date": {"$gte": today}}, None),
+        (update_items_collection, {"date": {"$gte": today}}, None),
+        (update_items_collection, {"user_id": "", "item": {"$in": [""]}, "date": {"$lt": today}}, {"date": -1}),
+        (messages_collection, {"user_id": "", "channel_id": "", "timestamp": {"$gte": _start_of_day()}}, {"timestamp": -1}),
+        (github_tokens_collection, {"slack_user_id": ""}, None),
+        (github_activity_snapshots_collection, {"slack_user_id": ""}, None),
+        (github_activity_events_collection, {"slack_user_id": "", "occurred_at": {"$gte": _start_of_day()}}, {"occurred_at": 1}),
+        (standup_schedules_collection, {"timezone": "", "send_time": ""}, None),
+        (standup_send_jobs_collection, {"status": "queued", "run_at": {"$lte": datetime.utcnow()}}, {"run_at": 1})
+    ]
+    collection_scans = []
+    for collection, query_filter, sort in hot_queries:
+        find_command = {"find": collection.name, "filter": query_filter, "limit": 1}
+        if sort:
+            find_command["sort"] = sort
+        plan = await db.command({"explain": find_command, "verbosity": "queryPlanner"})
+        if "COLLSCAN" in _plan_stages(plan["queryPlanner"]["winningPlan"]):
+            collection_scans.append(f"{collection.name} {query_filter}")
+    if collection_scans:
+        raise Exception(f"Hot queries fall back to a collection scan: {collection_scans}")
+
+def _plan_stages(plan):
+    stages = [plan.get("stage")]
+    for child in plan.get("inputStages", []) + [plan[key] for key in ("inputStage", "queryPlan") if key in plan]:
+        stages.extend(_plan_stages(child))
+    return stages
+
+def _start_of_day(date = None):
+    """Midnight of the given YYYY-MM-DD date, or of today. Message timestamps are datetimes, so they must be compared against one."""
+    day = datetime.strptime(date, "%Y-%m-%d") if date else datetime.now()
+    return day.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _date_string(date = None):
+    """The YYYY-MM-DD string the daily_updates collection keys on, validating a given date."""
+    return datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d") if date else datetime.now().strftime("%Y-%m-%d")
+
+async def get_standup_updates_by_user_id(user_id: str, date = None):
     """
     Get standup updates for a user since the given date
     """
@@ -17,59 +181,338 @@ def get_standup_updates_by_user_id(user_id: str, date = None):
         "user_id": user_id,
         "date": {"$gte": query_date}  # Get all updates with date greater than or equal to query_date
     }
-    updates = list(updates_collection.find(db_query, {"_id": 0}))
+    updates = await updates_collection.find(db_query, {"_id": 0}).to_list()
 
     if updates:
         return updates  # Return all updates, not just the first one
     raise Exception(f"No updates found for user {user_id} on date {query_date}")
 
-def insert_item(user_id, extracted_updates):
+async def get_standup_update(user_id: str, date = None):
+    """
+    Get a user's standup update for a single day, or None if they haven't given one
+    """
+    return await updates_collection.find_one({"user_id": user_id, "date": _date_string(date)}, {"_id": 0})
+
+class StaleUpdateError(Exception):
+    """The day's update changed after the caller read the version it passed to insert_item."""
+
+async def insert_item(user_id, extracted_updates, expected_version = None):
+    """
+    Create or replace the user's update for today in one round-trip and return the new document.
+    Every write bumps the document's version. Pass the version the caller read (0 if there was no update) to only
+    write if nobody else has written since; otherwise StaleUpdateError is raised. Without it the last write wins.
+    """
     now = datetime.now()
-    date = now.strftime("%Y-%m-%d")
-    if update_exists(user_id):
-        update_item(user_id, extracted_updates)
-    else:
-        updates_collection.insert_one({
-            "user_id": user_id,
-            "updates": extracted_updates,
-            "date": date,
-            "update_time": now
-        })
-
-def update_exists(user_id, date = None) -> bool:
+    query = {"user_id": user_id, "date": now.strftime("%Y-%m-%d")}
+    if expected_version:
+        query["version"] = expected_version
+    elif expected_version is not None:
+        # documents written before versioning have no version field
+        query["version"] = {"$in": [None, 0]}
+    try:
+        update = await updates_collection.find_one_and_update(
+            query,
+            {"$set": {"updates": extracted_updates, "update_time": now}, "$inc": {"version": 1}},
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # the version didn't match, so the upsert tried to insert a second document for the day
+        if expected_version is None:
+            raise
+        raise StaleUpdateError(f"Update for {user_id} changed since version {expected_version}")
+    await _sync_update_items_safely(user_id, update["date"], extracted_updates, update["version"])
+    return update
+
+async def update_exists(user_id, date = None) -> bool:
     """
     Check if an update exists in our DB for a user on a given date
     """
-    desired_date = datetime.strptime(date, "%Y-%m-%d") if date else datetime.now().strftime("%Y-%m-%d")
-    return updates_collection.find_one({"user_id": user_id, "date": desired_date}) is not None
+    desired_date = _date_string(date)
+    return await updates_collection.find_one({"user_id": user_id, "date": desired_date}, {"_id": 1}) is not None
 
-def update_item(user_id, extracted_updates):
+async def delete_item(user_id, date = None):
+    desired_date = _date_string(date)
+    await updates_collection.delete_one({"user_id": user_id, "date": desired_date})
+    await update_items_collection.delete_many({"user_id": user_id, "date": desired_date})
+
+async def sync_update_items(user_id: str, date: str, extracted_updates, version: int):
+    """
+    Store each UpdateItem of a user's update for the date as its own document and drop items no longer in it.
+    status_since is the first day of the item's current status, carried over from its previous day when that had the same status.
+    version is the version of the daily update the items come from, so a sync of an older read of the update, e.g. by the
+    backfill, can't undo a newer one: items from a newer version are neither overwritten, as the upsert's filter then
+    collides with their _id, nor dropped. If the update has moved past version once the items are written, they are
+    dropped again; a sync that starts later drops those of them its version doesn't have.
+    """
+    extracted_updates = extracted_updates or {}
+    if not isinstance(extracted_updates, dict) or not isinstance(extracted_updates.get("updates") or [], list):
+        raise ValueError(f"expected an update with a list of items, got {type(extracted_updates).__name__}")
+    items = {}
+    for update_item in extracted_updates.get("updates") or []:
+        # an entry without an item name can't be keyed, so it isn't tracked
+        if isinstance(update_item, dict) and update_item.get("item"):
+            items[str(update_item["item"])] = update_item
+    previous = await (await update_items_collection.aggregate([
+        {"$match": {"user_id": user_id, "item": {"$in": list(items)}, "date": {"$lt": date}}},
+        {"$sort": {"date": -1}},
+        {"$group": {"_id": "$item", "status": {"$first": "$status"}, "status_since": {"$first": "$status_since"}}}
+    ])).to_list()
+    previous = {item["_id"]: item for item in previous}
     now = datetime.now()
-    date = now.strftime("%Y-%m-%d")
-    updates_collection.update_one(
-        {"user_id": user_id, "date": date},
-        {"$set": {"updates": extracted_updates, "update_time": now}}
-    )
+    # items written before they carried a version have none, which counts as older than any
+    not_newer = {"$not": {"$gt": version}}
+    operations = []
+    for name, update_item in items.items():
+        status = str(update_item.get("status", "")).upper()
+        previous_item = previous.get(name)
+        operations.append(UpdateOne(
+            {"_id": f"{user_id}:{date}:{name}", "update_version": not_newer},
+            {"$set": {
+                "user_id": user_id,
+                "date": date,
+                "item": name,
+                "status": status,
+                "blockers": update_item.get("identified_blockers") or [],
+                "status_since": previous_item["status_since"] if previous_item and previous_item["status"] == status else date,
+                "update_version": version,
+                "updated_at": now
+            }},
+            upsert=True
+        ))
+    try:
+        if operations:
+            await update_items_collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        if any(error["code"] != DUPLICATE_KEY_ERROR_CODE for error in e.details["writeErrors"]):
+            raise
+        print(f"kept {len(e.details['writeErrors'])} items of {user_id}'s update for {date} written from a version newer than {version}")
+    # after the upserts, so a newer sync either sees the items written here or is seen by the version check below
+    await update_items_collection.delete_many({"user_id": user_id, "date": date, "item": {"$nin": list(items)}, "update_version": not_newer})
+    update = await updates_collection.find_one({"user_id": user_id, "date": date}, {"_id": 0, "version": 1})
+    if update is None or (update.get("version") or 0) != version:
+        await update_items_collection.delete_many({"user_id": user_id, "date": date, "update_version": version})
+
+async def _sync_update_items_safely(user_id, date, extracted_updates, version):
+    # the update itself is already stored; stale items are fixed by the next write or backfill_update_items
+    try:
+        await sync_update_items(user_id, date, extracted_updates, version)
+    except Exception as e:
+        print(f"Error syncing update items for {user_id}: {e}")
+        record_handled_error("sync_update_items")
+
+async def backfill_update_items(days: int = 30):
+    """
+    Build the item documents for the last days of daily updates that don't have any yet, oldest first so status_since
+    carries over, UPDATE_ITEMS_BACKFILL_BATCH_SIZE updates at a time. An interrupted run picks up where it stopped,
+    and malformed updates are logged and skipped. Returns how many daily updates were backfilled.
+    It runs alongside live traffic, so the items are written with the version of the update it read and sync_update_items
+    keeps them from replacing those of a newer write.
+    """
+    since = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    backfilled = skipped = 0
+    batch = []
+    try:
+        cursor = updates_collection.find({"date": {"$gte": since}}, {"_id": 0, "user_id": 1, "date": 1, "updates": 1, "version": 1})
+        async for update in cursor.sort("date", ASCENDING).batch_size(UPDATE_ITEMS_BACKFILL_BATCH_SIZE):
+            batch.append(update)
+            if len(batch) == UPDATE_ITEMS_BACKFILL_BATCH_SIZE:
+                batch_backfilled, batch_skipped = await _backfill_update_items_batch(batch)
+                backfilled, skipped, batch = backfilled + batch_backfilled, skipped + batch_skipped, []
+        if batch:
+            batch_backfilled, batch_skipped = await _backfill_update_items_batch(batch)
+            backfilled, skipped = backfilled + batch_backfilled, skipped + batch_skipped
+    except Exception as e:
+        print(f"Error backfilling update items: {e}")
+        record_handled_error("backfill_update_items")
+    if backfilled or skipped:
+        print(f"backfilled update items from {backfilled} daily updates, skipped {skipped} malformed ones")
+    return backfilled
+
+async def _backfill_update_items_batch(updates: list):
+    """Sync the items of each update in the batch that has none stored yet. Returns how many were synced and how many skipped."""
+    existing = await update_items_collection.find(
+        {"user_id": {"$in": [update.get("user_id") for update in updates]}, "date": {"$in": [update.get("date") for update in updates]}},
+        {"_id": 0, "user_id": 1, "date": 1}
+    ).to_list()
+    synced = {(item["user_id"], item["date"]) for item in existing}
+    backfilled = skipped = 0
+    for update in updates:
+        if (update.get("user_id"), update.get("date")) in synced:
+            continue
+        try:
+            # updates written before versioning have no version, which insert_item also reads as 0
+            await sync_update_items(update["user_id"], update["date"], update.get("updates"), update.get("version") or 0)
+            backfilled += 1
+        except Exception as e:
+            print(f"Skipping the daily update of {update.get('user_id')} on {update.get('date')}: {e!r}")
+            record_handled_error("backfill_update_items")
+            skipped += 1
+    return backfilled, skipped
+
+async def get_team_blockers() -> list:
+    """Items that are BLOCKED or have open blockers in each user's most recent update, longest blocked first"""
+    return await _get_latest_team_items({"$or": [
+        {"status": "BLOCKED"},
+        {"blockers.0": {"$exists": True}, "status": {"$nin": ["COMPLETED", "REJECTED"]}}
+    ]})
 
-def delete_item(user_id, date = None):
-    desired_date = datetime.strptime(date, "%Y-%m-%d") if date else datetime.now().strftime("%Y-%m-%d")
-    updates_collection.delete_one({"user_id": user_id, "date": desired_date})
+async def get_stale_items(status: str = "IN_PROGRESS", days: int = 5) -> list:
+    """Items in each user's most recent update that have had the given status for at least the given number of days, oldest first"""
+    since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    return await _get_latest_team_items({"status": status.upper(), "status_since": {"$lte": since}})
 
-def persist_scheduled_message(user_id, message, scheduled_time):
-    messages_collection.insert_one({
+async def _get_latest_team_items(item_filter: dict) -> list:
+    """
+    The items matching item_filter from each user's latest update in the last TEAM_STATUS_LOOKBACK_DAYS.
+    Finding the latest date per user is covered by the (date, user_id) index, and each user's items are then
+    looked up by the (user_id, date) index, so the cost grows with the team's recent items rather than all history.
+    """
+    since = (datetime.now() - timedelta(days=TEAM_STATUS_LOOKBACK_DAYS)).strftime("%Y-%m-%d")
+    return await (await update_items_collection.aggregate([
+        {"$match": {"date": {"$gte": since}}},
+        {"$group": {"_id": "$user_id", "date": {"$max": "$date"}}},
+        {"$lookup": {
+            "from": update_items_collection.name,
+            "let": {"user_id": "$_id", "date": "$date"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [{"$eq": ["$user_id", "$$user_id"]}, {"$eq": ["$date", "$$date"]}]}}},
+                {"$match": item_filter}
+            ],
+            "as": "items"
+        }},
+        {"$unwind": "$items"},
+        {"$replaceRoot": {"newRoot": "$items"}},
+        {"$sort": {"status_since": 1, "user_id": 1}},
+        {"$project": {"_id": 0, "user_id": 1, "date": 1, "item": 1, "status": 1, "blockers": 1, "status_since": 1}}
+    ])).to_list()
+
+async def persist_scheduled_message(user_id, message, scheduled_time, date = None):
+    """Store a sent standup message. date is the YYYY-MM-DD day it was for in the user's time zone, defaulting to the server's."""
+    await messages_collection.insert_one({
         "type": "scheduled_message",
         "is_bot": True,
         "user_id": user_id,
         "channel_id": user_id,
         "message": message,
-        "timestamp": scheduled_time
+        "timestamp": scheduled_time,
+        "date": _date_string(date)
     })
 
-def standup_message_sent(user_id, date = None):
-    return messages_collection.find_one({"user_id": user_id, "type": "scheduled_message", "date": date}) is not None
+async def standup_message_sent(user_id, date = None):
+    """Whether the scheduled standup message for the given YYYY-MM-DD date, or today, already went out to the user"""
+    start = _start_of_day(date)
+    # date is the user's local day, which is at most a day off the server's, so the timestamp bound keeps the index range small
+    return await messages_collection.find_one({
+        "user_id": user_id,
+        "channel_id": user_id,
+        "timestamp": {"$gte": start - timedelta(days=1), "$lt": start + timedelta(days=2)},
+        "type": "scheduled_message",
+        "date": _date_string(date)
+    }, {"_id": 1}) is not None
+
+async def acquire_lease(name: str, owner: str, ttl_seconds: int) -> bool:
+    """
+    Take or renew the named lease for owner. Returns False while another owner holds it and it hasn't expired:
+    the filter then matches nothing, and the upsert collides with the existing lease's _id.
+    """
+    now = datetime.utcnow()
+    try:
+        await leases_collection.update_one(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lte": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl_seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def release_lease(name: str, owner: str):
+    """Give up the named lease if owner still holds it"""
+    await leases_collection.delete_one({"_id": name, "owner": owner})
+
+async def enqueue_standup_send_jobs(user_ids: list, date: str, max_attempts: int) -> int:
+    """
+    Queue a standup send job for each user for the given YYYY-MM-DD date. The job's _id is its idempotency key,
+    so enqueueing the same user and date again, e.g. when a slot job runs twice, adds nothing. Returns how many were new.
+    """
+    if not user_ids:
+        return 0
+    now = datetime.utcnow()
+    result = await standup_send_jobs_collection.bulk_write([
+        UpdateOne(
+            {"_id": f"standup:{user_id}:{date}"},
+            {"$setOnInsert": {
+                "user_id": user_id,
+                "date": date,
+                "status": "queued",
+                "attempts": 0,
+                "max_attempts": max_attempts,
+                "run_at": now,
+                "created_at": now
+            }},
+            upsert=True
+        ) for user_id in user_ids
+    ], ordered=False)
+    return result.upserted_count
 
-def save_message_to_db(user_id, message, channel_id, is_bot):
-    messages_collection.insert_one({
+async def claim_standup_send_job(owner: str, visibility_timeout_seconds: int):
+    """
+    Take the next due job for owner and hide it from other workers for visibility_timeout_seconds.
+    A running job whose worker didn't finish it in time is handed out again. Returns None when nothing is due.
+    The first claim also records send_intent_at in the same write, before anything can be posted for the job, so a later
+    claim knows an earlier attempt may have posted and from when to look for it.
+    """
+    now = datetime.utcnow()
+    return await standup_send_jobs_collection.find_one_and_update(
+        {"$or": [
+            {"status": "queued", "run_at": {"$lte": now}},
+            {"status": "running", "lease_expires_at": {"$lte": now}}
+        ]},
+        # an update pipeline, so send_intent_at can keep the value of the first claim
+        [{"$set": {
+            "status": "running",
+            "owner": {"$literal": owner},
+            "started_at": now,
+            "lease_expires_at": now + timedelta(seconds=visibility_timeout_seconds),
+            "attempts": {"$add": ["$attempts", 1]},
+            "send_intent_at": {"$ifNull": ["$send_intent_at", now]}
+        }}],
+        sort=[("run_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def complete_standup_send_job(job_id: str, owner: str, status: str, error: str = None):
+    """Finish a job as "sent" or "failed", unless its visibility timeout ran out and another worker has it now"""
+    await standup_send_jobs_collection.update_one(
+        {"_id": job_id, "owner": owner, "status": "running"},
+        {"$set": {"status": status, "finished_at": datetime.utcnow(), "last_error": error}, "$unset": {"lease_expires_at": ""}}
+    )
+
+async def retry_standup_send_job(job_id: str, owner: str, run_at: datetime, error: str):
+    """Put a failed attempt back in the queue to run again at run_at"""
+    await standup_send_jobs_collection.update_one(
+        {"_id": job_id, "owner": owner, "status": "running"},
+        {"$set": {"status": "queued", "run_at": run_at, "last_error": error}, "$unset": {"lease_expires_at": "", "owner": ""}}
+    )
+
+async def get_standup_send_queue_stats() -> dict:
+    """How many jobs are queued and running, and the age in seconds of the oldest queued job"""
+    groups = await (await standup_send_jobs_collection.aggregate([
+        {"$match": {"status": {"$in": ["queued", "running"]}}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}, "oldest": {"$min": "$created_at"}}}
+    ])).to_list()
+    depth = {"queued": 0, "running": 0}
+    oldest_age = 0.0
+    for group in groups:
+        depth[group["_id"]] = group["count"]
+        if group["_id"] == "queued":
+            oldest_age = (datetime.utcnow() - group["oldest"]).total_seconds()
+    return {"depth": depth, "oldest_age_seconds": oldest_age}
+
+async def save_message_to_db(user_id, message, channel_id, is_bot):
+    await messages_collection.insert_one({
         "type": "message",
         "is_bot": is_bot,
         "user_id": user_id,
@@ -78,9 +521,9 @@ def save_message_to_db(user_id, message, channel_id, is_bot):
         "timestamp": datetime.now()
     })
 
-def get_messages_from_db(user_id, channel_id, max_number_of_messages_to_fetch=10, date=None):
-    desired_date = datetime.strptime(date, "%Y-%m-%d") if date else datetime.now().strftime("%Y-%m-%d") # if date is not provided, get messages from today
-    result = list(
+async def get_messages_from_db(user_id, channel_id, max_number_of_messages_to_fetch=10, date=None):
+    desired_date = _start_of_day(date) # if date is not provided, get messages from today
+    return await (
         messages_collection.find(
             {
                 "user_id": user_id, 
@@ -91,12 +534,125 @@ def get_messages_from_db(user_id, channel_id, max_number_of_messages_to_fetch=10
                 "_id": 0
             }
         )
-        .sort("timestamp", -1))
-    return result[:max_number_of_messages_to_fetch]
+        .sort("timestamp", -1)
+        .limit(max_number_of_messages_to_fetch)
+        .to_list())
 
-def save_github_token(slack_user_id: str, github_token: str):
+async def get_messages_to_summarize(user_id, channel_id, summarized_until, before: datetime, limit: int):
+    """
+    Up to limit of today's messages after summarized_until, or from the start of the day if it is None, and before the given time,
+    oldest first. Unlike get_messages_from_db this reaches past the newest messages, for folding them into the summary in order.
+    """
+    timestamp = {"$gte": _start_of_day(), "$lt": before}
+    if summarized_until:
+        timestamp["$gt"] = summarized_until
+    return await (
+        messages_collection.find({"user_id": user_id, "channel_id": channel_id, "timestamp": timestamp}, {"_id": 0})
+        .sort("timestamp", 1)
+        .limit(limit)
+        .to_list())
+
+async def rollup_messages(start: datetime, end: datetime) -> int:
+    """
+    Compact each user's day of messages between start and end into one message_rollups document holding the day's
+    messages in order, their counts and the day's conversation summary. Runs entirely in mongo and replaces existing
+    rollups, so re-running it for the same days is safe. Returns how many user days were rolled up.
+    """
+    await (await messages_collection.aggregate([
+        {"$match": {"timestamp": {"$gte": start, "$lt": end}}},
+        {"$sort": {"timestamp": 1}},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "channel_id": "$channel_id",
+                # timestamps are stored as local time, so this is the same day _start_of_day uses
+                "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}}
+            },
+            "messages": {"$push": {"type": "$type", "is_bot": "$is_bot", "message": "$message", "timestamp": "$timestamp"}},
+            "message_count": {"$sum": 1},
+            "bot_message_count": {"$sum": {"$cond": ["$is_bot", 1, 0]}},
+            "first_at": {"$min": "$timestamp"},
+            "last_at": {"$max": "$timestamp"}
+        }},
+        {"$lookup": {
+            "from": conversation_summaries_collection.name,
+            "let": {"user_id": "$_id.user_id", "channel_id": "$_id.channel_id", "date": "$_id.date"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$user_id", "$$user_id"]},
+                    {"$eq": ["$channel_id", "$$channel_id"]},
+                    {"$eq": ["$date", "$$date"]}
+                ]}}},
+                {"$project": {"_id": 0, "summary": 1}}
+            ],
+            "as": "conversation_summary"
+        }},
+        {"$project": {
+            "_id": {"$concat": ["$_id.user_id", ":", "$_id.channel_id", ":", "$_id.date"]},
+            "user_id": "$_id.user_id",
+            "channel_id": "$_id.channel_id",
+            "date": "$_id.date",
+            "messages": 1,
+            "message_count": 1,
+            "bot_message_count": 1,
+            "first_at": 1,
+            "last_at": 1,
+            "summary": {"$first": "$conversation_summary.summary"},
+            "rolled_up_at": "$$NOW"
+        }},
+        {"$merge": {"into": message_rollups_collection.name, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ])).to_list()
+    return await message_rollups_collection.count_documents({"first_at": {"$gte": start, "$lt": end}})
+
+async def get_message_rollup(user_id: str, channel_id: str, date: str):
+    """The rolled up messages of one user's YYYY-MM-DD day in a channel, or None if that day wasn't rolled up"""
+    return await message_rollups_collection.find_one({"_id": f"{user_id}:{channel_id}:{date}"})
+
+async def get_collection_storage_stats(collection_names: list) -> dict:
+    """Document count, data size, storage size and index size in bytes of each named collection that exists"""
+    existing = set(await db.list_collection_names())
+    stats = {}
+    for name in collection_names:
+        # $collStats fails on a collection that hasn't been created yet, e.g. message_rollups before the first rollup
+        if name not in existing:
+            continue
+        storage = (await (await db[name].aggregate([{"$collStats": {"storageStats": {}}}])).to_list())[0]["storageStats"]
+        stats[name] = {
+            "count": storage.get("count", 0),
+            "size": storage.get("size", 0),
+            "storage_size": storage.get("storageSize", 0),
+            "index_size": storage.get("totalIndexSize", 0)
+        }
+    return stats
+
+async def profile_messages_query() -> dict:
+    """
+    Explain the per-turn history query for the most recent conversation and return how long mongo took
+    and how many index keys and documents it read, or None if there are no messages.
+    """
+    latest = await messages_collection.find_one({}, {"user_id": 1, "channel_id": 1}, sort=[("timestamp", DESCENDING)])
+    if not latest:
+        return None
+    plan = await db.command({
+        "explain": {
+            "find": messages_collection.name,
+            "filter": {"user_id": latest["user_id"], "channel_id": latest["channel_id"], "timestamp": {"$gte": _start_of_day()}},
+            "sort": {"timestamp": -1},
+            "limit": 10
+        },
+        "verbosity": "executionStats"
+    })
+    execution = plan["executionStats"]
+    return {
+        "execution_ms": execution["executionTimeMillis"],
+        "keys_examined": execution["totalKeysExamined"],
+        "docs_examined": execution["totalDocsExamined"],
+        "returned": execution["nReturned"]
+    }
+
+async def save_github_token(slack_user_id: str, github_token: str):
     """Store or update a GitHub token for a Slack user"""
-    github_tokens_collection.update_one(
+    await github_tokens_collection.update_one(
         {"slack_user_id": slack_user_id},
         {"$set": {
             "github_token": github_token,
@@ -105,11 +661,194 @@ def save_github_token(slack_user_id: str, github_token: str):
         upsert=True
     )
 
-def get_github_token(slack_user_id: str) -> str:
+async def get_github_token(slack_user_id: str) -> str:
     """Retrieve a GitHub token for a Slack user"""
-    token_doc = github_tokens_collection.find_one({"slack_user_id": slack_user_id})
+    token_doc = await github_tokens_collection.find_one({"slack_user_id": slack_user_id}, {"_id": 0, "github_token": 1})
     return token_doc["github_token"] if token_doc else None
 
-def delete_github_token(slack_user_id: str):
-    """Remove a GitHub token for a Slack user"""
-    github_tokens_collection.delete_one({"slack_user_id": slack_user_id})
+async def delete_github_token(slack_user_id: str):
+    """Remove a GitHub token for a Slack user along with the activity snapshot synced with it"""
+    await github_tokens_collection.delete_one({"slack_user_id": slack_user_id})
+    await github_activity_snapshots_collection.delete_one({"slack_user_id": slack_user_id})
+
+async def get_github_tokens_without_login() -> list:
+    """The Slack users and tokens whose GitHub login hasn't been looked up yet"""
+    return await github_tokens_collection.find(
+        {"github_login": {"$exists": False}},
+        {"_id": 0, "slack_user_id": 1, "github_token": 1}
+    ).to_list()
+
+async def save_github_login(slack_user_id: str, github_login: str):
+    """Store the GitHub login behind a Slack user's token and claim the webhook events already received for it"""
+    await github_tokens_collection.update_one({"slack_user_id": slack_user_id}, {"$set": {"github_login": github_login}})
+    await github_activity_events_collection.update_many(
+        {"github_login": github_login, "slack_user_id": None},
+        {"$set": {"slack_user_id": slack_user_id}}
+    )
+
+async def get_slack_user_ids_by_github_login(github_logins: list) -> dict:
+    """Map GitHub logins to the Slack users that connected them"""
+    tokens = await github_tokens_collection.find(
+        {"github_login": {"$in": list(github_logins)}},
+        {"_id": 0, "slack_user_id": 1, "github_login": 1}
+    ).to_list()
+    return {token["github_login"]: token["slack_user_id"] for token in tokens}
+
+async def save_github_activity_events(events: list) -> int:
+    """
+    Append webhook activity events, each keyed by its own _id. An event that is already stored is left alone,
+    so redelivered or replayed webhooks don't duplicate activity. Returns how many were new.
+    """
+    if not events:
+        return 0
+    result = await github_activity_events_collection.bulk_write(
+        [UpdateOne({"_id": event["_id"]}, {"$setOnInsert": event}, upsert=True) for event in events],
+        ordered=False
+    )
+    return result.upserted_count
+
+async def get_github_activity_events(slack_user_id: str, since: datetime) -> list:
+    """A Slack user's webhook activity events since the given UTC datetime, oldest first"""
+    return await github_activity_events_collection.find(
+        {"slack_user_id": slack_user_id, "occurred_at": {"$gte": since}},
+        {"_id": 0}
+    ).sort("occurred_at", 1).to_list()
+
+async def get_github_connected_user_ids() -> list:
+    """Slack user ids of everyone with a GitHub token"""
+    return await github_tokens_collection.distinct("slack_user_id")
+
+async def get_github_activity_snapshot(slack_user_id: str):
+    """Retrieve the stored GitHub activity snapshot for a Slack user"""
+    return await github_activity_snapshots_collection.find_one({"slack_user_id": slack_user_id}, {"_id": 0})
+
+async def save_github_activity_snapshot(slack_user_id: str, commits: list, pull_requests: list, cursor: datetime, synced_at: datetime):
+    """Store a Slack user's GitHub activity snapshot with the cursor the next sync starts from"""
+    await github_activity_snapshots_collection.update_one(
+        {"slack_user_id": slack_user_id},
+        {"$set": {
+            "commits": commits,
+            "pull_requests": pull_requests,
+            "cursor": cursor,
+            "synced_at": synced_at
+        }},
+        upsert=True
+    )
+
+async def get_github_http_cache_entry(cache_key: str):
+    """Retrieve a cached GitHub API response and mark it as recently used"""
+    return await github_http_cache_collection.find_one_and_update(
+        {"_id": cache_key},
+        {"$set": {"last_used": datetime.now()}}
+    )
+
+async def save_github_http_cache_entry(cache_key: str, etag: str, last_modified: str, link: str, body, size: int, max_entries: int):
+    """Store a GitHub API response with its validators, evicting the least recently used entries over max_entries"""
+    await github_http_cache_collection.replace_one(
+        {"_id": cache_key},
+        {
+            "etag": etag,
+            "last_modified": last_modified,
+            "link": link,
+            "body": body,
+            "size": size,
+            "last_used": datetime.now()
+        },
+        upsert=True
+    )
+    excess = await github_http_cache_collection.estimated_document_count() - max_entries
+    if excess > 0:
+        stale_entries = await github_http_cache_collection.find({}, {"_id": 1}).sort("last_used", 1).limit(excess).to_list()
+        await github_http_cache_collection.delete_many({"_id": {"$in": [entry["_id"] for entry in stale_entries]}})
+
+async def save_user_schedule(user_id: str, timezone: str, send_time: str):
+    """Store or update the local time zone and send time of a user's scheduled standup message"""
+    await standup_schedules_collection.update_one(
+        {"user_id": user_id},
+        {"$set": {
+            "timezone": timezone,
+            "send_time": send_time,
+            "updated_at": datetime.now()
+        }},
+        upsert=True
+    )
+
+async def delete_user_schedules_not_in(user_ids):
+    """Remove schedules for users that are no longer in the standup user group"""
+    await standup_schedules_collection.delete_many({"user_id": {"$nin": list(user_ids)}})
+
+async def get_schedule_slots():
+    """Get every distinct (timezone, send_time) pair that has at least one user"""
+    cursor = await standup_schedules_collection.aggregate([
+        {"$group": {"_id": {"timezone": "$timezone", "send_time": "$send_time"}}}
+    ])
+    slots = await cursor.to_list()
+    return [(slot["_id"]["timezone"], slot["_id"]["send_time"]) for slot in slots]
+
+async def get_users_for_schedule_slot(timezone: str, send_time: str):
+    """Get the users whose standup message goes out at send_time in the given time zone"""
+    schedules = await standup_schedules_collection.find(
+        {"timezone": timezone, "send_time": send_time},
+        {"_id": 0, "user_id": 1}
+    ).to_list()
+    return [schedule["user_id"] for schedule in schedules]
+
+async def get_llm_cache_entry(cache_key: str):
+    """Retrieve a cached LLM response"""
+    return await llm_cache_collection.find_one({"_id": cache_key})
+
+async def save_llm_cache_entry(cache_key: str, generations: list, latency: float):
+    """Store an LLM response's messages along with how long it took to generate"""
+    await llm_cache_collection.replace_one(
+        {"_id": cache_key},
+        {
+            "generations": generations,
+            "latency": latency,
+            # TTL indexes compare against UTC
+            "created_at": datetime.utcnow()
+        },
+        upsert=True
+    )
+
+async def clear_llm_cache():
+    await llm_cache_collection.delete_many({})
+
+async def save_standup_draft(user_id: str, message: str, date = None):
+    """Store the pre-generated standup message for a user's day"""
+    await standup_drafts_collection.update_one(
+        {"user_id": user_id, "date": _date_string(date)},
+        {"$set": {"message": message, "created_at": datetime.now()}},
+        upsert=True
+    )
+
+async def get_standup_draft(user_id: str, date = None):
+    """Retrieve the pre-generated standup message for a user's day, or None if there isn't one"""
+    draft = await standup_drafts_collection.find_one({"user_id": user_id, "date": _date_string(date)}, {"_id": 0, "message": 1})
+    return draft["message"] if draft else None
+
+async def get_conversation_summary(user_id: str, channel_id: str, date = None):
+    """Retrieve the rolling summary of a day's earlier conversation, or None if nothing has been summarized yet"""
+    return await conversation_summaries_collection.find_one(
+        {"user_id": user_id, "channel_id": channel_id, "date": _date_string(date)},
+        {"_id": 0, "summary": 1, "summarized_until": 1}
+    )
+
+async def save_conversation_summary(user_id: str, channel_id: str, summary: str, summarized_until: datetime, previous_summarized_until: datetime = None, date = None) -> bool:
+    """
+    Store the rolling summary along with the timestamp of the newest message it covers, but only over the summary it extended:
+    previous_summarized_until is the cursor of that summary, None if there wasn't one. Returns False, writing nothing,
+    if the summary moved on in the meantime; the filter then matches nothing and the upsert collides with the existing summary.
+    """
+    try:
+        await conversation_summaries_collection.update_one(
+            {"user_id": user_id, "channel_id": channel_id, "date": _date_string(date), "summarized_until": previous_summarized_until},
+            {"$set": {
+                "summary": summary,
+                "summarized_until": summarized_until,
+                "updated_at": datetime.now()
+            }},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
@@ -0,0 +1,262 @@
+from apscheduler.schedulers.asyncio import AsyncIOScheduler, run_in_event_loop
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.jobstores.mongodb import MongoDBJobStore
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from datetime import datetime, timedelta
+from pymongo import MongoClient
+from dotenv import find_dotenv, load_dotenv
+import asyncio
+import os
+import pytz
+from .mongo_db_helpers import (
+    MONGO_URI, MONGO_DB_NAME, save_user_schedule, delete_user_schedules_not_in, get_schedule_slots, get_users_for_schedule_slot, get_github_connected_user_ids,
+    rollup_messages, get_collection_storage_stats, profile_messages_query
+)
+from .slack_helpers import enqueue_standup_messages, run_standup_send_worker, prepare_standup_drafts, get_standup_users_with_timezones
+from .github_helpers import sync_github_activity_snapshots, backfill_github_logins, GITHUB_ACTIVITY_SOURCE
+from .cluster_helpers import run_leader_election
+from .metrics_helpers import MongoCommandTimer, record_collection_stats, record_handled_error
+
+load_dotenv(find_dotenv())
+
+STANDUP_SEND_TIME = os.environ.get("STANDUP_SEND_TIME", "08:55") # 5 minutes before 9 am in each user's time zone
+# how long before the send time the drafts are generated; 0 turns pre-generation off
+STANDUP_DRAFT_LEAD_MINUTES = int(os.environ.get("STANDUP_DRAFT_LEAD_MINUTES", 30))
+SCHEDULE_SYNC_TIME = os.environ.get("SCHEDULE_SYNC_TIME", "00:00")
+SCHEDULE_SYNC_TIMEZONE = os.environ.get("SCHEDULE_SYNC_TIMEZONE", "UTC")
+# how late a run may still fire after a restart; runs missed by more than this are skipped rather than sent late
+STANDUP_MISFIRE_GRACE_SECONDS = int(os.environ.get("STANDUP_MISFIRE_GRACE_SECONDS", 3600))
+# how often every connected user's GitHub activity snapshot is synced; 0 leaves syncing to the readers
+GITHUB_SNAPSHOT_SYNC_MINUTES = int(os.environ.get("GITHUB_SNAPSHOT_SYNC_MINUTES", 15))
+MESSAGE_ROLLUP_TIME = os.environ.get("MESSAGE_ROLLUP_TIME", "01:00") # in SCHEDULE_SYNC_TIMEZONE
+# the rollup re-covers a few complete days so a missed night is caught up; must stay well under MESSAGE_RETENTION_DAYS
+MESSAGE_ROLLUP_LOOKBACK_DAYS = int(os.environ.get("MESSAGE_ROLLUP_LOOKBACK_DAYS", 2))
+
+SCHEDULE_SYNC_JOB_ID = "sync-standup-schedules"
+GITHUB_SNAPSHOT_SYNC_JOB_ID = "sync-github-snapshots"
+MESSAGE_ROLLUP_JOB_ID = "rollup-messages"
+
+class ThreadedJobStoreExecutor(AsyncIOExecutor):
+    """AsyncIOExecutor that can be handed jobs from another thread; the job's coroutine is still started on the event loop."""
+
+    def _do_submit_job(self, job, run_times):
+        self._eventloop.call_soon_threadsafe(super()._do_submit_job, job, run_times)
+
+class ThreadedJobStoreScheduler(AsyncIOScheduler):
+    """
+    AsyncIOScheduler that looks for due jobs in a worker thread. The MongoDB job store is synchronous, so reading the due jobs
+    and writing their next run times on the event loop would stall every turn in flight for those round-trips.
+    Job store calls made from the bot's coroutines, like add_job, go through asyncio.to_thread for the same reason.
+    """
+
+    _processing = None
+
+    @run_in_event_loop
+    def wakeup(self):
+        self._stop_timer()
+        # a wakeup while the last one is still reading the store runs after it, so the newest state sets the timer
+        previous = self._processing
+        self._processing = self._eventloop.create_task(self._process_jobs_in_thread(previous))
+
+    async def _process_jobs_in_thread(self, previous):
+        if previous:
+            await asyncio.gather(previous, return_exceptions=True)
+        wait_seconds = await asyncio.to_thread(self._process_jobs)
+        self._start_timer(wait_seconds)
+
+    def _create_default_executor(self):
+        return ThreadedJobStoreExecutor()
+
+# the job store is synchronous, so it gets its own pymongo client; jobs live next to the bot's other collections.
+# its queries are recorded as mongo spans too, so the time spent in the store shows up next to the bot's own queries.
+# a job store can't be shared by running schedulers, so every node starts one paused and only the leader resumes it
+scheduler = ThreadedJobStoreScheduler(
+    jobstores={
+        "default": MongoDBJobStore(database=MONGO_DB_NAME, collection="scheduled_jobs", client=MongoClient(MONGO_URI, event_listeners=[MongoCommandTimer()]))
+    },
+    job_defaults={
+        "coalesce": True,
+        "max_instances": 1,
+        "misfire_grace_time": STANDUP_MISFIRE_GRACE_SECONDS
+    }
+)
+
+def _slot_job_id(timezone, send_time):
+    return f"standup-{timezone}-{send_time}"
+
+def _draft_job_id(timezone, send_time):
+    return f"standup-draft-{timezone}-{send_time}"
+
+def _draft_time(send_time):
+    """The local time STANDUP_DRAFT_LEAD_MINUTES before send_time, wrapping past midnight."""
+    hour, minute = send_time.split(":")
+    minutes = (int(hour) * 60 + int(minute) - STANDUP_DRAFT_LEAD_MINUTES) % (24 * 60)
+    return minutes // 60, minutes % 60
+
+async def send_standup_slot(timezone: str, send_time: str):
+    """Queue the standup message for every user who shares this local time slot; the send workers on every node deliver them."""
+    users = await get_users_for_schedule_slot(timezone, send_time)
+    print(f"sending standup messages for {timezone} {send_time} to {len(users)} users")
+    if users:
+        date = datetime.now(pytz.timezone(timezone)).strftime("%Y-%m-%d")
+        await enqueue_standup_messages(users, date)
+
+async def prepare_standup_slot(timezone: str, send_time: str):
+    """Generate and store the standup drafts for everyone in this slot ahead of its send time."""
+    users = await get_users_for_schedule_slot(timezone, send_time)
+    if users:
+        if GITHUB_ACTIVITY_SOURCE == "snapshot":
+            # the drafts read the snapshots, so bring them up to date first instead of waiting for the next periodic sync
+            await sync_github_activity_snapshots(users)
+        # stored under the local date send_standup_slot will queue the jobs for, which is tomorrow when the lead time wraps past midnight
+        hour, minute = send_time.split(":")
+        send_date = datetime.now(pytz.timezone(timezone)).date()
+        if _draft_time(send_time) > (int(hour), int(minute)):
+            send_date += timedelta(days=1)
+        await prepare_standup_drafts(users, send_date.strftime("%Y-%m-%d"))
+
+async def sync_github_snapshots():
+    """Sync the GitHub activity snapshot of everyone with a connected account so standups read them instead of GitHub."""
+    found_logins = await backfill_github_logins()
+    if found_logins:
+        print(f"looked up {found_logins} missing github logins")
+    if GITHUB_ACTIVITY_SOURCE != "snapshot":
+        return
+    user_ids = await get_github_connected_user_ids()
+    results = await sync_github_activity_snapshots(user_ids)
+    print(f"github activity snapshots synced: {results['synced']} synced, {results['failed']} failed")
+
+async def rollup_daily_messages():
+    """
+    Compact the last MESSAGE_ROLLUP_LOOKBACK_DAYS complete days of messages into per-user rollups before the TTL index
+    expires them, and report the size of the messages and rollups collections before and after, the change between the two,
+    and the cost of the per-turn history query, so the effect of retention shows up night over night.
+    The stats are best effort on both sides: failing to collect them never blocks the rollup.
+    """
+    end = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    before = await _message_storage_stats()
+    rolled_up = await rollup_messages(end - timedelta(days=MESSAGE_ROLLUP_LOOKBACK_DAYS), end)
+    print(f"rolled up {rolled_up} user days of messages")
+    after = await _message_storage_stats()
+    if after is None:
+        return
+    record_collection_stats(after)
+    print(f"message storage before the rollup: {before}, after: {after}, change: {_storage_change(before, after)}")
+    try:
+        print(f"history query: {await profile_messages_query()}")
+    except Exception as e:
+        print(f"Error profiling the history query: {e}")
+        record_handled_error("message_storage_stats")
+
+async def _message_storage_stats():
+    """Storage stats of the messages and message_rollups collections, or None if they couldn't be collected."""
+    try:
+        return await get_collection_storage_stats(["messages", "message_rollups"])
+    except Exception as e:
+        print(f"Error collecting message storage stats: {e}")
+        record_handled_error("message_storage_stats")
+        return None
+
+def _storage_change(before, after):
+    """Per collection and stat, how much it grew (or shrank, if negative) from before to after; None without a before."""
+    if before is None:
+        return None
+    return {
+        name: {stat: value - before.get(name, {}).get(stat, 0) for stat, value in stats.items()}
+        for name, stats in after.items()
+    }
+
+async def sync_standup_schedules():
+    """
+    Refresh every user's time zone from Slack and make sure there is exactly one job per (time zone, send time) slot.
+    Jobs are keyed by slot, so re-running this after a restart replaces jobs instead of duplicating them.
+    """
+    user_timezones = await get_standup_users_with_timezones()
+    for user_id, timezone in user_timezones.items():
+        if timezone not in pytz.all_timezones_set:
+            timezone = "UTC"
+        await save_user_schedule(user_id, timezone, STANDUP_SEND_TIME)
+    await delete_user_schedules_not_in(user_timezones.keys())
+
+    slots = await get_schedule_slots()
+    # the job store is synchronous, so the job reads and writes run off the event loop
+    await asyncio.to_thread(_sync_slot_jobs, slots)
+    print(f"standup schedule synced: {len(user_timezones)} users across {len(slots)} time slots")
+
+def _sync_slot_jobs(slots):
+    """Add the send and draft jobs of any slot that doesn't have them yet and remove the jobs of slots that are gone."""
+    slot_job_ids = set()
+    for timezone, send_time in slots:
+        hour, minute = send_time.split(":")
+        job_id = _slot_job_id(timezone, send_time)
+        slot_job_ids.add(job_id)
+        # keep the stored next run time of existing jobs so a pending run isn't lost or repeated
+        if not scheduler.get_job(job_id):
+            scheduler.add_job(
+                "helpers.scheduler_helpers:send_standup_slot",
+                CronTrigger(hour=int(hour), minute=int(minute), timezone=pytz.timezone(timezone)),
+                args=[timezone, send_time],
+                id=job_id
+            )
+        if STANDUP_DRAFT_LEAD_MINUTES <= 0:
+            continue
+        draft_job_id = _draft_job_id(timezone, send_time)
+        slot_job_ids.add(draft_job_id)
+        if not scheduler.get_job(draft_job_id):
+            draft_hour, draft_minute = _draft_time(send_time)
+            scheduler.add_job(
+                "helpers.scheduler_helpers:prepare_standup_slot",
+                CronTrigger(hour=draft_hour, minute=draft_minute, timezone=pytz.timezone(timezone)),
+                args=[timezone, send_time],
+                id=draft_job_id
+            )
+
+    for job in scheduler.get_jobs():
+        if job.id.startswith("standup-") and job.id not in slot_job_ids:
+            job.remove()
+
+async def start_standup_scheduler():
+    """Start the scheduler paused; run_standup_node resumes it while this node is the leader."""
+    # this connects the job store on the event loop, but only once at startup, before any message is handled
+    scheduler.start(paused=True)
+
+async def run_standup_node():
+    """Elect a leader to run the scheduled jobs, and work the standup send queue, until cancelled."""
+    await asyncio.gather(run_leader_election(_start_leading, _stop_leading), run_standup_send_worker())
+
+async def _stop_leading():
+    scheduler.pause()
+
+async def _start_leading():
+    scheduler.resume()
+    await asyncio.to_thread(_add_leader_jobs)
+    await sync_standup_schedules()
+
+def _add_leader_jobs():
+    # time zones change and people join the user group, so refresh the slots once a day
+    sync_hour, sync_minute = SCHEDULE_SYNC_TIME.split(":")
+    scheduler.add_job(
+        "helpers.scheduler_helpers:sync_standup_schedules",
+        CronTrigger(hour=int(sync_hour), minute=int(sync_minute), timezone=pytz.timezone(SCHEDULE_SYNC_TIMEZONE)),
+        id=SCHEDULE_SYNC_JOB_ID,
+        replace_existing=True
+    )
+    rollup_hour, rollup_minute = MESSAGE_ROLLUP_TIME.split(":")
+    scheduler.add_job(
+        "helpers.scheduler_helpers:rollup_daily_messages",
+        CronTrigger(hour=int(rollup_hour), minute=int(rollup_minute), timezone=pytz.timezone(SCHEDULE_SYNC_TIMEZONE)),
+        id=MESSAGE_ROLLUP_JOB_ID,
+        replace_existing=True
+    )
+    if GITHUB_SNAPSHOT_SYNC_MINUTES > 0:
+        # first run right away so the snapshots are warm after a restart or a change of leader
+        scheduler.add_job(
+            "helpers.scheduler_helpers:sync_github_snapshots",
+            IntervalTrigger(minutes=GITHUB_SNAPSHOT_SYNC_MINUTES),
+            id=GITHUB_SNAPSHOT_SYNC_JOB_ID,
+            next_run_time=datetime.now(pytz.utc),
+            replace_existing=True
+        )
+    elif scheduler.get_job(GITHUB_SNAPSHOT_SYNC_JOB_ID):
+        scheduler.remove_job(GITHUB_SNAPSHOT_SYNC_JOB_ID)
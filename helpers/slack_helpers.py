@@ -1,29 +1,173 @@
-from slack_sdk import WebClient
+from slack_sdk.web.async_client import AsyncWebClient
 from slack_sdk.errors import SlackApiError
-from datetime import datetime, timedelta
+from slack_sdk.http_retry.builtin_async_handlers import AsyncRateLimitErrorRetryHandler
+from datetime import datetime, timedelta, timezone
 from dotenv import find_dotenv, load_dotenv
 import os
-from .mongo_db_helpers import persist_scheduled_message, standup_message_sent, insert_item
-from .llm_helpers import derive_standup_message, create_standup_update
+import time
+import asyncio
+import random
+import statistics
+from .mongo_db_helpers import (
+    persist_scheduled_message, standup_message_sent, insert_item, save_standup_draft, get_standup_draft,
+    enqueue_standup_send_jobs, claim_standup_send_job, complete_standup_send_job, retry_standup_send_job, get_standup_send_queue_stats
+)
+from .llm_helpers import derive_standup_message, derive_standup_messages, create_standup_update
 from .github_helpers import get_github_token, generate_github_oauth_url
+from .metrics_helpers import timed, record_handled_error, record_standup_send_job, record_standup_send_queue
+from .cluster_helpers import NODE_ID
 
 load_dotenv(find_dotenv())
 
-slack_client = WebClient(token=os.environ["SLACK_BOT_TOKEN"])
+class TimedAsyncWebClient(AsyncWebClient):
+    """AsyncWebClient that records every Web API call, rate limit retries included, as a slack span."""
+
+    async def api_call(self, api_method, **kwargs):
+        with timed("slack", api_method):
+            return await super().api_call(api_method, **kwargs)
+
+slack_client = TimedAsyncWebClient(token=os.environ["SLACK_BOT_TOKEN"])
+# on HTTP 429 wait for Slack's Retry-After and try again instead of dropping the message
+slack_client.retry_handlers.append(AsyncRateLimitErrorRetryHandler(max_retry_count=3))
 _usergroup_id = os.environ["SLACK_USER_GROUP_ID"]
+DEFAULT_STANDUP_TIMEZONE = os.environ.get("DEFAULT_STANDUP_TIMEZONE", "America/Los_Angeles")
+STANDUP_FANOUT_MAX_WORKERS = int(os.environ.get("STANDUP_FANOUT_MAX_WORKERS", 20))
+STANDUP_SEND_MAX_ATTEMPTS = int(os.environ.get("STANDUP_SEND_MAX_ATTEMPTS", 5))
+# how long a worker may take to send one user's message before the job is handed to another worker
+STANDUP_SEND_VISIBILITY_TIMEOUT_SECONDS = int(os.environ.get("STANDUP_SEND_VISIBILITY_TIMEOUT_SECONDS", 300))
+STANDUP_SEND_RETRY_BASE_SECONDS = int(os.environ.get("STANDUP_SEND_RETRY_BASE_SECONDS", 30))
+STANDUP_SEND_RETRY_MAX_SECONDS = int(os.environ.get("STANDUP_SEND_RETRY_MAX_SECONDS", 900))
+# how often an idle worker checks the queue for due jobs
+STANDUP_SEND_POLL_SECONDS = float(os.environ.get("STANDUP_SEND_POLL_SECONDS", 2))
+# message metadata event type a standup post carries, with the send job's _id as payload, so a retry can find it
+STANDUP_SEND_EVENT_TYPE = "standup_send"
+# slack errors that retrying won't fix
+PERMANENT_SLACK_ERRORS = {"channel_not_found", "user_not_found", "not_in_channel", "is_archived", "account_inactive", "user_disabled", "cannot_dm_bot", "invalid_auth", "not_authed"}
+SLACK_STREAMING_REPLIES = os.environ.get("SLACK_STREAMING_REPLIES", "true").lower() == "true"
+# streamed text is pushed at most this often per reply, and only while the shared chat.update budget allows
+SLACK_STREAM_UPDATE_INTERVAL = float(os.environ.get("SLACK_STREAM_UPDATE_INTERVAL", 1.0))
+# chat.update is a tier 3 method (~50 calls a minute) shared by every reply being streamed at once
+SLACK_CHAT_UPDATES_PER_MINUTE = float(os.environ.get("SLACK_CHAT_UPDATES_PER_MINUTE", 40))
+SLACK_CHAT_UPDATE_BURST = float(os.environ.get("SLACK_CHAT_UPDATE_BURST", 10))
+STREAM_PLACEHOLDER_TEXT = ":hourglass_flowing_sand: Thinking..."
+STREAM_ERROR_TEXT = "Sorry, something went wrong while answering that. Please try again."
+
+class TokenBucket:
+    """Refills rate tokens a second up to capacity. Not awaitable: callers that find it empty skip the call instead of waiting."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def take(self, force=False):
+        """Take a token if there is one. force always takes it, going into debt that later takers wait out."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1 and not force:
+            return False
+        self.tokens -= 1
+        return True
+
+# one budget for the whole process, so the morning rush of concurrent turns stays under the chat.update limit
+chat_update_budget = TokenBucket(SLACK_CHAT_UPDATES_PER_MINUTE / 60, SLACK_CHAT_UPDATE_BURST)
+
+class SlackReplyStreamer:
+    """
+    Posts a placeholder reply right away and edits it as LLM tokens arrive.
+    Tokens are buffered and flushed by a background task every SLACK_STREAM_UPDATE_INTERVAL seconds,
+    so a fast stream turns into a handful of chat.update calls instead of one per token. A flush is skipped while
+    chat_update_budget is empty; the final reply is always pushed.
+    """
+
+    def __init__(self, channel_id, started_at=None):
+        self.channel_id = channel_id
+        self.started_at = started_at or time.perf_counter()
+        self.text = ""
+        self.ts = None
+        # seconds from the start of the turn until the first generated text was visible in Slack
+        self.time_to_first_visible_token = None
+        self._dirty = False
+        self._flusher = None
+
+    async def start(self):
+        response = await slack_client.chat_postMessage(channel=self.channel_id, text=STREAM_PLACEHOLDER_TEXT)
+        self.channel_id = response["channel"]
+        self.ts = response["ts"]
+        self._flusher = asyncio.create_task(self._flush_periodically())
+
+    def reset(self):
+        """Start over for a new LLM call; its text replaces whatever an earlier call streamed."""
+        self.text = ""
+        self._dirty = False
 
-def _get_all_users():
+    def append(self, chunk: str):
+        if chunk:
+            self.text += chunk
+            self._dirty = True
+
+    async def finish(self, text: str):
+        """Stop streaming and leave the message showing the final reply."""
+        self.stop()
+        self.text = text
+        chat_update_budget.take(force=True)
+        await self._push()
+
+    def stop(self):
+        if self._flusher:
+            self._flusher.cancel()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(SLACK_STREAM_UPDATE_INTERVAL)
+            # an intermediate update can wait for the next tick; the text stays dirty until it goes out
+            if self._dirty and chat_update_budget.take():
+                await self._push()
+
+    async def _push(self):
+        self._dirty = False
+        try:
+            await slack_client.chat_update(channel=self.channel_id, ts=self.ts, text=self.text or STREAM_PLACEHOLDER_TEXT)
+        except SlackApiError as e:
+            print(f"Error updating streamed reply: {e.response['error']}")
+            record_handled_error("stream_reply")
+            return
+        if self.time_to_first_visible_token is None and self.text:
+            self.time_to_first_visible_token = time.perf_counter() - self.started_at
+
+async def _get_all_users():
     try:
-        response = slack_client.usergroups_users_list(usergroup=_usergroup_id)
+        response = await slack_client.usergroups_users_list(usergroup=_usergroup_id)
         users = response["users"]
         return users
     except SlackApiError as e:
         print(f"Error fetching users: {e.response['error']}")
         raise e
 
-def fetch_conversation_history(channel_id, date=None, max_number_of_messages_to_fetch=10):
+async def get_standup_users_with_timezones():
+    """Map every user in the standup user group to the time zone on their Slack profile."""
+    members = set(await _get_all_users())
+    timezones = {}
+    cursor = None
+    # users.list returns tz for a whole page of users, which is far fewer calls than users.info per member
+    while True:
+        response = await slack_client.users_list(cursor=cursor, limit=200)
+        for user in response["members"]:
+            if user["id"] in members:
+                timezones[user["id"]] = user.get("tz") or DEFAULT_STANDUP_TIMEZONE
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            break
+    # members we couldn't find in the directory still get a message
+    for user_id in members - timezones.keys():
+        timezones[user_id] = DEFAULT_STANDUP_TIMEZONE
+    return timezones
+
+async def fetch_conversation_history(channel_id, date=None, max_number_of_messages_to_fetch=10):
     try:
-        response = slack_client.conversations_history(channel=channel_id)
+        response = await slack_client.conversations_history(channel=channel_id)
         messages = response["messages"]
         target_date = datetime.strptime(date, "%Y-%m-%d") if date else datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
         start_timestamp = target_date.timestamp()
@@ -32,85 +176,218 @@ def fetch_conversation_history(channel_id, date=None, max_number_of_messages_to_
         print(f"Error fetching conversation history: {e.response['error']}")
         return []
 
-async def send_standup_messages():
-    users = _get_all_users()
-    now = datetime.now()
-    for user_id in users:
+async def send_standup_messages(users=None, date=None):
+    """
+    Queue the morning standup message for the given YYYY-MM-DD date, or today, to the given users, or to the whole
+    user group if none are given, and work the queue until it is empty. Workers on other nodes help drain it.
+    """
+    users = users if users is not None else await _get_all_users()
+    await enqueue_standup_messages(users, date or datetime.now().strftime("%Y-%m-%d"))
+    return await process_standup_send_queue()
+
+async def enqueue_standup_messages(users, date):
+    """Add a send job per user to the durable queue. A user already queued for the date isn't queued again."""
+    queued = await enqueue_standup_send_jobs(users, date, STANDUP_SEND_MAX_ATTEMPTS)
+    print(f"queued {queued}/{len(users)} standup messages for {date}")
+    return queued
+
+async def run_standup_send_worker():
+    """Work the standup send queue until cancelled. Every node runs one, so a restart picks up where the queue left off."""
+    while True:
+        fanout_stats = None
         try:
-            standup_message = None
-            github_token = get_github_token(user_id)
-            if not github_token:
-                oauth_url = generate_github_oauth_url(user_id, user_id)
-                response = {
-                    "blocks": [
+            fanout_stats = await process_standup_send_queue()
+            await _record_standup_send_queue()
+        except Exception as e:
+            print(f"Error working the standup send queue: {e}")
+            record_handled_error("standup_send_queue")
+        # keep going straight away while there was work
+        if not fanout_stats or not fanout_stats["users"]:
+            await asyncio.sleep(STANDUP_SEND_POLL_SECONDS)
+
+async def process_standup_send_queue():
+    """Run due send jobs with up to STANDUP_FANOUT_MAX_WORKERS at a time until none are due. Returns the fan-out stats."""
+    start = time.perf_counter()
+    job_durations = []
+
+    # each worker keeps claiming jobs; one holds GitHub requests and an LLM call at a time
+    async def work():
+        while job := await claim_standup_send_job(NODE_ID, STANDUP_SEND_VISIBILITY_TIMEOUT_SECONDS):
+            job_start = time.perf_counter()
+            await _run_standup_send_job(job)
+            job_durations.append(time.perf_counter() - job_start)
+
+    await asyncio.gather(*[work() for _ in range(STANDUP_FANOUT_MAX_WORKERS)])
+    fanout_stats = _summarize_fanout(job_durations, time.perf_counter() - start)
+    if job_durations:
+        print("standup fan-out stats: ", fanout_stats)
+    return fanout_stats
+
+async def _run_standup_send_job(job):
+    user_id = job["user_id"]
+    if job["attempts"] > job["max_attempts"]:
+        # the last attempt ran out of time without reporting back
+        await complete_standup_send_job(job["_id"], NODE_ID, "failed", job.get("last_error") or "visibility timeout")
+        record_standup_send_job("failed")
+        return
+    try:
+        # a redelivered job may have posted before its worker stopped; the persisted message says so
+        if not await standup_message_sent(user_id, job["date"]):
+            # unless the worker stopped between posting and persisting; then Slack has the post, tagged with the job's _id
+            posted = await _find_standup_post(job) if job["attempts"] > 1 else None
+            if posted:
+                print(f"the standup message for {user_id} was already posted by an earlier attempt")
+                await persist_scheduled_message(user_id, posted.get("text"), datetime.fromtimestamp(float(posted["ts"])), job["date"])
+            else:
+                await _send_standup_message(user_id, job["date"], job["_id"])
+        await complete_standup_send_job(job["_id"], NODE_ID, "sent")
+        record_standup_send_job("sent")
+    except Exception as e:
+        error = e.response["error"] if isinstance(e, SlackApiError) else str(e)
+        record_handled_error("send_standup_message")
+        if (isinstance(e, SlackApiError) and error in PERMANENT_SLACK_ERRORS) or job["attempts"] >= job["max_attempts"]:
+            print(f"Giving up on the standup message for {user_id} after {job['attempts']} attempts: {error}")
+            await complete_standup_send_job(job["_id"], NODE_ID, "failed", error)
+            record_standup_send_job("failed")
+            return
+        # exponential backoff with jitter so a Slack or GitHub outage isn't hit by every retry at once
+        delay = min(STANDUP_SEND_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1), STANDUP_SEND_RETRY_MAX_SECONDS) * random.uniform(0.5, 1)
+        print(f"Error sending the standup message to {user_id}, retrying in {delay:.0f}s: {error}")
+        await retry_standup_send_job(job["_id"], NODE_ID, datetime.utcnow() + timedelta(seconds=delay), error)
+        record_standup_send_job("retried")
+
+async def _find_standup_post(job):
+    """
+    The standup message an earlier attempt at job posted to the user, found by the job's _id in the metadata of the DM's
+    messages since the job's send intent was recorded, or None if nothing was posted.
+    """
+    response = await slack_client.conversations_open(users=job["user_id"])
+    channel_id = response["channel"]["id"]
+    # send_intent_at is stored in UTC
+    oldest = str(job["send_intent_at"].replace(tzinfo=timezone.utc).timestamp())
+    cursor = None
+    while True:
+        response = await slack_client.conversations_history(channel=channel_id, oldest=oldest, include_all_metadata=True, limit=200, cursor=cursor)
+        for message in response["messages"]:
+            metadata = message.get("metadata") or {}
+            if metadata.get("event_type") == STANDUP_SEND_EVENT_TYPE and metadata.get("event_payload", {}).get("job_id") == job["_id"]:
+                return message
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            return None
+
+async def _record_standup_send_queue():
+    queue_stats = await get_standup_send_queue_stats()
+    record_standup_send_queue(queue_stats["depth"], queue_stats["oldest_age_seconds"])
+
+async def _send_standup_message(user_id, date, job_id):
+    """
+    Post the user's standup message for date, their local YYYY-MM-DD day, tagged with the send job's _id.
+    Errors are left to the send queue to retry.
+    """
+    standup_message = None
+    metadata = {"event_type": STANDUP_SEND_EVENT_TYPE, "event_payload": {"job_id": job_id}}
+    github_token = await get_github_token(user_id)
+    if not github_token:
+        oauth_url = generate_github_oauth_url(user_id, user_id)
+        response = {
+            "blocks": [
+                {
+                    "type": "header",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "Good morning! :wave: Time for your standup update!"
+                    }
+                },
+                {
+                    "type": "section",
+                    "text": {
+                        "type": "mrkdwn",
+                        "text": "It looks like you haven't connected your GitHub account to the standup bot yet. Please connect your GitHub account to the standup bot so that I can help you with your standup updates. You can do this by clicking the button below."
+                    }
+                },
+                {
+                    "type": "actions",
+                    "elements": [
                         {
-                            "type": "header",
+                            "type": "button",
                             "text": {
                                 "type": "plain_text",
-                                "text": "Good morning! :wave: Time for your standup update!"
-                            }
-                        },
-                        {
-                            "type": "section",
-                            "text": {
-                                "type": "mrkdwn",
-                                "text": "It looks like you haven't connected your GitHub account to the standup bot yet. Please connect your GitHub account to the standup bot so that I can help you with your standup updates. You can do this by clicking the button below."
-                            }
-                        },
-                        {
-                            "type": "actions",
-                            "elements": [
-                                {
-                                    "type": "button",
-                                    "text": {
-                                        "type": "plain_text",
-                                        "text": "Connect GitHub"
-                                    },
-                                    "url": oauth_url,
-                                    "style": "primary"
-                                }
-                            ]
-                        },
-                        {
-                            "type": "section",
-                            "text": {
-                                "type": "mrkdwn",
-                                "text": "In the meantime, please provide your standup update including your statuses, plans for today, and any blockers you're facing. Thank you!"
-                            }
+                                "text": "Connect GitHub"
+                            },
+                            "url": oauth_url,
+                            "style": "primary"
                         }
-                    ],
-                    "response_type": "ephemeral"
+                    ]
+                },
+                {
+                    "type": "section",
+                    "text": {
+                        "type": "mrkdwn",
+                        "text": "In the meantime, please provide your standup update including your statuses, plans for today, and any blockers you're facing. Thank you!"
+                    }
                 }
-                standup_message = "Hello! Please provide your standup update including your statuses, plans for today, and any blockers you're facing. Thank you!"
-                slack_client.chat_postMessage(
-                    channel=user_id,
-                    blocks=response["blocks"],
-                    text=standup_message
-                )
-            else:
-                standup_message = derive_standup_message(user_id)
-                # slack_client.chat_scheduleMessage(
-                #     channel=user_id,
-                #     text=standup_message,
-                #     post_at=int(datetime.combine(now.date(), datetime.min.time()).timestamp()) + 9 * 60 * 60 # 9 am current day
-                # )
-
-                # TODO: Remove this after testing
-                slack_client.chat_postMessage(
-                    channel=user_id,
-                    text=standup_message
-                )
-            persist_scheduled_message(user_id, standup_message, now)
-        except SlackApiError as e:
-            print(f"Error sending message to {user_id}: {e.response['error']}")
+            ],
+            "response_type": "ephemeral"
+        }
+        standup_message = "Hello! Please provide your standup update including your statuses, plans for today, and any blockers you're facing. Thank you!"
+        await slack_client.chat_postMessage(
+            channel=user_id,
+            blocks=response["blocks"],
+            text=standup_message,
+            metadata=metadata
+        )
+    else:
+        # drafts are generated ahead of the send time by prepare_standup_drafts; derive one live if that didn't happen
+        standup_message = await get_standup_draft(user_id, date) or await derive_standup_message(user_id)
+        # slack_client.chat_scheduleMessage(
+        #     channel=user_id,
+        #     text=standup_message,
+        #     post_at=int(datetime.combine(now.date(), datetime.min.time()).timestamp()) + 9 * 60 * 60 # 9 am current day
+        # )
+
+        # TODO: Remove this after testing
+        await slack_client.chat_postMessage(
+            channel=user_id,
+            text=standup_message,
+            metadata=metadata
+        )
+    await persist_scheduled_message(user_id, standup_message, datetime.now(), date)
+
+async def prepare_standup_drafts(users, date=None):
+    """
+    Generate the standup messages for users with a connected GitHub account ahead of the send time and store them as drafts
+    for date, the YYYY-MM-DD day the send job is queued for, so the send itself is just a Slack post.
+    """
+    start = time.perf_counter()
+    github_tokens = await asyncio.gather(*[get_github_token(user_id) for user_id in users])
+    connected_users = [user_id for user_id, github_token in zip(users, github_tokens) if github_token]
+    standup_messages = await derive_standup_messages(connected_users)
+    await asyncio.gather(*[save_standup_draft(user_id, message, date) for user_id, message in standup_messages.items()])
+    print(f"prepared {len(standup_messages)}/{len(connected_users)} standup drafts in {time.perf_counter() - start:.1f}s")
+    return standup_messages
+
+def _summarize_fanout(per_user_durations, wall_time):
+    """Total fan-out wall time and the per-user p50/p95 in seconds."""
+    if len(per_user_durations) > 1:
+        percentiles = statistics.quantiles(per_user_durations, n=100, method="inclusive")
+        p50, p95 = percentiles[49], percentiles[94]
+    else:
+        p50 = p95 = per_user_durations[0] if per_user_durations else 0.0
+    return {
+        "users": len(per_user_durations),
+        "wall_time": round(wall_time, 3),
+        "p50": round(p50, 3),
+        "p95": round(p95, 3)
+    }
 
-def send_github_oauth_message(channel_id, user_id):
+async def send_github_oauth_message(channel_id, user_id):
     # slack_client.chat_postMessage(
     #     channel=channel_id,
     #     user=user_id,
     #     text="Successfully connected your GitHub account! :white_check_mark:"
     # )
-    slack_client.chat_postMessage(
+    await slack_client.chat_postMessage(
         channel=user_id,
         user=user_id,
         text="Successfully connected your GitHub account! :white_check_mark:"
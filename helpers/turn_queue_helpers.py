@@ -0,0 +1,104 @@
+import asyncio
+import os
+import time
+from dotenv import find_dotenv, load_dotenv
+from .metrics_helpers import record_coalesced_messages, record_handled_error
+
+load_dotenv(find_dotenv())
+
+# how long a user has to be quiet before their messages are answered as one turn
+MESSAGE_DEBOUNCE_SECONDS = float(os.environ.get("MESSAGE_DEBOUNCE_SECONDS", 1.5))
+# upper bound on the wait from a turn's first message, so someone typing non-stop still gets a reply
+MESSAGE_DEBOUNCE_MAX_SECONDS = float(os.environ.get("MESSAGE_DEBOUNCE_MAX_SECONDS", 6))
+
+class UserTurnQueue:
+    """
+    Per-user inbound queue in front of the turn pipeline. Messages a user sends in quick succession are merged
+    into one turn once they have been quiet for debounce_seconds, and a user never has more than one turn running,
+    so a standup sent as several short messages gets one answer and one write to the day's update.
+    Messages that arrive while a turn is running are answered by the next turn.
+
+    start_turn(message, arrived_at), if given, runs as soon as a turn's first message is picked up, before the debounce
+    wait, so the user sees something right away; whatever it returns is handed to run_turn(message, say, arrived_at, started).
+    Times are time.perf_counter() values.
+    """
+
+    def __init__(self, run_turn, debounce_seconds=MESSAGE_DEBOUNCE_SECONDS, max_wait_seconds=MESSAGE_DEBOUNCE_MAX_SECONDS, start_turn=None):
+        self.run_turn = run_turn
+        self.start_turn = start_turn
+        self.debounce_seconds = debounce_seconds
+        self.max_wait_seconds = max_wait_seconds
+        # user id -> [(message, say, arrived_at)] waiting for the next turn, oldest first
+        self._pending = {}
+        self._last_arrival = {}
+        self._workers = {}
+
+    def submit(self, message, say):
+        user_id = message["user"]
+        arrived_at = time.perf_counter()
+        self._pending.setdefault(user_id, []).append((message, say, arrived_at))
+        self._last_arrival[user_id] = arrived_at
+        if user_id not in self._workers:
+            self._workers[user_id] = asyncio.create_task(self._work(user_id))
+
+    async def join(self):
+        """Wait until every queued message has been answered."""
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
+
+    async def _work(self, user_id):
+        try:
+            while self._pending.get(user_id):
+                first_message, _, first_arrival = self._pending[user_id][0]
+                started = await self._start_turn(user_id, first_message, first_arrival)
+                # keep waiting while messages keep coming, up to max_wait_seconds from the first one
+                while True:
+                    quiet_at = self._last_arrival[user_id] + self.debounce_seconds
+                    wait = min(quiet_at, first_arrival + self.max_wait_seconds) - time.perf_counter()
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                batch = self._take_batch(user_id)
+                if len(batch) > 1:
+                    print(f"merged {len(batch)} messages from {user_id} into one turn")
+                    record_coalesced_messages(len(batch) - 1)
+                message, say = _merge(batch)
+                try:
+                    await self.run_turn(message, say, first_arrival, started)
+                except Exception as e:
+                    # one failed turn shouldn't drop the messages queued behind it
+                    print(f"Error handling message from {user_id}: {e}")
+                    record_handled_error("turn")
+        finally:
+            self._workers.pop(user_id, None)
+            if not self._pending.get(user_id):
+                self._pending.pop(user_id, None)
+                self._last_arrival.pop(user_id, None)
+
+    async def _start_turn(self, user_id, message, arrived_at):
+        if not self.start_turn:
+            return None
+        try:
+            return await self.start_turn(message, arrived_at)
+        except Exception as e:
+            # the turn still runs, just without whatever start_turn would have shown
+            print(f"Error starting turn for {user_id}: {e}")
+            record_handled_error("turn")
+            return None
+
+    def _take_batch(self, user_id):
+        """The pending messages from the channel of the oldest one, up to the first message from another channel."""
+        pending = self._pending[user_id]
+        channel = pending[0][0]["channel"]
+        size = 1
+        while size < len(pending) and pending[size][0]["channel"] == channel:
+            size += 1
+        self._pending[user_id] = pending[size:]
+        return pending[:size]
+
+def _merge(batch):
+    """One message with the texts of the batch in order, answered through the latest message's say."""
+    message, say, _ = batch[-1]
+    if len(batch) > 1:
+        message = {**message, "text": "\n".join(queued_message["text"] for queued_message, _, _ in batch)}
+    return message, say
@@ -1,30 +1,83 @@
 from dotenv import find_dotenv, load_dotenv
 import os
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import time
+import asyncio
+import uvicorn
 import helpers.slack_helpers as slack_helpers
-from helpers.mongo_db_helpers import get_standup_updates_by_user_id, delete_item, save_message_to_db, delete_github_token
+from helpers.scheduler_helpers import start_standup_scheduler, run_standup_node
+from helpers.mongo_db_helpers import (
+    get_standup_updates_by_user_id, delete_item, save_message_to_db, delete_github_token, ensure_indexes, check_hot_query_plans,
+    backfill_update_items, get_team_blockers, get_stale_items
+)
+from helpers.format_helpers import format_team_blockers_to_slack, format_stale_items_to_slack, load_token_encoding
 from helpers.github_helpers import generate_github_oauth_url, get_github_activity
 from slack_bolt.app.async_app import AsyncApp
 from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from helpers.context_helpers import build_turn_context
+from helpers.llm_helpers import refresh_conversation_summary
+from helpers.metrics_helpers import record_turn
+from helpers.turn_queue_helpers import UserTurnQueue
 from tool_agent import execute_agent_with_user_context
 from reply_agent import reply
-from github_oauth_connection import GitHubCallbackHandler
+from github_oauth_connection import oauth_app, CALLBACK_SERVER_HOST, CALLBACK_SERVER_PORT
 
 load_dotenv(find_dotenv())
 
 app = AsyncApp(token=os.environ["SLACK_BOT_TOKEN"])
+# keep references to fire-and-forget tasks so they aren't garbage collected before they finish
+_background_tasks = set()
 
 @app.message()
 async def respond_to_message(message, say):
-    save_message_to_db(message["user"], message["text"], message["channel"], False)
-    tool_agent_response, used_tool = execute_agent_with_user_context(message["text"], message["user"], message["channel"])
-    if not tool_agent_response:
-        await say(text="Sorry, I didn't understand that.")
-        return
-    print("tool agent response is: ", tool_agent_response)
-    reply_agent_response = reply(tool_agent_response, message["channel"], message["user"], message["text"], used_tool)
-    save_message_to_db(message["user"], reply_agent_response, message["channel"], True)
-    await say(text=reply_agent_response)
+    """Save the message and queue it; bursts from one user are answered as a single turn by run_turn."""
+    await save_message_to_db(message["user"], message["text"], message["channel"], False)
+    turn_queue.submit(message, say)
+
+async def start_turn(message, arrived_at):
+    """Show a placeholder as soon as a turn's first message is picked up, before the debounce wait, to fill in as the reply is generated."""
+    if not slack_helpers.SLACK_STREAMING_REPLIES:
+        return None
+    reply_stream = slack_helpers.SlackReplyStreamer(message["channel"], arrived_at)
+    await reply_stream.start()
+    return reply_stream
+
+async def run_turn(message, say, turn_start=None, reply_stream=None):
+    # latency counts from when the turn's first message arrived, so it includes the debounce wait
+    turn_start = turn_start or time.perf_counter()
+
+    async def send(text):
+        if reply_stream:
+            await reply_stream.finish(text)
+        else:
+            await say(text=text)
+
+    try:
+        context = await build_turn_context(message["user"], message["channel"], message["text"], reply_stream)
+        tool_agent_response, used_tool = await execute_agent_with_user_context(context)
+        if not tool_agent_response:
+            await send("Sorry, I didn't understand that.")
+            return
+        print("tool agent response is: ", tool_agent_response)
+        reply_agent_response = await reply(tool_agent_response, context, used_tool)
+        await save_message_to_db(message["user"], reply_agent_response, message["channel"], True)
+        await send(reply_agent_response)
+        turn_latency = time.perf_counter() - turn_start
+        time_to_first_visible_token = reply_stream.time_to_first_visible_token if reply_stream else None
+        record_turn(turn_latency, time_to_first_visible_token)
+        print(f"turn latency: {turn_latency:.2f}s, time to first visible token: {time_to_first_visible_token}")
+        # after the reply is out, but still inside the user's turn so it never overlaps another refresh or the next turn:
+        # fold messages that left the history window into the day's summary
+        await refresh_conversation_summary(context)
+    except Exception:
+        # don't leave the placeholder thinking forever; the turn queue logs the error
+        if reply_stream:
+            await reply_stream.finish(slack_helpers.STREAM_ERROR_TEXT)
+        raise
+    finally:
+        if reply_stream:
+            reply_stream.stop()
+
+turn_queue = UserTurnQueue(run_turn, start_turn=start_turn)
 
 @app.command("/get_updates")
 async def get_updates(ack, body):
@@ -87,7 +140,7 @@ async def handle_standup_command(ack, respond, command):
     slack_user_id = command['user_id']
     
     # Get GitHub activity
-    github_data = get_github_activity(slack_user_id)
+    github_data = await get_github_activity(slack_user_id)
     
     if isinstance(github_data, str):
         # User needs to connect GitHub
@@ -109,32 +162,45 @@ async def handle_standup_command(ack, respond, command):
     
     await respond(activity_summary)
 
+@app.command("/team-blockers")
+async def team_blockers(ack, respond):
+    await ack()
+    await respond(format_team_blockers_to_slack(await get_team_blockers()))
+
+@app.command("/stale-items")
+async def stale_items(ack, respond, command):
+    """/stale-items [days] [status], e.g. /stale-items 3 IN_REVIEW; defaults to IN_PROGRESS for 5 days."""
+    await ack()
+    days, status = 5, "IN_PROGRESS"
+    for argument in command.get("text", "").split():
+        if argument.isdigit():
+            days = max(int(argument), 1)
+        else:
+            status = argument.upper()
+    await respond(format_stale_items_to_slack(await get_stale_items(status, days), status, days))
+
 @app.command("/github-logout")
 async def github_logout(ack, body, say):
     await ack()
     #delete the github token from the database
-    delete_github_token(body["user_id"])
+    await delete_github_token(body["user_id"])
     await say("Logged out of GitHub")
 
-async def schedule_standup_message():
-    num_seconds_in_one_day = 86400 - 5 * 60 # 5 minutes before 9 am
-    while True:
-        await slack_helpers.send_standup_messages()
-        await asyncio.sleep(num_seconds_in_one_day)
-
 async def main():
-    asyncio.ensure_future(schedule_standup_message())
+    # tiktoken may download the encoding on first load, which mustn't block the event loop
+    await asyncio.to_thread(load_token_encoding)
+    await ensure_indexes()
+    await check_hot_query_plans()
+    # item documents for updates written before they existed, built in the background so the bot starts answering right away
+    backfill_task = asyncio.create_task(backfill_update_items())
+    _background_tasks.add(backfill_task)
+    backfill_task.add_done_callback(_background_tasks.discard)
+    await start_standup_scheduler()
     handler = AsyncSocketModeHandler(app, os.environ["SLACK_APP_TOKEN"])
-    await handler.start_async()
-
-def run_http_server():
-    """Run the HTTP server for GitHub callbacks."""
-    server = HTTPServer(('localhost', 3000), GitHubCallbackHandler)
-    server.serve_forever()
+    # GitHub callbacks and the Prometheus /metrics route are served on the same event loop as the bot
+    http_server = uvicorn.Server(uvicorn.Config(oauth_app, host=CALLBACK_SERVER_HOST, port=CALLBACK_SERVER_PORT, log_level="warning"))
+    # every replica runs the same loop; run_standup_node makes sure scheduled sends happen once across all of them
+    await asyncio.gather(handler.start_async(), http_server.serve(), run_standup_node())
 
 if __name__ == "__main__":
-    import asyncio
-    import threading
-    http_thread = threading.Thread(target=run_http_server, daemon=True)
-    http_thread.start()
     asyncio.run(main())
\ No newline at end of file
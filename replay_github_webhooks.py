@@ -0,0 +1,47 @@
+"""
+Replay recorded GitHub webhook deliveries against a running bot, signed with GITHUB_WEBHOOK_SECRET the way GitHub signs them:
+
+    python replay_github_webhooks.py recorded/*.json --url http://localhost:3000/github/webhook
+
+Each file is one delivery as written to GITHUB_WEBHOOK_RECORD_DIR: {"event": ..., "delivery": ..., "payload": {...}}.
+A file holding only the payload, e.g. copied from the repo's webhook settings, can be replayed with --event push.
+Events are stored idempotently, so replaying the same files twice stores nothing the second time.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import uuid
+import httpx
+from dotenv import find_dotenv, load_dotenv
+
+load_dotenv(find_dotenv())
+
+def replay(path, url, secret, event=None):
+    with open(path) as f:
+        delivery = json.load(f)
+    if event:
+        delivery = {"event": event, "delivery": str(uuid.uuid4()), "payload": delivery}
+    body = json.dumps(delivery["payload"]).encode()
+    headers = {
+        "Content-Type": "application/json",
+        "X-GitHub-Event": delivery["event"],
+        "X-GitHub-Delivery": delivery.get("delivery") or str(uuid.uuid4()),
+        "X-Hub-Signature-256": "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    }
+    response = httpx.post(url, content=body, headers=headers)
+    print(f"{path}: {response.status_code} {response.text}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--url", default=f"http://localhost:{os.environ.get('CALLBACK_SERVER_PORT', 3000)}/github/webhook")
+    parser.add_argument("--event", help="the X-GitHub-Event of files that hold only a payload")
+    args = parser.parse_args()
+    secret = os.environ["GITHUB_WEBHOOK_SECRET"]
+    for path in args.files:
+        replay(path, args.url, secret, args.event)
+
+if __name__ == "__main__":
+    main()
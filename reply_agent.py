@@ -1,38 +1,27 @@
-from helpers.mongo_db_helpers import update_exists, get_standup_updates_by_user_id, get_messages_from_db
-from helpers.llm_helpers import llm, convert_conversation_history_to_langchain_messages
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain_core.messages.system import SystemMessage
+from helpers.llm_helpers import generate_reply
+from helpers.context_helpers import TurnContext
+from helpers.format_helpers import MAX_HISTORY_TOKENS
+from langchain_core.prompts.chat import ChatPromptTemplate, MessagesPlaceholder
 import json
 
-def reply(tool_agent_response, channel_id, user_id, message, last_used_tool) -> str:
-    # Get conversation history and convert to langchain messages
-    # conversation_history = fetch_conversation_history(channel_id, max_number_of_messages_to_fetch=6)
-    conversation_history = get_messages_from_db(user_id, channel_id, max_number_of_messages_to_fetch=8)
-    langchain_messages = convert_conversation_history_to_langchain_messages(conversation_history)
-    
-    has_update = update_exists(user_id)
-    update_data = get_standup_updates_by_user_id(user_id)[0] if has_update else None
-    system_prompt = ""
+# tools whose output is already a message for the user; create and edit return update JSON that still needs formatting
+DIRECT_REPLY_TOOLS = {
+    "ask_question_response",
+    "ask_question",
+    "friendly_conversation_response",
+    "friendly_conversation",
+    # a create or edit that couldn't be saved; the tool agent explains why instead of formatting the old update
+    "update_not_saved"
+}
 
-    # TODO: check if we want to use this if statement for the ask question and friendly conversation tools. Doing this will get me closer to my goal
-    # TODO: Do we want to use the agent response within the system prompt to make the agent response more relevant?
-    # if last_used_tool not in ["create_standup_update", "make_edits_to_update"] and tool_agent_response and isinstance(tool_agent_response, list) and isinstance(tool_agent_response[0], str):
-    #     print("executing tool agent response reply and tool agent response is: ", tool_agent_response)
-    #     return tool_agent_response[0]
-    
-    # if we have an update and the last tool used was create or edit
-    if update_data and last_used_tool in ["create_standup_update", "make_edits_to_update"]:
-        print("update data from reply agent is: ", update_data)
-        
-        system_prompt = f"""
+FORMAT_UPDATE_INSTRUCTIONS = """
         You are a project manager that responds to standup updates from developers.
         Your task is to craft a beautiful response to the user's message.
         
-        The developer has provided their update in the following format:
-        {update_data['updates']['updates'] if 'updates' in update_data and update_data['updates']['updates'] else "No updates provided"}
+        The developer's update and their preferred writing style are given after the conversation history.
         
         Please format this update into a well-structured Slack message.
-        Write your response such that it follows the developer's preferred writing style: {update_data['updates']['preferred_style'] if 'preferred_style' in update_data['updates'] else "Paragraph"}.
+        Write your response such that it follows the developer's preferred writing style.
         
         For tasks that are BLOCKED, make sure to highlight the blockers clearly.
         Make sure to differentiate between yesterday and today updates if needed.
@@ -40,9 +29,9 @@ def reply(tool_agent_response, channel_id, user_id, message, last_used_tool) ->
 
         Reply with a brief and courteous message to the user followed by the formatted update.
         """
-    else:
-        # this is wrong. It's possible to have an update and still up in this block
-        system_prompt = """
+
+# this is wrong. It's possible to have an update and still end up with this prompt
+ENGAGE_INSTRUCTIONS = """
         You are a project manager that responds to standup updates from developers.
         Your task is to craft a beautiful response to the user's message. 
         
@@ -50,22 +39,45 @@ def reply(tool_agent_response, channel_id, user_id, message, last_used_tool) ->
         For clarity, it may be best to let the user know the status of the update that you have for them.
         Use appropriate formatting for a slack message in your response and include emojis where appropriate.
         """
-    # system_prompt = """
-    #     You are a project manager that responds to standup updates from developers.
-    #     Your task is to craft a beautiful response to the user's message. 
-        
-    #     Please engage with the developer based on their message and the conversation history, and ask questions to get more information for a sufficient standup update if needed.
-    #     For clarity, it may be best to let the user know the status of the update that you have for them.
-    #     Use appropriate formatting for a slack message in your response and include emojis where appropriate.
-    #     """
-    # Combine system prompt with chat history and current message
-    messages = [
-        SystemMessage(content=system_prompt),
-        *langchain_messages,
-        HumanMessage(content=message)
-    ]
+
+# compiled once at import with the static instructions first and the user's history, update and message last,
+# so replies share a prompt prefix the provider can cache
+FORMAT_UPDATE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", FORMAT_UPDATE_INSTRUCTIONS),
+    MessagesPlaceholder("history"),
+    ("system", "The developer has provided their update in the following format:\n{updates}\n\nThe developer's preferred writing style: {preferred_style}."),
+    ("human", "{message}")
+])
+
+ENGAGE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", ENGAGE_INSTRUCTIONS),
+    MessagesPlaceholder("history"),
+    ("human", "{message}")
+])
+
+async def reply(tool_agent_response, context: TurnContext, last_used_tool) -> str:
+    message = context.message
     
-    # Get response from LLM
-    response = llm.invoke(messages)
+    # the context already reflects any update written by the tools this turn
+    update_data = context.update
+
+    # conversational tools already wrote a reply for the user, so send it as is instead of paying for another LLM call to rewrite it
+    if last_used_tool in DIRECT_REPLY_TOOLS and tool_agent_response and isinstance(tool_agent_response[-1], str):
+        print("replying directly with the output of ", last_used_tool)
+        return tool_agent_response[-1]
+    
+    langchain_messages = context.get_langchain_history(MAX_HISTORY_TOKENS)
+    # if we have an update and the last tool used was create or edit
+    if update_data and last_used_tool in ["create_standup_update", "make_edits_to_update"]:
+        print("update data from reply agent is: ", update_data)
+        messages = FORMAT_UPDATE_PROMPT.format_messages(
+            history=langchain_messages,
+            updates=update_data['updates']['updates'] if 'updates' in update_data and update_data['updates']['updates'] else "No updates provided",
+            preferred_style=update_data['updates']['preferred_style'] if 'preferred_style' in update_data['updates'] else "Paragraph",
+            message=message
+        )
+    else:
+        messages = ENGAGE_PROMPT.format_messages(history=langchain_messages, message=message)
     
-    return response.content
+    # Get response from LLM
+    return await generate_reply(messages, context, "reply_agent")
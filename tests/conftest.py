@@ -0,0 +1,82 @@
+import asyncio
+import os
+import uuid
+from contextlib import ExitStack
+from unittest import mock
+
+import pytest
+from pymongo import AsyncMongoClient, MongoClient
+from pymongo.asynchronous.collection import AsyncCollection
+
+import helpers.mongo_db_helpers as mongo_db_helpers
+
+# the Slack, GitHub and OpenAI clients are created when the app modules are imported, so the tests need placeholders
+CREDENTIAL_ENV_VARS = ["SLACK_BOT_TOKEN", "SLACK_APP_TOKEN", "SLACK_USER_GROUP_ID", "GITHUB_CLIENT_ID", "GITHUB_CLIENT_SECRET", "GITHUB_REDIRECT_URI", "OPENAI_API_KEY"]
+
+def pytest_configure(config):
+    # runs before the test modules are collected and import main
+    for env_var in CREDENTIAL_ENV_VARS:
+        os.environ.setdefault(env_var, "test")
+
+@pytest.fixture
+def turn_settings(monkeypatch):
+    """Answer every message as its own turn, right away, through say() rather than a streamed Slack reply."""
+    import main
+    import helpers.slack_helpers as slack_helpers
+    monkeypatch.setattr(main.turn_queue, "debounce_seconds", 0)
+    monkeypatch.setattr(slack_helpers, "SLACK_STREAMING_REPLIES", False)
+
+@pytest.fixture(scope="session")
+def mongo_uri():
+    """
+    A MongoDB server for the tests that need a real one: MONGODB_TEST_URI if it is set, otherwise a throwaway mongod
+    started by pymongo_inmemory. Those tests are skipped when neither is available.
+    """
+    if os.environ.get("MONGODB_TEST_URI"):
+        yield os.environ["MONGODB_TEST_URI"]
+        return
+    try:
+        from pymongo_inmemory.context import Context
+        from pymongo_inmemory.mongod import Mongod
+        mongod = Mongod(Context())
+        mongod.start()
+    except Exception as e:
+        pytest.skip(f"no MongoDB to test against, set MONGODB_TEST_URI or install pymongo_inmemory: {e!r}")
+    try:
+        yield mongod.connection_string
+    finally:
+        mongod.stop()
+
+@pytest.fixture
+def mongo_db_name(mongo_uri):
+    """A database of its own for one test, dropped afterwards."""
+    name = f"standup_test_{uuid.uuid4().hex[:8]}"
+    yield name
+    client = MongoClient(mongo_uri)
+    client.drop_database(name)
+    client.close()
+
+@pytest.fixture
+def run_with_test_db(mongo_uri, mongo_db_name):
+    """
+    Run a coroutine function test(db) with the db and every collection in mongo_db_helpers pointed at the test database,
+    which has the same indexes as production, so unique indexes turn racing writes into DuplicateKeyErrors there too.
+    """
+    def run(test):
+        async def run_test():
+            client = AsyncMongoClient(mongo_uri)
+            db = client[mongo_db_name]
+            try:
+                with ExitStack() as stack:
+                    stack.enter_context(mock.patch.object(mongo_db_helpers, "db", db))
+                    for name, value in list(vars(mongo_db_helpers).items()):
+                        if isinstance(value, AsyncCollection):
+                            stack.enter_context(mock.patch.object(mongo_db_helpers, name, db[value.name]))
+                    indexes = {db[collection.name]: collection_indexes for collection, collection_indexes in mongo_db_helpers.INDEXES.items()}
+                    stack.enter_context(mock.patch.object(mongo_db_helpers, "INDEXES", indexes))
+                    await mongo_db_helpers.ensure_indexes()
+                    return await test(db)
+            finally:
+                await client.close()
+        return asyncio.run(run_test())
+    return run
@@ -0,0 +1,361 @@
+"""
+In-process stand-ins for the LLM, Mongo, Slack and GitHub, shared by the tests and benchmark.py.
+Each one sleeps for a configurable latency and counts its calls, so neither needs credentials, network or a database.
+The app modules read their Slack and OpenAI settings at import time, so those must be set before this is imported.
+"""
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+import httpx
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+
+import main
+import tool_agent
+import helpers.llm_helpers as llm_helpers
+import helpers.context_helpers as context_helpers
+import helpers.github_helpers as github_helpers
+
+USER_ID = "U_BENCHMARK"
+CHANNEL_ID = "D_BENCHMARK"
+GITHUB_LOGIN = "benchmark"
+
+UPDATE_JSON = json.dumps({
+    "preferred_style": "Bullet points",
+    "updates": [{"item": "task-1", "status": "IN_PROGRESS", "identified_blockers": []}]
+})
+
+# message type -> the tool the agent picks for it and whether the user already has an update for the day
+MESSAGE_TYPES = {
+    "question": {"tool": "ask_question_response", "has_update": False},
+    "friendly": {"tool": "friendly_conversation_response", "has_update": True},
+    "create": {"tool": "create_standup_update", "has_update": False},
+    "edit": {"tool": "make_edits_to_update", "has_update": True}
+}
+
+def _tool_args(tool_name, message):
+    if tool_name == "create_standup_update":
+        return {"text": message, "user_id": USER_ID, "channel_id": CHANNEL_ID}
+    if tool_name == "make_edits_to_update":
+        return {"update_exists": True, "text": message, "user_id": USER_ID, "channel_id": CHANNEL_ID}
+    return {"user_id": USER_ID, "channel_id": CHANNEL_ID, "message": message}
+
+class FakeChatModel:
+    """Stands in for the chat model: sleeps for the configured latency and counts every call."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def ainvoke(self, messages, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        # create and edit tools parse their reply as JSON, everything else treats it as text
+        return AIMessage(content=UPDATE_JSON)
+
+    async def astream(self, messages, **kwargs):
+        # the whole reply as one chunk, after the same latency
+        response = await self.ainvoke(messages, **kwargs)
+        yield AIMessageChunk(content=response.content)
+
+    async def abatch(self, inputs, config=None, return_exceptions=False):
+        max_concurrency = (config or {}).get("max_concurrency") or len(inputs) or 1
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def invoke_with_limit(messages):
+            async with semaphore:
+                return await self.ainvoke(messages)
+
+        return await asyncio.gather(*[invoke_with_limit(messages) for messages in inputs])
+
+class FakeToolAgent(FakeChatModel):
+    """Stands in for llm.bind_tools(...): picks the tool canned for the message type, which is the human message text."""
+
+    async def ainvoke(self, messages, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        # a burst merged into one turn repeats the message type on every line
+        message = [m for m in messages if isinstance(m, HumanMessage)][-1].content.split("\n")[0]
+        tool_name = MESSAGE_TYPES[message]["tool"]
+        return AIMessage(content="", tool_calls=[{"name": tool_name, "args": _tool_args(tool_name, message), "id": "benchmark"}])
+
+class FakeStore:
+    """In-memory replacement for the Mongo helpers. Every call counts as one round-trip and sleeps for the configured latency."""
+
+    def __init__(self, has_update=False, github_token=None, latency=0.0):
+        now = datetime.now()
+        self.latency = latency
+        self.round_trips = 0
+        self.messages = []
+        self.summary = None
+        self.update = {"user_id": USER_ID, "updates": json.loads(UPDATE_JSON), "date": now.strftime("%Y-%m-%d"), "update_time": now} if has_update else None
+        self.github_token = github_token
+        self.github_http_cache = {}
+        self.github_activity_snapshots = {}
+        self.send_jobs = {}
+        # (user_id, date) -> the standup message persisted for that day
+        self.scheduled_messages = {}
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        await asyncio.sleep(self.latency)
+
+    async def get_messages_from_db(self, user_id, channel_id, max_number_of_messages_to_fetch=10, date=None):
+        await self._round_trip()
+        return list(reversed(self.messages))[:max_number_of_messages_to_fetch]
+
+    async def save_message_to_db(self, user_id, message, channel_id, is_bot):
+        await self._round_trip()
+        self.messages.append({"user_id": user_id, "channel_id": channel_id, "message": message, "is_bot": is_bot, "timestamp": datetime.now()})
+
+    async def get_conversation_summary(self, user_id, channel_id, date=None):
+        await self._round_trip()
+        return self.summary
+
+    async def save_conversation_summary(self, user_id, channel_id, summary, summarized_until, previous_summarized_until=None, date=None):
+        await self._round_trip()
+        if (self.summary or {}).get("summarized_until") != previous_summarized_until:
+            return False
+        self.summary = {"summary": summary, "summarized_until": summarized_until}
+        return True
+
+    async def get_messages_to_summarize(self, user_id, channel_id, summarized_until, before, limit):
+        await self._round_trip()
+        return [
+            message for message in self.messages
+            if (not summarized_until or message["timestamp"] > summarized_until) and message["timestamp"] < before
+        ][:limit]
+
+    async def get_standup_update(self, user_id, date=None):
+        await self._round_trip()
+        return self.update
+
+    async def get_standup_updates_by_user_id(self, user_id, date=None):
+        await self._round_trip()
+        if not self.update:
+            raise Exception(f"No updates found for user {user_id}")
+        return [self.update]
+
+    async def insert_item(self, user_id, extracted_updates, expected_version=None):
+        await self._round_trip()
+        version = (self.update or {}).get("version", 0) + 1
+        self.update = {"user_id": user_id, "updates": extracted_updates, "version": version}
+        return self.update
+
+    async def get_github_token(self, slack_user_id):
+        await self._round_trip()
+        return self.github_token
+
+    async def get_github_http_cache_entry(self, cache_key):
+        await self._round_trip()
+        return self.github_http_cache.get(cache_key)
+
+    async def save_github_http_cache_entry(self, cache_key, etag, last_modified, link, body, size, max_entries):
+        await self._round_trip()
+        self.github_http_cache[cache_key] = {"etag": etag, "last_modified": last_modified, "link": link, "body": body, "size": size}
+
+    async def get_github_activity_snapshot(self, slack_user_id):
+        await self._round_trip()
+        return self.github_activity_snapshots.get(slack_user_id)
+
+    async def save_github_activity_snapshot(self, slack_user_id, commits, pull_requests, cursor, synced_at):
+        await self._round_trip()
+        self.github_activity_snapshots[slack_user_id] = {"slack_user_id": slack_user_id, "commits": commits, "pull_requests": pull_requests, "cursor": cursor, "synced_at": synced_at}
+
+    async def get_standup_draft(self, user_id, date=None):
+        await self._round_trip()
+        return None
+
+    async def persist_scheduled_message(self, user_id, message, scheduled_time, date=None):
+        await self._round_trip()
+        self.scheduled_messages[(user_id, date)] = message
+
+    async def standup_message_sent(self, user_id, date=None):
+        await self._round_trip()
+        return (user_id, date) in self.scheduled_messages
+
+    async def enqueue_standup_send_jobs(self, user_ids, date, max_attempts):
+        await self._round_trip()
+        queued = 0
+        for user_id in user_ids:
+            job_id = f"standup:{user_id}:{date}"
+            if job_id not in self.send_jobs:
+                now = datetime.utcnow()
+                self.send_jobs[job_id] = {"_id": job_id, "user_id": user_id, "date": date, "status": "queued", "attempts": 0, "max_attempts": max_attempts, "run_at": now, "created_at": now}
+                queued += 1
+        return queued
+
+    async def claim_standup_send_job(self, owner, visibility_timeout_seconds):
+        """Like the Mongo claim: the earliest due queued job, or a running one past its visibility timeout."""
+        await self._round_trip()
+        now = datetime.utcnow()
+        claimable = [
+            job for job in self.send_jobs.values()
+            if (job["status"] == "queued" and job["run_at"] <= now) or (job["status"] == "running" and job["lease_expires_at"] <= now)
+        ]
+        if not claimable:
+            return None
+        job = min(claimable, key=lambda job: job["run_at"])
+        job.update(status="running", owner=owner, started_at=now, lease_expires_at=now + timedelta(seconds=visibility_timeout_seconds), attempts=job["attempts"] + 1)
+        job.setdefault("send_intent_at", now)
+        return dict(job)
+
+    async def complete_standup_send_job(self, job_id, owner, status, error=None):
+        await self._round_trip()
+        job = self.send_jobs[job_id]
+        if job["owner"] == owner and job["status"] == "running":
+            job.update(status=status, finished_at=datetime.utcnow(), last_error=error)
+            job.pop("lease_expires_at", None)
+
+    async def retry_standup_send_job(self, job_id, owner, run_at, error):
+        await self._round_trip()
+        job = self.send_jobs[job_id]
+        if job["owner"] == owner and job["status"] == "running":
+            job.update(status="queued", run_at=run_at, last_error=error)
+            job.pop("lease_expires_at", None)
+            job.pop("owner", None)
+
+class FakeGitHubServer:
+    """
+    GitHub's REST and GraphQL endpoints served through an httpx.MockTransport. Every response carries an ETag
+    and a matching If-None-Match gets a 304, like the real API. Half of the repos have a commit and an open PR by the user,
+    and one by a teammate that only shows up in the REST pulls list.
+    """
+
+    def __init__(self, repos, latency):
+        self.repos = [{"name": f"repo{index}", "full_name": f"{GITHUB_LOGIN}/repo{index}"} for index in range(repos)]
+        self.latency = latency
+        self.requests = 0
+        self.not_modified = 0
+
+    def client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+    async def handle(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if request.method == "POST":
+            return httpx.Response(200, json={"data": self._graphql(json.loads(request.content)["query"])})
+        body = self._rest(request.url.path)
+        if body is None:
+            return httpx.Response(404, json={"message": "Not Found"})
+        etag = f'"{hash(json.dumps(body, sort_keys=True))}"'
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return httpx.Response(304, headers={"ETag": etag})
+        return httpx.Response(200, json=body, headers={"ETag": etag})
+
+    def _active_repos(self):
+        return self.repos[::2]
+
+    def _rest(self, path):
+        now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+        if path == "/user":
+            return {"login": GITHUB_LOGIN}
+        if path == "/user/repos":
+            return self.repos
+        for repo in self.repos:
+            active = repo in self._active_repos()
+            if path == f"/repos/{repo['full_name']}/commits":
+                return [{"sha": f"{repo['name']}-1", "commit": {"message": f"Work on {repo['name']}", "author": {"date": now}}}] if active else []
+            if path == f"/repos/{repo['full_name']}/pulls":
+                # like the real endpoint, a repo's pulls include PRs by other people
+                return [
+                    {"title": f"Improve {repo['name']}", "state": "open", "html_url": f"https://github.com/{repo['full_name']}/pull/1", "updated_at": now, "user": {"login": GITHUB_LOGIN}},
+                    {"title": f"Review {repo['name']}", "state": "open", "html_url": f"https://github.com/{repo['full_name']}/pull/2", "updated_at": now, "user": {"login": "teammate"}}
+                ] if active else []
+        return None
+
+    def _graphql(self, query):
+        now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+        if "contributionsCollection" in query:
+            return {"viewer": {"id": "U_1", "login": GITHUB_LOGIN, "contributionsCollection": {
+                "commitContributionsByRepository": [{"repository": {"name": repo["name"], "owner": {"login": GITHUB_LOGIN}}} for repo in self._active_repos()],
+                "pullRequestContributions": {"nodes": [
+                    {"pullRequest": {"title": f"Improve {repo['name']}", "state": "OPEN", "url": f"https://github.com/{repo['full_name']}/pull/1", "updatedAt": now, "repository": {"name": repo["name"]}}}
+                    for repo in self._active_repos()
+                ]},
+                "pullRequestReviewContributions": {"nodes": []}
+            }}}
+        return {
+            f"repo{index}": {"defaultBranchRef": {"target": {"history": {"nodes": [{"oid": f"{repo['name']}-1", "message": f"Work on {repo['name']}", "authoredDate": now}]}}}}
+            for index, repo in enumerate(self._active_repos())
+        }
+
+class FakeSlackClient:
+    """
+    Stands in for the AsyncWebClient calls the fan-out and streamed replies make. Keeps every post, and when it landed,
+    for conversations.history; a DM's channel id is the user id. Exceptions in post_errors are raised by the next posts.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.posted_at = []
+        self.posts = []
+        self.post_errors = []
+
+    async def chat_postMessage(self, channel, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.post_errors:
+            raise self.post_errors.pop(0)
+        self.posted_at.append(time.perf_counter())
+        post = {"channel": channel, "ts": f"{time.time():.6f}", "text": kwargs.get("text"), "metadata": kwargs.get("metadata")}
+        self.posts.append(post)
+        return {"ok": True, "channel": channel, "ts": post["ts"]}
+
+    async def chat_update(self, channel, ts, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return {"ok": True, "channel": channel, "ts": ts}
+
+    async def conversations_open(self, users, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return {"ok": True, "channel": {"id": users}}
+
+    async def conversations_history(self, channel, oldest="0", include_all_metadata=False, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        messages = [
+            {"ts": post["ts"], "text": post["text"], **({"metadata": post["metadata"]} if include_all_metadata and post["metadata"] else {})}
+            for post in reversed(self.posts) if post["channel"] == channel and float(post["ts"]) >= float(oldest)
+        ]
+        return {"ok": True, "messages": messages, "response_metadata": {"next_cursor": ""}}
+
+def install_turn_fakes(stack, store, llm, agent):
+    """Point the turn pipeline at the fake store, model and tool agent until stack closes."""
+    patches = [
+        (main, "save_message_to_db", store.save_message_to_db),
+        (context_helpers, "get_messages_from_db", store.get_messages_from_db),
+        (context_helpers, "get_conversation_summary", store.get_conversation_summary),
+        (context_helpers, "get_standup_update", store.get_standup_update),
+        (context_helpers, "get_github_token", store.get_github_token),
+        (llm_helpers, "get_messages_from_db", store.get_messages_from_db),
+        (llm_helpers, "get_conversation_summary", store.get_conversation_summary),
+        (llm_helpers, "save_conversation_summary", store.save_conversation_summary),
+        (llm_helpers, "get_messages_to_summarize", store.get_messages_to_summarize),
+        (llm_helpers, "get_standup_updates_by_user_id", store.get_standup_updates_by_user_id),
+        (tool_agent, "insert_item", store.insert_item),
+        (tool_agent, "agent", agent),
+        (llm_helpers, "llm", llm)
+    ]
+    for module, name, fake in patches:
+        stack.enter_context(mock.patch.object(module, name, fake))
+
+def install_github_fakes(stack, store, server):
+    """Point the GitHub helpers at the fake server and store until stack closes."""
+    patches = [
+        (github_helpers, "_http_client", server.client()),
+        # asyncio primitives belong to the loop that first waits on them
+        (github_helpers, "_request_slots", asyncio.Semaphore(github_helpers.GITHUB_MAX_CONCURRENT_REQUESTS)),
+        (github_helpers, "get_github_token", store.get_github_token),
+        (github_helpers, "get_github_http_cache_entry", store.get_github_http_cache_entry),
+        (github_helpers, "save_github_http_cache_entry", store.save_github_http_cache_entry),
+        (github_helpers, "get_github_activity_snapshot", store.get_github_activity_snapshot),
+        (github_helpers, "save_github_activity_snapshot", store.save_github_activity_snapshot)
+    ]
+    for module, name, fake in patches:
+        stack.enter_context(mock.patch.object(module, name, fake))
@@ -0,0 +1,27 @@
+"""
+One node for the multi-process failover test in test_cluster.py: competes for the leader lease in the given database
+and prints a line whenever it is elected or deposed.
+
+    python tests/leader_node.py <mongo uri> <database> <node id>
+"""
+import asyncio
+import sys
+
+from pymongo import AsyncMongoClient
+
+import helpers.cluster_helpers as cluster_helpers
+import helpers.mongo_db_helpers as mongo_db_helpers
+
+async def run_node(mongo_uri, db_name, node_id):
+    mongo_db_helpers.leases_collection = AsyncMongoClient(mongo_uri)[db_name]["leases"]
+
+    async def on_elected():
+        print(f"elected {node_id}", flush=True)
+
+    async def on_deposed():
+        print(f"deposed {node_id}", flush=True)
+
+    await cluster_helpers.run_leader_election(on_elected, on_deposed, node_id)
+
+if __name__ == "__main__":
+    asyncio.run(run_node(*sys.argv[1:4]))
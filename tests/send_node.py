@@ -0,0 +1,54 @@
+"""
+One node for the exactly-once send test in test_cluster.py: waits until all the nodes are up, then queues the day's
+standup message for the given users in the given database and works the send queue until it is empty, like every node
+does at a send slot. Slack is replaced by a client that also writes each post to the slack_posts collection, so the test
+can count them across nodes. Prints how many messages this node sent.
+
+    python tests/send_node.py <mongo uri> <database> <node id> <nodes> <date> <user id>...
+"""
+import asyncio
+import sys
+
+from pymongo import AsyncMongoClient
+from pymongo.asynchronous.collection import AsyncCollection
+
+import helpers.mongo_db_helpers as mongo_db_helpers
+import helpers.slack_helpers as slack_helpers
+from tests.fakes import FakeSlackClient
+
+SLACK_LATENCY = 0.1
+
+class RecordingSlackClient(FakeSlackClient):
+    def __init__(self, posts_collection, node_id):
+        super().__init__(SLACK_LATENCY)
+        self.posts_collection = posts_collection
+        self.node_id = node_id
+
+    async def chat_postMessage(self, channel, **kwargs):
+        response = await super().chat_postMessage(channel, **kwargs)
+        await self.posts_collection.insert_one({"channel": channel, "node_id": self.node_id, "ts": response["ts"]})
+        return response
+
+async def _no_github_token(user_id):
+    # the connect prompt needs no GitHub or LLM call
+    return None
+
+async def run_node(mongo_uri, db_name, node_id, nodes, date, user_ids):
+    db = AsyncMongoClient(mongo_uri)[db_name]
+    mongo_db_helpers.db = db
+    for name, value in list(vars(mongo_db_helpers).items()):
+        if isinstance(value, AsyncCollection):
+            setattr(mongo_db_helpers, name, db[value.name])
+    slack_helpers.slack_client = RecordingSlackClient(db["slack_posts"], node_id)
+    slack_helpers.get_github_token = _no_github_token
+    slack_helpers.NODE_ID = node_id
+
+    # start together, so the nodes really compete for the same jobs
+    await db["nodes_ready"].insert_one({"_id": node_id})
+    while await db["nodes_ready"].count_documents({}) < nodes:
+        await asyncio.sleep(0.05)
+    fanout_stats = await slack_helpers.send_standup_messages(user_ids, date)
+    print(f"sent {node_id} {fanout_stats['users']}", flush=True)
+
+if __name__ == "__main__":
+    asyncio.run(run_node(sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4]), sys.argv[5], sys.argv[6:]))
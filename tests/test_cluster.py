@@ -0,0 +1,163 @@
+"""
+The leader lease against a real MongoDB: one owner at a time, handover when the leader shuts down,
+and failover to another process when the leader dies without giving the lease up. And the send queue across processes:
+every node queueing and working the same day's standups still sends each user exactly one.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+import helpers.cluster_helpers as cluster_helpers
+from helpers.mongo_db_helpers import acquire_lease, release_lease, standup_message_sent
+
+LEASE_SECONDS = 3
+HEARTBEAT_SECONDS = 1
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NODE_SCRIPT = os.path.join(REPO_ROOT, "tests", "leader_node.py")
+SEND_NODE_SCRIPT = os.path.join(REPO_ROOT, "tests", "send_node.py")
+
+@pytest.fixture(autouse=True)
+def fast_heartbeat(monkeypatch):
+    monkeypatch.setattr(cluster_helpers, "CLUSTER_LEASE_SECONDS", LEASE_SECONDS)
+    monkeypatch.setattr(cluster_helpers, "CLUSTER_HEARTBEAT_SECONDS", HEARTBEAT_SECONDS)
+
+def test_lease_has_one_owner_until_it_expires(run_with_test_db):
+    async def test(db):
+        assert await acquire_lease("lease", "a", 1)
+        assert not await acquire_lease("lease", "b", 1)
+        # renewing your own lease always works
+        assert await acquire_lease("lease", "a", 1)
+        await asyncio.sleep(1.2)
+        assert await acquire_lease("lease", "b", 1)
+        assert not await acquire_lease("lease", "a", 1)
+        # only the owner can give it up
+        await release_lease("lease", "a")
+        assert not await acquire_lease("lease", "a", 1)
+        await release_lease("lease", "b")
+        assert await acquire_lease("lease", "a", 1)
+
+    run_with_test_db(test)
+
+def test_one_leader_at_a_time_and_handover_on_shutdown(run_with_test_db):
+    async def test(db):
+        leaders = set()
+
+        def start_node(node_id):
+            async def on_elected():
+                leaders.add(node_id)
+
+            async def on_deposed():
+                leaders.discard(node_id)
+
+            return asyncio.create_task(cluster_helpers.run_leader_election(on_elected, on_deposed, node_id))
+
+        nodes = {node_id: start_node(node_id) for node_id in ["a", "b", "c"]}
+        try:
+            for _ in range(3):
+                await asyncio.sleep(HEARTBEAT_SECONDS)
+                assert len(leaders) == 1
+            old_leader = next(iter(leaders))
+            # a clean shutdown releases the lease, so another node takes over on its next heartbeat
+            stopped = nodes.pop(old_leader)
+            stopped.cancel()
+            await asyncio.gather(stopped, return_exceptions=True)
+            await asyncio.sleep(HEARTBEAT_SECONDS * 1.5)
+            assert len(leaders) == 1
+            assert old_leader not in leaders
+        finally:
+            for task in nodes.values():
+                task.cancel()
+            await asyncio.gather(*nodes.values(), return_exceptions=True)
+        assert not leaders
+
+    run_with_test_db(test)
+
+def test_failover_across_processes(mongo_uri, mongo_db_name):
+    env = {
+        **os.environ,
+        "PYTHONPATH": REPO_ROOT,
+        "CLUSTER_LEASE_SECONDS": str(LEASE_SECONDS),
+        "CLUSTER_HEARTBEAT_SECONDS": str(HEARTBEAT_SECONDS)
+    }
+    events = []
+    lock = threading.Lock()
+
+    def read_events(process):
+        for line in process.stdout:
+            with lock:
+                events.append((time.monotonic(), line.split()))
+
+    def elected():
+        with lock:
+            return [(at, words[1]) for at, words in events if words[:1] == ["elected"]]
+
+    def wait_for(condition, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+            time.sleep(0.1)
+        return condition()
+
+    processes = {}
+    try:
+        for node_id in ["a", "b", "c"]:
+            process = subprocess.Popen(
+                [sys.executable, NODE_SCRIPT, mongo_uri, mongo_db_name, node_id],
+                stdout=subprocess.PIPE, text=True, env=env, cwd=REPO_ROOT
+            )
+            threading.Thread(target=read_events, args=(process,), daemon=True).start()
+            processes[node_id] = process
+
+        # imports make startup slow, so allow a while for the first election
+        assert wait_for(lambda: elected(), timeout=30)
+        time.sleep(HEARTBEAT_SECONDS * 3)
+        assert len(elected()) == 1
+        _, leader = elected()[0]
+
+        # a crash never releases the lease: the others take over once it expires
+        processes[leader].kill()
+        killed_at = time.monotonic()
+        assert wait_for(lambda: len(elected()) == 2, timeout=LEASE_SECONDS + HEARTBEAT_SECONDS * 3)
+        time.sleep(HEARTBEAT_SECONDS * 2)
+        assert len(elected()) == 2
+        new_elected_at, new_leader = elected()[1]
+        assert new_leader != leader
+        assert new_elected_at - killed_at >= LEASE_SECONDS - HEARTBEAT_SECONDS * 1.5
+    finally:
+        for process in processes.values():
+            process.kill()
+            process.wait()
+
+def test_each_user_gets_one_standup_a_day_across_processes(mongo_uri, mongo_db_name, run_with_test_db):
+    async def test(db):
+        node_ids = ["a", "b", "c", "d"]
+        user_ids = [f"U{index:03d}" for index in range(100)]
+        # today, as the sent messages are stamped with the time they went out
+        date = datetime.now().strftime("%Y-%m-%d")
+        processes = [
+            await asyncio.create_subprocess_exec(
+                sys.executable, SEND_NODE_SCRIPT, mongo_uri, mongo_db_name, node_id, str(len(node_ids)), date, *user_ids,
+                stdout=subprocess.PIPE, env={**os.environ, "PYTHONPATH": REPO_ROOT}, cwd=REPO_ROOT
+            ) for node_id in node_ids
+        ]
+        outputs = await asyncio.wait_for(asyncio.gather(*[process.communicate() for process in processes]), timeout=120)
+        assert [process.returncode for process in processes] == [0] * len(node_ids)
+        sent = {words[1]: int(words[2]) for stdout, _ in outputs for words in map(str.split, stdout.decode().splitlines()) if words[:1] == ["sent"]}
+        assert sum(sent.values()) == len(user_ids)
+        # the nodes shared the work rather than one of them doing it all
+        assert sum(1 for count in sent.values() if count) > 1
+
+        posts = await db["slack_posts"].aggregate([{"$group": {"_id": "$channel", "count": {"$sum": 1}}}])
+        assert {post["_id"]: post["count"] for post in await posts.to_list()} == {user_id: 1 for user_id in user_ids}
+        assert all([await standup_message_sent(user_id, date) for user_id in user_ids])
+        assert await db["messages"].count_documents({"type": "scheduled_message", "date": date}) == len(user_ids)
+        assert await db["standup_send_jobs"].count_documents({"status": "sent"}) == len(user_ids)
+
+    run_with_test_db(test)
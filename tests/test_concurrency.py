@@ -0,0 +1,71 @@
+"""
+Turns for different users run concurrently on the event loop: with the LLM stubbed to sleep for a fixed latency,
+answering many users at once should take about as long as answering one. A turn's placeholder doesn't wait for the
+debounce window.
+"""
+import asyncio
+import io
+import time
+from contextlib import ExitStack, redirect_stdout
+
+import main
+import helpers.slack_helpers as slack_helpers
+from tests.fakes import CHANNEL_ID, MESSAGE_TYPES, FakeChatModel, FakeSlackClient, FakeStore, FakeToolAgent, install_turn_fakes
+
+LLM_LATENCY = 0.2
+CONCURRENT_USERS = 20
+
+async def _run_turns(user_ids, message_type="create"):
+    store = FakeStore(MESSAGE_TYPES[message_type]["has_update"])
+    llm = FakeChatModel(LLM_LATENCY)
+    agent = FakeToolAgent(LLM_LATENCY)
+    replies = []
+
+    async def say(text=None, **kwargs):
+        replies.append(text)
+
+    with ExitStack() as stack:
+        install_turn_fakes(stack, store, llm, agent)
+        stack.enter_context(redirect_stdout(io.StringIO()))
+        start = time.perf_counter()
+        for user_id in user_ids:
+            await main.respond_to_message({"user": user_id, "channel": CHANNEL_ID, "text": message_type}, say)
+        await main.turn_queue.join()
+        wall_time = time.perf_counter() - start
+    return wall_time, replies, llm.calls + agent.calls
+
+def test_concurrent_turns_take_about_as_long_as_one(turn_settings):
+    single_turn, replies, llm_calls = asyncio.run(_run_turns(["U_SINGLE"]))
+    assert len(replies) == 1
+    # the turn waits on the LLM at least twice: the tool agent and the tool itself
+    assert single_turn >= 2 * LLM_LATENCY
+
+    user_ids = [f"U_{index}" for index in range(CONCURRENT_USERS)]
+    wall_time, replies, concurrent_llm_calls = asyncio.run(_run_turns(user_ids))
+    assert len(replies) == CONCURRENT_USERS
+    assert concurrent_llm_calls == CONCURRENT_USERS * llm_calls
+    # run one after another these would take CONCURRENT_USERS times as long
+    assert wall_time < single_turn * 1.5
+
+def test_turns_for_one_user_run_one_at_a_time(turn_settings):
+    single_turn, _, _ = asyncio.run(_run_turns(["U_SINGLE"]))
+    wall_time, replies, _ = asyncio.run(_run_turns(["U_SAME", "U_SAME"]))
+    # with no debounce window the second message gets a turn of its own, after the first
+    assert len(replies) == 2
+    assert wall_time >= single_turn * 1.5
+
+def test_the_placeholder_shows_before_the_debounce_window(turn_settings, monkeypatch):
+    debounce = 0.5
+    slack = FakeSlackClient(0)
+    turn_latencies = []
+    monkeypatch.setattr(main.turn_queue, "debounce_seconds", debounce)
+    monkeypatch.setattr(slack_helpers, "SLACK_STREAMING_REPLIES", True)
+    monkeypatch.setattr(slack_helpers, "slack_client", slack)
+    monkeypatch.setattr(main, "record_turn", lambda latency, time_to_first_visible_token=None: turn_latencies.append(latency))
+    start = time.perf_counter()
+    asyncio.run(_run_turns(["U_SINGLE"]))
+    # the placeholder goes out as soon as the message is picked up, not once the user has been quiet for the window
+    assert len(slack.posted_at) == 1
+    assert slack.posted_at[0] - start < debounce / 2
+    # and the turn's latency counts from the message's arrival, so it includes the wait
+    assert turn_latencies[0] >= debounce + 2 * LLM_LATENCY
@@ -0,0 +1,93 @@
+"""
+The rolling conversation summary: messages older than a turn loads are still folded in, in order, and two refreshes
+of the same conversation racing each other don't fold the same messages in twice.
+"""
+import asyncio
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+
+from helpers.context_helpers import TurnContext, MAX_TURN_HISTORY_MESSAGES
+from helpers.llm_helpers import refresh_conversation_summary, CONVERSATION_SUMMARY_BATCH_MESSAGES
+from helpers.mongo_db_helpers import get_conversation_summary, save_conversation_summary, get_messages_to_summarize
+from tests.fakes import USER_ID, CHANNEL_ID, FakeChatModel, FakeStore, FakeToolAgent, install_turn_fakes
+
+def _store_with_messages(count):
+    store = FakeStore()
+    start = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+    store.messages = [
+        {"user_id": USER_ID, "channel_id": CHANNEL_ID, "message": f"message {index}", "is_bot": index % 2 == 1, "timestamp": start + timedelta(seconds=index)}
+        for index in range(count)
+    ]
+    return store
+
+def _turn_context(store):
+    """The context a turn builds: the newest MAX_TURN_HISTORY_MESSAGES messages, newest first."""
+    history = list(reversed(store.messages))[:MAX_TURN_HISTORY_MESSAGES]
+    return TurnContext(user_id=USER_ID, channel_id=CHANNEL_ID, message="hi", conversation_history=history)
+
+async def _refresh(store, refreshes=1):
+    llm = FakeChatModel(0.01)
+    with ExitStack() as stack:
+        install_turn_fakes(stack, store, llm, FakeToolAgent(0))
+        await asyncio.gather(*[refresh_conversation_summary(_turn_context(store)) for _ in range(refreshes)])
+    return llm.calls
+
+def test_nothing_to_fold_while_the_history_fits():
+    store = _store_with_messages(5)
+    assert asyncio.run(_refresh(store)) == 0
+    assert store.summary is None
+
+def test_messages_past_the_fetch_cap_are_folded_in():
+    older = CONVERSATION_SUMMARY_BATCH_MESSAGES + 20
+    store = _store_with_messages(older + MAX_TURN_HISTORY_MESSAGES)
+    llm_calls = asyncio.run(_refresh(store))
+    # everything the turn couldn't load, in batches, up to the oldest message the turn did load
+    assert llm_calls == 2
+    assert store.summary["summarized_until"] == store.messages[older - 1]["timestamp"]
+
+def test_racing_refreshes_fold_each_message_in_once():
+    store = _store_with_messages(CONVERSATION_SUMMARY_BATCH_MESSAGES * 2 + MAX_TURN_HISTORY_MESSAGES)
+    saves = []
+    save = store.save_conversation_summary
+
+    async def record_save(*args, **kwargs):
+        saved = await save(*args, **kwargs)
+        if saved:
+            saves.append(args[3])
+        return saved
+
+    store.save_conversation_summary = record_save
+    asyncio.run(_refresh(store, refreshes=2))
+    # the refresh that lost the first save stops instead of saving its copy of the same batch
+    assert saves == [
+        store.messages[CONVERSATION_SUMMARY_BATCH_MESSAGES - 1]["timestamp"],
+        store.messages[CONVERSATION_SUMMARY_BATCH_MESSAGES * 2 - 1]["timestamp"]
+    ]
+
+def test_summary_saves_only_over_the_summary_they_extend(run_with_test_db):
+    async def test(db):
+        first, second = datetime(2026, 1, 5, 9, 0), datetime(2026, 1, 5, 9, 30)
+        assert await save_conversation_summary(USER_ID, CHANNEL_ID, "one", first, None)
+        # a refresh that read no summary, racing the one above
+        assert not await save_conversation_summary(USER_ID, CHANNEL_ID, "other", first, None)
+        assert await save_conversation_summary(USER_ID, CHANNEL_ID, "two", second, first)
+        assert not await save_conversation_summary(USER_ID, CHANNEL_ID, "stale", second, first)
+        summary = await get_conversation_summary(USER_ID, CHANNEL_ID)
+        assert (summary["summary"], summary["summarized_until"]) == ("two", second)
+
+    run_with_test_db(test)
+
+def test_messages_to_summarize_are_the_unsummarized_ones_before_the_boundary(run_with_test_db):
+    async def test(db):
+        start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        await db["messages"].insert_many([
+            {"user_id": USER_ID, "channel_id": CHANNEL_ID, "message": f"message {index}", "is_bot": False, "timestamp": start + timedelta(minutes=index)}
+            for index in range(-2, 10)
+        ])
+        messages = await get_messages_to_summarize(USER_ID, CHANNEL_ID, start + timedelta(minutes=2), start + timedelta(minutes=8), 4)
+        # yesterday's messages belong to yesterday's summary
+        assert [message["message"] for message in messages] == ["message 3", "message 4", "message 5", "message 6"]
+        messages = await get_messages_to_summarize(USER_ID, CHANNEL_ID, None, start + timedelta(minutes=2), 10)
+        assert [message["message"] for message in messages] == ["message 0", "message 1"]
+
+    run_with_test_db(test)
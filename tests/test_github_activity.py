@@ -0,0 +1,105 @@
+"""
+The GraphQL backend against the REST one, both replaying the GitHub responses in fixtures/github_activity.json through
+an httpx.MockTransport: the same activity in the same shape, in at most two GraphQL requests.
+"""
+import asyncio
+import copy
+import json
+import os
+from contextlib import ExitStack
+from unittest import mock
+
+import httpx
+import pytest
+
+import helpers.github_helpers as github_helpers
+from tests.fakes import FakeStore, install_github_fakes
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "github_activity.json")
+# the fixtures are one day of activity; both backends are asked for everything since its start
+SINCE = "2026-03-10T00:00:00Z"
+COMMIT_KEYS = {"repo", "sha", "message", "timestamp"}
+PULL_REQUEST_KEYS = {"repo", "title", "state", "url", "updated_at"}
+
+class ReplayGitHubServer:
+    """Answers each request with the fixture response recorded for its method and path, and counts the requests."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = 0
+
+    def client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+    async def handle(self, request):
+        self.requests += 1
+        key = f"{request.method} {request.url.path}"
+        if request.method == "POST":
+            # the contributions query and the aliased commit history query go to the same endpoint
+            key += " contributionsCollection" if "contributionsCollection" in json.loads(request.content)["query"] else " history"
+        if key not in self.responses:
+            return httpx.Response(404, json={"message": "Not Found"})
+        return httpx.Response(200, json=self.responses[key])
+
+@pytest.fixture
+def responses():
+    with open(FIXTURE_PATH) as f:
+        return json.load(f)
+
+def _fetch(server, backend):
+    async def fetch():
+        with ExitStack() as stack:
+            install_github_fakes(stack, FakeStore(github_token="fixture"), server)
+            stack.enter_context(mock.patch.object(github_helpers, "GITHUB_ACTIVITY_BACKEND", backend))
+            return await github_helpers._fetch_github_activity("fixture", SINCE)
+    requests_before = server.requests
+    activity = asyncio.run(fetch())
+    return activity, server.requests - requests_before
+
+def _comparable(activity):
+    return (
+        sorted((commit["repo"], commit["sha"], commit["message"], commit["timestamp"]) for commit in activity["commits"]),
+        sorted((pr["repo"], pr["title"], pr["state"], pr["url"], pr["updated_at"]) for pr in activity["pull_requests"])
+    )
+
+def test_graphql_matches_rest(responses):
+    server = ReplayGitHubServer(responses)
+    rest, _ = _fetch(server, "rest")
+    graphql, _ = _fetch(server, "graphql")
+    assert _comparable(graphql) == _comparable(rest)
+    for activity in (rest, graphql):
+        assert all(set(commit) == COMMIT_KEYS for commit in activity["commits"])
+        assert all(set(pr) == PULL_REQUEST_KEYS for pr in activity["pull_requests"])
+
+def test_rest_only_counts_the_users_own_pull_requests(responses):
+    rest, _ = _fetch(ReplayGitHubServer(responses), "rest")
+    # the repos' pulls lists also hold a bot's and a teammate's PRs, and one of the user's from last week
+    assert sorted(pr["url"] for pr in rest["pull_requests"]) == [
+        "https://github.com/acme/api/pull/318",
+        "https://github.com/octodev/standup-bot/pull/42"
+    ]
+    # a merged PR is closed in both backends
+    assert {pr["url"]: pr["state"] for pr in rest["pull_requests"]}["https://github.com/acme/api/pull/318"] == "closed"
+
+def test_graphql_makes_at_most_two_requests(responses):
+    server = ReplayGitHubServer(responses)
+    _, rest_requests = _fetch(server, "rest")
+    _, graphql_requests = _fetch(server, "graphql")
+    # REST asks for the user and the repo list, then commits and pulls for every repo
+    assert rest_requests == 2 + 2 * len(responses["GET /user/repos"])
+    assert graphql_requests <= 2
+
+def test_graphql_skips_the_history_query_without_commits(responses):
+    responses = copy.deepcopy(responses)
+    collection = responses["POST /graphql contributionsCollection"]["data"]["viewer"]["contributionsCollection"]
+    collection["commitContributionsByRepository"] = []
+    collection["pullRequestContributions"]["nodes"] = []
+    activity, requests = _fetch(ReplayGitHubServer(responses), "graphql")
+    assert activity == {"commits": [], "pull_requests": []}
+    assert requests == 1
+
+def test_graphql_errors_are_reported_not_raised(responses):
+    responses = {**responses, "POST /graphql contributionsCollection": {"data": None, "errors": [{"type": "RATE_LIMITED", "message": "API rate limit exceeded"}]}}
+    activity, requests = _fetch(ReplayGitHubServer(responses), "graphql")
+    assert activity == "Error accessing GitHub account"
+    assert requests == 1
@@ -0,0 +1,133 @@
+"""
+GitHub webhook deliveries: checking their signature, turning them into activity events credited to the right GitHub login,
+rejecting bodies that aren't JSON, and looking up the GitHub login behind each stored token so events can be matched to Slack users.
+"""
+import asyncio
+import hashlib
+import hmac
+import io
+import json
+from contextlib import ExitStack, redirect_stdout
+from unittest import mock
+
+import httpx
+from fastapi.testclient import TestClient
+
+import github_oauth_connection
+import helpers.github_helpers as github_helpers
+from tests.fakes import FakeStore
+
+SECRET = "webhook-secret"
+REPOSITORY = {"name": "standup-bot", "owner": {"login": "octodev"}}
+PULL_REQUEST = {
+    "id": 1802231947,
+    "title": "Retry standup sends with backoff",
+    "state": "closed",
+    "html_url": "https://github.com/octodev/standup-bot/pull/42",
+    "updated_at": "2026-03-10T16:51:02Z",
+    "user": {"login": "octodev"}
+}
+
+def _sign(body):
+    return "sha256=" + hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+class LoginServer:
+    """Answers GET /user with the login for the token, and times out for the tokens in slow_tokens."""
+
+    def __init__(self, slow_tokens=()):
+        self.slow_tokens = set(slow_tokens)
+
+    def client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+    async def handle(self, request):
+        token = request.headers["Authorization"].removeprefix("token ")
+        if token in self.slow_tokens:
+            raise httpx.ReadTimeout("timed out", request=request)
+        return httpx.Response(200, json={"login": f"{token}-login"})
+
+def _backfill(tokens, server):
+    saved = {}
+
+    async def get_github_tokens_without_login():
+        return [{"slack_user_id": f"U_{token}", "github_token": token} for token in tokens]
+
+    async def save_github_login(slack_user_id, github_login):
+        saved[slack_user_id] = github_login
+
+    async def backfill():
+        store = FakeStore()
+        with ExitStack() as stack:
+            stack.enter_context(redirect_stdout(io.StringIO()))
+            for name, fake in [
+                ("_http_client", server.client()),
+                ("_request_slots", asyncio.Semaphore(github_helpers.GITHUB_MAX_CONCURRENT_REQUESTS)),
+                ("get_github_http_cache_entry", store.get_github_http_cache_entry),
+                ("save_github_http_cache_entry", store.save_github_http_cache_entry),
+                ("get_github_tokens_without_login", get_github_tokens_without_login),
+                ("save_github_login", save_github_login)
+            ]:
+                stack.enter_context(mock.patch.object(github_helpers, name, fake))
+            return await github_helpers.backfill_github_logins()
+
+    return asyncio.run(backfill()), saved
+
+def test_login_backfill_survives_a_token_timing_out():
+    found, saved = _backfill(["alpha", "slow", "gamma"], LoginServer(slow_tokens=["slow"]))
+    assert found == 2
+    assert saved == {"U_alpha": "alpha-login", "U_gamma": "gamma-login"}
+
+def test_signature_matches_the_hmac_of_the_body(monkeypatch):
+    monkeypatch.setattr(github_helpers, "GITHUB_WEBHOOK_SECRET", SECRET)
+    body = b'{"zen": "Keep it logically awesome."}'
+    assert github_helpers.verify_github_webhook_signature(body, _sign(body))
+    assert not github_helpers.verify_github_webhook_signature(body + b" ", _sign(body))
+    assert not github_helpers.verify_github_webhook_signature(body, "sha256=" + "0" * 64)
+    assert not github_helpers.verify_github_webhook_signature(body, None)
+
+def test_nothing_verifies_without_a_secret(monkeypatch):
+    monkeypatch.setattr(github_helpers, "GITHUB_WEBHOOK_SECRET", None)
+    body = b"{}"
+    assert not github_helpers.verify_github_webhook_signature(body, _sign(body))
+
+def test_push_commits_are_credited_to_their_authors():
+    events = github_helpers._parse_github_webhook("push", {
+        "repository": REPOSITORY,
+        "sender": {"login": "octodev"},
+        "commits": [
+            {"id": "9f3c1e2", "message": "Retry sends", "timestamp": "2026-03-10T16:40:02Z", "author": {"username": "teammate-jo"}},
+            # an author without a GitHub account falls back to the pusher
+            {"id": "1d2e3f4", "message": "Add stats", "timestamp": "2026-03-10T09:12:47Z", "author": {"name": "Octo Dev"}}
+        ]
+    })
+    assert [(event["_id"], event["github_login"]) for event in events] == [("commit:9f3c1e2", "teammate-jo"), ("commit:1d2e3f4", "octodev")]
+
+def test_pull_request_events_are_credited_to_the_author_not_the_sender():
+    # a teammate merging the PR sends the delivery; the activity is still the author's
+    events = github_helpers._parse_github_webhook("pull_request", {
+        "action": "closed", "repository": REPOSITORY, "sender": {"login": "teammate-jo"}, "pull_request": PULL_REQUEST
+    })
+    assert len(events) == 1
+    assert events[0]["github_login"] == "octodev"
+    assert events[0]["_id"] == "pull_request:1802231947:closed:2026-03-10T16:51:02Z"
+
+def test_reviews_are_credited_to_the_reviewer():
+    events = github_helpers._parse_github_webhook("pull_request_review", {
+        "action": "submitted", "repository": REPOSITORY, "sender": {"login": "teammate-jo"}, "pull_request": PULL_REQUEST,
+        "review": {"id": 77, "user": {"login": "teammate-jo"}, "submitted_at": "2026-03-10T17:02:00Z"}
+    })
+    assert [(event["github_login"], event["timestamp"]) for event in events] == [("teammate-jo", "2026-03-10T17:02:00Z")]
+
+def test_other_events_are_ignored():
+    assert github_helpers._parse_github_webhook("issues", {"action": "opened", "repository": REPOSITORY}) == []
+    assert github_helpers._parse_github_webhook("ping", {"zen": "Keep it logically awesome."}) == []
+
+def test_a_body_that_isnt_a_json_object_is_a_bad_request(monkeypatch):
+    monkeypatch.setattr(github_helpers, "GITHUB_WEBHOOK_SECRET", SECRET)
+    client = TestClient(github_oauth_connection.oauth_app)
+    for body in [b"not json", b"[1, 2]"]:
+        response = client.post("/github/webhook", content=body, headers={"X-Hub-Signature-256": _sign(body), "X-GitHub-Event": "push"})
+        assert response.status_code == 400
+    body = json.dumps({"zen": "Keep it logically awesome."}).encode()
+    response = client.post("/github/webhook", content=body, headers={"X-Hub-Signature-256": _sign(b"tampered"), "X-GitHub-Event": "ping"})
+    assert response.status_code == 401
@@ -0,0 +1,110 @@
+"""
+The nightly message rollup against a real MongoDB, including on a database where message_rollups doesn't exist yet;
+and, without one, the storage report around it: the change from before to after, and stats that never block the rollup.
+"""
+import asyncio
+import io
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+import helpers.scheduler_helpers as scheduler_helpers
+from helpers.mongo_db_helpers import rollup_messages, get_message_rollup, get_collection_storage_stats
+from helpers.scheduler_helpers import rollup_daily_messages
+
+DAY = datetime(2026, 1, 5)
+
+def _message(user_id, text, timestamp, is_bot=False):
+    return {"user_id": user_id, "channel_id": f"D{user_id}", "message": text, "is_bot": is_bot, "timestamp": timestamp}
+
+def test_rollup_compacts_each_user_day(run_with_test_db):
+    async def test(db):
+        await db["messages"].insert_many([
+            _message("U1", "morning", DAY + timedelta(hours=9)),
+            _message("U1", "hi!", DAY + timedelta(hours=9, minutes=1), is_bot=True),
+            _message("U1", "the next day", DAY + timedelta(days=1, hours=9)),
+            _message("U2", "another user", DAY + timedelta(hours=10))
+        ])
+        await db["conversation_summaries"].insert_one({"user_id": "U1", "channel_id": "DU1", "date": "2026-01-05", "summary": "talked about task-1"})
+
+        assert await rollup_messages(DAY, DAY + timedelta(days=1)) == 2
+        rollup = await get_message_rollup("U1", "DU1", "2026-01-05")
+        assert [message["message"] for message in rollup["messages"]] == ["morning", "hi!"]
+        assert rollup["message_count"] == 2
+        assert rollup["bot_message_count"] == 1
+        assert rollup["summary"] == "talked about task-1"
+        assert (await get_message_rollup("U2", "DU2", "2026-01-05")).get("summary") is None
+        assert await get_message_rollup("U1", "DU1", "2026-01-06") is None
+
+        # running it again replaces the rollups instead of adding more
+        assert await rollup_messages(DAY, DAY + timedelta(days=1)) == 2
+        assert await db["message_rollups"].count_documents({}) == 2
+
+    run_with_test_db(test)
+
+def test_storage_stats_skip_collections_that_dont_exist(run_with_test_db):
+    async def test(db):
+        await db["messages"].insert_one(_message("U1", "morning", DAY))
+        stats = await get_collection_storage_stats(["messages", "message_rollups"])
+        assert list(stats) == ["messages"]
+        assert stats["messages"]["count"] == 1
+
+    run_with_test_db(test)
+
+def test_nightly_job_creates_rollups_on_a_fresh_database(run_with_test_db):
+    async def test(db):
+        yesterday = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        await db["messages"].insert_one(_message("U1", "morning", yesterday))
+        await rollup_daily_messages()
+        assert await get_message_rollup("U1", "DU1", yesterday.strftime("%Y-%m-%d"))
+
+    run_with_test_db(test)
+
+def _report(monkeypatch, snapshots):
+    """Run the nightly job with the storage stats taken from snapshots in turn, an exception meaning the stats failed."""
+    rollups, recorded = [], []
+
+    async def get_stats(collection_names):
+        snapshot = snapshots.pop(0)
+        if isinstance(snapshot, Exception):
+            raise snapshot
+        return snapshot
+
+    async def rollup(start, end):
+        rollups.append((start, end))
+        return 2
+
+    async def profile():
+        return {"millis": 1}
+
+    monkeypatch.setattr(scheduler_helpers, "get_collection_storage_stats", get_stats)
+    monkeypatch.setattr(scheduler_helpers, "rollup_messages", rollup)
+    monkeypatch.setattr(scheduler_helpers, "profile_messages_query", profile)
+    monkeypatch.setattr(scheduler_helpers, "record_collection_stats", recorded.append)
+    output = io.StringIO()
+    with redirect_stdout(output):
+        asyncio.run(rollup_daily_messages())
+    return rollups, recorded, output.getvalue()
+
+def test_storage_report_shows_the_change_the_rollup_made(monkeypatch):
+    before = {"messages": {"count": 10, "size": 1000, "storage_size": 4096, "index_size": 2048}}
+    after = {**before, "message_rollups": {"count": 2, "size": 600, "storage_size": 4096, "index_size": 1024}}
+    rollups, recorded, output = _report(monkeypatch, [before, after])
+    assert len(rollups) == 1
+    assert recorded == [after]
+    # a collection the rollup created counts from zero
+    assert scheduler_helpers._storage_change(before, after) == {
+        "messages": {"count": 0, "size": 0, "storage_size": 0, "index_size": 0},
+        "message_rollups": {"count": 2, "size": 600, "storage_size": 4096, "index_size": 1024}
+    }
+    assert "change: {'messages': {'count': 0" in output
+
+def test_storage_stats_failing_never_blocks_the_rollup(monkeypatch):
+    after = {"messages": {"count": 10, "size": 1000, "storage_size": 4096, "index_size": 2048}}
+    rollups, recorded, output = _report(monkeypatch, [RuntimeError("collStats not allowed"), after])
+    assert len(rollups) == 1
+    assert recorded == [after]
+    assert "change: None" in output
+
+    rollups, recorded, _ = _report(monkeypatch, [after, RuntimeError("collStats not allowed")])
+    assert len(rollups) == 1
+    assert recorded == []
@@ -0,0 +1,42 @@
+"""
+What a turn says when the update a create or edit tool produced can't be saved: a write that lost to a concurrent one
+twice is a concurrency problem the user can resend through, anything else isn't.
+"""
+import asyncio
+import io
+from contextlib import redirect_stdout
+
+import tool_agent
+from helpers.context_helpers import TurnContext
+from helpers.mongo_db_helpers import StaleUpdateError
+from tests.fakes import USER_ID, CHANNEL_ID
+
+UPDATES = {"preferred_style": "Bullet points", "updates": [{"item": "task-1", "status": "IN_PROGRESS", "identified_blockers": []}]}
+
+def _save(monkeypatch, insert_error):
+    async def insert_item(user_id, updates, expected_version):
+        raise insert_error
+
+    async def get_standup_update(user_id):
+        return {"user_id": user_id, "updates": UPDATES, "version": 2}
+
+    async def make_edits_to_update(has_update, message, user_id, channel_id):
+        return UPDATES
+
+    monkeypatch.setattr(tool_agent, "insert_item", insert_item)
+    monkeypatch.setattr(tool_agent, "get_standup_update", get_standup_update)
+    monkeypatch.setattr(tool_agent, "make_edits_to_update", make_edits_to_update)
+    context = TurnContext(user_id=USER_ID, channel_id=CHANNEL_ID, message="edit", conversation_history=[])
+    with redirect_stdout(io.StringIO()):
+        return asyncio.run(tool_agent._save_update(context, UPDATES))
+
+def test_a_write_that_keeps_losing_the_race_asks_to_resend(monkeypatch):
+    assert _save(monkeypatch, StaleUpdateError()) == (None, tool_agent.UPDATE_NOT_SAVED_MESSAGE)
+
+def test_other_write_errors_dont_blame_a_concurrent_change(monkeypatch):
+    assert _save(monkeypatch, RuntimeError("connection reset")) == (None, tool_agent.UPDATE_SAVE_FAILED_MESSAGE)
+
+def test_questions_from_the_tool_pass_through():
+    context = TurnContext(user_id=USER_ID, channel_id=CHANNEL_ID, message="edit", conversation_history=[])
+    question = "You don't have an update for today yet. What did you work on?"
+    assert asyncio.run(tool_agent._save_update(context, question)) == (question, None)
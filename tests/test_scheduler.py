@@ -0,0 +1,55 @@
+"""
+The scheduler reads and writes its synchronous job store off the event loop: with a job store that takes a while to answer,
+due jobs still run and the loop stays free for the bot's turns in the meantime.
+"""
+import asyncio
+import time
+
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from helpers.scheduler_helpers import ThreadedJobStoreScheduler
+
+JOB_STORE_LATENCY = 0.3
+
+class SlowJobStore(MemoryJobStore):
+    """A MemoryJobStore that blocks like a remote store on every lookup of due jobs."""
+
+    def get_due_jobs(self, now):
+        time.sleep(JOB_STORE_LATENCY)
+        return super().get_due_jobs(now)
+
+async def _job_ran(event):
+    event.set()
+
+async def _run_due_job(scheduler_class):
+    """Run one due coroutine job and return the longest the event loop went without running a callback meanwhile."""
+    scheduler = scheduler_class(jobstores={"default": SlowJobStore()})
+    ran = asyncio.Event()
+    longest_stall = 0.0
+
+    async def watch_loop():
+        nonlocal longest_stall
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            longest_stall = max(longest_stall, time.perf_counter() - start - 0.01)
+
+    watcher = asyncio.create_task(watch_loop())
+    scheduler.start()
+    try:
+        scheduler.add_job(_job_ran, args=[ran])
+        await asyncio.wait_for(ran.wait(), timeout=5)
+    finally:
+        scheduler.shutdown(wait=False)
+        watcher.cancel()
+    return longest_stall
+
+def test_due_jobs_run_without_blocking_the_loop():
+    longest_stall = asyncio.run(_run_due_job(ThreadedJobStoreScheduler))
+    assert longest_stall < JOB_STORE_LATENCY / 3
+
+def test_the_stock_scheduler_blocks_the_loop_on_the_job_store():
+    # what ThreadedJobStoreScheduler avoids
+    longest_stall = asyncio.run(_run_due_job(AsyncIOScheduler))
+    assert longest_stall >= JOB_STORE_LATENCY * 0.9
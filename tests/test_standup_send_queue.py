@@ -0,0 +1,202 @@
+"""
+The durable standup send queue. Against the in-memory store: failed posts are retried with backoff, and a job whose
+worker stopped after posting isn't posted again, because the post carries the job's _id and the re-claim looks for it.
+Against a real MongoDB: enqueueing is idempotent, a claim hides a job until its visibility timeout and records the
+send intent once, retries wait for their run_at, and a fresh worker drains what a stopped one left behind.
+"""
+import asyncio
+import io
+from contextlib import ExitStack, redirect_stdout
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+from slack_sdk.errors import SlackApiError
+
+import helpers.slack_helpers as slack_helpers
+from tests.fakes import FakeSlackClient, FakeStore
+
+DATE = "2026-03-10"
+RETRY_BASE_SECONDS = 8
+
+async def _no_github_token(user_id):
+    # users without GitHub get the connect prompt, which needs no LLM call
+    return None
+
+@pytest.fixture
+def queue(monkeypatch):
+    """The send queue pointed at an in-memory store and Slack client."""
+    store = FakeStore()
+    slack = FakeSlackClient(0)
+    monkeypatch.setattr(slack_helpers, "slack_client", slack)
+    monkeypatch.setattr(slack_helpers, "get_github_token", _no_github_token)
+    monkeypatch.setattr(slack_helpers, "STANDUP_SEND_RETRY_BASE_SECONDS", RETRY_BASE_SECONDS)
+    for name in ["persist_scheduled_message", "standup_message_sent", "enqueue_standup_send_jobs", "claim_standup_send_job",
+                 "complete_standup_send_job", "retry_standup_send_job"]:
+        monkeypatch.setattr(slack_helpers, name, getattr(store, name))
+    return store, slack
+
+def _slack_error(error):
+    return SlackApiError(error, {"ok": False, "error": error})
+
+def _run(coroutine):
+    with redirect_stdout(io.StringIO()):
+        return asyncio.run(coroutine)
+
+def _make_due(store):
+    for job in store.send_jobs.values():
+        job["run_at"] = datetime.utcnow() - timedelta(seconds=1)
+
+def test_a_failed_post_is_retried_with_backoff(queue):
+    store, slack = queue
+    slack.post_errors.append(_slack_error("internal_error"))
+    before = datetime.utcnow()
+    _run(slack_helpers.send_standup_messages(["U1"], DATE))
+    job = store.send_jobs[f"standup:U1:{DATE}"]
+    assert (job["status"], job["attempts"], job["last_error"]) == ("queued", 1, "internal_error")
+    # the first retry waits between half and all of the base delay, so retries from an outage are spread out
+    assert before + timedelta(seconds=RETRY_BASE_SECONDS * 0.5) <= job["run_at"] <= datetime.utcnow() + timedelta(seconds=RETRY_BASE_SECONDS)
+    # not due yet
+    _run(slack_helpers.process_standup_send_queue())
+    assert slack.posts == []
+
+    _make_due(store)
+    _run(slack_helpers.process_standup_send_queue())
+    assert (job["status"], job["attempts"]) == ("sent", 2)
+    assert len(slack.posts) == 1
+
+def test_permanent_slack_errors_are_not_retried(queue):
+    store, slack = queue
+    slack.post_errors.append(_slack_error("channel_not_found"))
+    _run(slack_helpers.send_standup_messages(["U1"], DATE))
+    job = store.send_jobs[f"standup:U1:{DATE}"]
+    assert (job["status"], job["attempts"], job["last_error"]) == ("failed", 1, "channel_not_found")
+
+def test_a_post_that_wasnt_recorded_is_found_instead_of_sent_again(queue, monkeypatch):
+    store, slack = queue
+    persist = store.persist_scheduled_message
+    failures = [RuntimeError("connection reset")]
+
+    async def persist_once_failing(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return await persist(*args, **kwargs)
+
+    monkeypatch.setattr(slack_helpers, "persist_scheduled_message", persist_once_failing)
+    _run(slack_helpers.send_standup_messages(["U1"], DATE))
+    # posted, but the record of it failed, so the job went back on the queue
+    assert len(slack.posts) == 1
+    assert store.send_jobs[f"standup:U1:{DATE}"]["status"] == "queued"
+
+    _make_due(store)
+    _run(slack_helpers.process_standup_send_queue())
+    assert len(slack.posts) == 1
+    assert store.send_jobs[f"standup:U1:{DATE}"]["status"] == "sent"
+    assert store.scheduled_messages[("U1", DATE)] == slack.posts[0]["text"]
+
+def test_a_job_whose_worker_died_after_posting_is_reclaimed_without_a_second_post(queue, monkeypatch):
+    store, slack = queue
+    posted = asyncio.Event()
+
+    async def die_before_persisting(*args, **kwargs):
+        posted.set()
+        await asyncio.Event().wait()
+
+    async def worker_dies_after_posting():
+        monkeypatch.setattr(slack_helpers, "persist_scheduled_message", die_before_persisting)
+        worker = asyncio.create_task(slack_helpers.send_standup_messages(["U1"], DATE))
+        await posted.wait()
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+
+    _run(worker_dies_after_posting())
+    monkeypatch.setattr(slack_helpers, "persist_scheduled_message", store.persist_scheduled_message)
+    assert len(slack.posts) == 1
+    # the next worker sends the rest of the day's queue but leaves U1's job alone until its visibility timeout
+    _run(slack_helpers.send_standup_messages(["U1", "U2"], DATE))
+    assert len(slack.posts) == 2
+    job = store.send_jobs[f"standup:U1:{DATE}"]
+    assert job["status"] == "running"
+
+    job["lease_expires_at"] = datetime.utcnow() - timedelta(seconds=1)
+    _run(slack_helpers.process_standup_send_queue())
+    # both users have exactly the one message they were sent
+    assert sorted(post["channel"] for post in slack.posts) == ["U1", "U2"]
+    assert {job["status"] for job in store.send_jobs.values()} == {"sent"}
+    assert set(store.scheduled_messages) == {("U1", DATE), ("U2", DATE)}
+
+def test_enqueue_adds_one_job_per_user_and_day(run_with_test_db):
+    async def test(db):
+        from helpers.mongo_db_helpers import enqueue_standup_send_jobs
+        assert await enqueue_standup_send_jobs(["U1", "U2"], DATE, 3) == 2
+        # a slot job that runs twice queues nothing new
+        assert await enqueue_standup_send_jobs(["U1", "U2", "U3"], DATE, 3) == 1
+        assert await enqueue_standup_send_jobs(["U1"], "2026-03-11", 3) == 1
+        jobs = await db["standup_send_jobs"].find({}, {"_id": 1, "status": 1, "attempts": 1}).sort("_id", 1).to_list()
+        assert jobs == [
+            {"_id": "standup:U1:2026-03-10", "status": "queued", "attempts": 0},
+            {"_id": "standup:U1:2026-03-11", "status": "queued", "attempts": 0},
+            {"_id": "standup:U2:2026-03-10", "status": "queued", "attempts": 0},
+            {"_id": "standup:U3:2026-03-10", "status": "queued", "attempts": 0}
+        ]
+
+    run_with_test_db(test)
+
+def test_a_claim_hides_the_job_until_its_visibility_timeout(run_with_test_db):
+    async def test(db):
+        from helpers.mongo_db_helpers import enqueue_standup_send_jobs, claim_standup_send_job, complete_standup_send_job
+        await enqueue_standup_send_jobs(["U1"], DATE, 3)
+        job = await claim_standup_send_job("node-a", 1)
+        assert (job["status"], job["owner"], job["attempts"]) == ("running", "node-a", 1)
+        # the send intent is written by the claim itself
+        assert job["send_intent_at"] == job["started_at"]
+        assert await claim_standup_send_job("node-b", 1) is None
+
+        await asyncio.sleep(1.2)
+        reclaimed = await claim_standup_send_job("node-b", 1)
+        assert (reclaimed["owner"], reclaimed["attempts"]) == ("node-b", 2)
+        # a re-claim keeps the first intent, which bounds where an earlier post can be
+        assert reclaimed["send_intent_at"] == job["send_intent_at"]
+        # the worker that timed out can't finish the job from under the one that has it now
+        await complete_standup_send_job(job["_id"], "node-a", "sent")
+        assert (await db["standup_send_jobs"].find_one({"_id": job["_id"]}))["status"] == "running"
+        await complete_standup_send_job(job["_id"], "node-b", "sent")
+        assert (await db["standup_send_jobs"].find_one({"_id": job["_id"]}))["status"] == "sent"
+
+    run_with_test_db(test)
+
+def test_a_retried_job_waits_for_its_run_at(run_with_test_db):
+    async def test(db):
+        from helpers.mongo_db_helpers import enqueue_standup_send_jobs, claim_standup_send_job, retry_standup_send_job
+        await enqueue_standup_send_jobs(["U1"], DATE, 3)
+        job = await claim_standup_send_job("node-a", 60)
+        await retry_standup_send_job(job["_id"], "node-a", datetime.utcnow() + timedelta(seconds=1), "internal_error")
+        assert await claim_standup_send_job("node-a", 60) is None
+        await asyncio.sleep(1.2)
+        retried = await claim_standup_send_job("node-b", 60)
+        assert (retried["attempts"], retried["last_error"], retried["owner"]) == (2, "internal_error", "node-b")
+
+    run_with_test_db(test)
+
+def test_a_fresh_worker_drains_what_a_stopped_one_left(run_with_test_db):
+    async def test(db):
+        from helpers.mongo_db_helpers import enqueue_standup_send_jobs, claim_standup_send_job, standup_message_sent
+        users = [f"U{index}" for index in range(5)]
+        # today, as the sent messages are stamped with the time they went out
+        date = datetime.now().strftime("%Y-%m-%d")
+        await enqueue_standup_send_jobs(users, date, 3)
+        # the node that queued them stopped while it held one of the jobs
+        await claim_standup_send_job("stopped-node", 1)
+        await asyncio.sleep(1.2)
+
+        slack = FakeSlackClient(0)
+        with ExitStack() as stack:
+            stack.enter_context(redirect_stdout(io.StringIO()))
+            stack.enter_context(mock.patch.object(slack_helpers, "slack_client", slack))
+            stack.enter_context(mock.patch.object(slack_helpers, "get_github_token", _no_github_token))
+            await slack_helpers.process_standup_send_queue()
+        assert sorted(post["channel"] for post in slack.posts) == users
+        assert all([await standup_message_sent(user_id, date) for user_id in users])
+        assert await db["standup_send_jobs"].count_documents({"status": "sent"}) == len(users)
+
+    run_with_test_db(test)
@@ -0,0 +1,109 @@
+"""
+The per-item documents behind the team views. Against a real MongoDB: status_since carries over between days, the
+blocker and stale queries read each user's latest update, the backfill builds items for updates without them, and a
+sync of an older version of an update, like a backfill racing a live edit, leaves the newer items alone. Without one,
+the Slack formatting of the team views.
+"""
+from datetime import datetime, timedelta
+from unittest import mock
+
+import helpers.mongo_db_helpers as mongo_db_helpers
+from helpers.format_helpers import format_team_blockers_to_slack, format_stale_items_to_slack
+
+def _day(days_ago):
+    return (datetime.now() - timedelta(days=days_ago)).strftime("%Y-%m-%d")
+
+def _update(*items):
+    return {"updates": [{"item": item, "status": status, "identified_blockers": blockers} for item, status, blockers in items]}
+
+async def _save(db, user_id, date, update, version=1):
+    """Store the daily update as a write of the given version would, then its items."""
+    await db["daily_updates"].update_one({"user_id": user_id, "date": date}, {"$set": {"updates": update, "version": version}}, upsert=True)
+    await mongo_db_helpers.sync_update_items(user_id, date, update, version)
+
+async def _items(db, user_id, date):
+    items = await db["update_items"].find({"user_id": user_id, "date": date}, {"_id": 0, "item": 1, "status": 1, "status_since": 1}).sort("item", 1).to_list()
+    return [(item["item"], item["status"], item["status_since"]) for item in items]
+
+def test_team_blockers_and_stale_items_come_from_each_users_latest_update(run_with_test_db):
+    async def test(db):
+        from helpers.mongo_db_helpers import get_team_blockers, get_stale_items
+        await _save(db, "U1", _day(6), _update(("api", "in_progress", []), ("docs", "blocked", ["review"])))
+        await _save(db, "U1", _day(1), _update(("api", "in_progress", []), ("docs", "completed", [])))
+        await _save(db, "U2", _day(2), _update(("deploy", "in_progress", ["access"]), ("tests", "blocked", [])))
+        # only each user's latest update counts
+        await _save(db, "U3", _day(3), _update(("old", "blocked", [])))
+        await _save(db, "U3", _day(0), _update(("new", "in_progress", [])))
+
+        blockers = await get_team_blockers()
+        assert sorted((item["user_id"], item["item"]) for item in blockers) == [("U2", "deploy"), ("U2", "tests")]
+        # api has been in progress since the first day it was
+        stale = await get_stale_items("in_progress", 5)
+        assert [(item["user_id"], item["item"], item["status_since"]) for item in stale] == [("U1", "api", _day(6))]
+        assert await get_stale_items("in_progress", 8) == []
+
+    run_with_test_db(test)
+
+def test_backfill_builds_the_items_of_updates_without_them(run_with_test_db):
+    async def test(db):
+        from helpers.mongo_db_helpers import backfill_update_items
+        await db["daily_updates"].insert_many([
+            {"user_id": "U1", "date": _day(2), "updates": _update(("api", "IN_PROGRESS", []))},
+            {"user_id": "U1", "date": _day(1), "updates": _update(("api", "IN_PROGRESS", []), ("docs", "BLOCKED", []))},
+            {"user_id": "U2", "date": _day(1), "updates": "not an update"}
+        ])
+        assert await backfill_update_items(days=5) == 2
+        assert await _items(db, "U1", _day(1)) == [("api", "IN_PROGRESS", _day(2)), ("docs", "BLOCKED", _day(1))]
+        # nothing left to do
+        assert await backfill_update_items(days=5) == 0
+
+    run_with_test_db(test)
+
+def test_an_older_version_does_not_overwrite_newer_items(run_with_test_db):
+    async def test(db):
+        from helpers.mongo_db_helpers import sync_update_items
+        await _save(db, "U1", _day(1), _update(("api", "IN_PROGRESS", [])))
+        await _save(db, "U1", _day(0), _update(("api", "IN_PROGRESS", []), ("docs", "BLOCKED", [])), version=2)
+        # a sync of version 1 that was read before version 2 was written and runs after it
+        await sync_update_items("U1", _day(0), _update(("api", "COMPLETED", []), ("old", "IN_PROGRESS", [])), 1)
+        assert await _items(db, "U1", _day(0)) == [("api", "IN_PROGRESS", _day(1)), ("docs", "BLOCKED", _day(0))]
+
+    run_with_test_db(test)
+
+def test_a_backfill_racing_a_live_edit_leaves_the_live_items(run_with_test_db):
+    async def test(db):
+        from helpers.mongo_db_helpers import backfill_update_items, insert_item
+        today = _day(0)
+        await db["daily_updates"].insert_one({"user_id": "U1", "date": today, "updates": _update(("api", "IN_PROGRESS", []), ("docs", "BLOCKED", [])), "version": 1})
+        sync = mongo_db_helpers.sync_update_items
+        edits = [_update(("api", "COMPLETED", []))]
+
+        async def edit_before_first_sync(*args):
+            # the user edits the update after the backfill read it, and that edit's sync finishes first
+            if edits:
+                assert (await insert_item("U1", edits.pop()))["version"] == 2
+            return await sync(*args)
+
+        with mock.patch.object(mongo_db_helpers, "sync_update_items", edit_before_first_sync):
+            assert await backfill_update_items(days=1) == 1
+        # api keeps its live status and docs, which the edit removed, isn't brought back
+        assert await _items(db, "U1", today) == [("api", "COMPLETED", today)]
+
+    run_with_test_db(test)
+
+def test_team_blockers_format():
+    items = [
+        {"user_id": "U1", "item": "deploy", "status": "IN_PROGRESS", "status_since": "2026-03-02", "blockers": ["access", "review"]},
+        {"user_id": "U2", "item": "tests", "status": "BLOCKED", "status_since": "2026-03-05", "blockers": []}
+    ]
+    assert format_team_blockers_to_slack(items) == (
+        "Blocked across the team (2):\n"
+        "- <@U1> deploy (IN_PROGRESS since 2026-03-02): access, review\n"
+        "- <@U2> tests (BLOCKED since 2026-03-05)"
+    )
+    assert format_team_blockers_to_slack([]) == "Nothing is blocked across the team right now."
+
+def test_stale_items_format():
+    items = [{"user_id": "U1", "item": "api", "status": "IN_PROGRESS", "status_since": "2026-03-02", "blockers": []}]
+    assert format_stale_items_to_slack(items, "IN_PROGRESS", 5) == "Items IN_PROGRESS for 5 days or more (1):\n- <@U1> api (since 2026-03-02)"
+    assert format_stale_items_to_slack([], "IN_PROGRESS", 5) == "No items have been IN_PROGRESS for 5 days or more."
@@ -1,15 +1,18 @@
 from langchain_core.tools.structured import StructuredTool
-from helpers.llm_helpers import llm, ask_question_response, create_standup_update, make_edits_to_update, friendly_conversation_response, convert_conversation_history_to_langchain_messages
-from helpers.mongo_db_helpers import insert_item, update_exists, get_standup_updates_by_user_id, get_messages_from_db
-from langchain_core.messages import SystemMessage, HumanMessage
+from helpers.llm_helpers import llm, invoke_llm, ask_question_response, create_standup_update, make_edits_to_update, friendly_conversation_response
+from helpers.mongo_db_helpers import insert_item, update_exists, get_standup_updates_by_user_id, get_standup_update, StaleUpdateError
+from helpers.context_helpers import TurnContext, set_turn_context
+from helpers.format_helpers import MAX_HISTORY_TOKENS
+from helpers.metrics_helpers import record_tool_call, record_handled_error
+from langchain_core.prompts.chat import ChatPromptTemplate, MessagesPlaceholder
 
 # Define the tools
-create_standup_update_tool = StructuredTool.from_function(func=create_standup_update)
-ask_question_tool = StructuredTool.from_function(func=ask_question_response)
-make_edits_to_update_tool = StructuredTool.from_function(func=make_edits_to_update)
-friendly_conversation_tool = StructuredTool.from_function(func=friendly_conversation_response)
-check_if_update_exists_tool = StructuredTool.from_function(func=update_exists)
-get_standup_update_by_user_id_tool = StructuredTool.from_function(func=get_standup_updates_by_user_id)
+create_standup_update_tool = StructuredTool.from_function(coroutine=create_standup_update)
+ask_question_tool = StructuredTool.from_function(coroutine=ask_question_response)
+make_edits_to_update_tool = StructuredTool.from_function(coroutine=make_edits_to_update)
+friendly_conversation_tool = StructuredTool.from_function(coroutine=friendly_conversation_response)
+check_if_update_exists_tool = StructuredTool.from_function(coroutine=update_exists)
+get_standup_update_by_user_id_tool = StructuredTool.from_function(coroutine=get_standup_updates_by_user_id)
 
 tool_map = {
     "create_standup_update": create_standup_update_tool,
@@ -29,20 +32,18 @@ tools = [
 
 agent = llm.bind_tools(tools)
 
-def execute_agent_with_user_context(message: str, user_id: str, channel_id: str):
-    has_update = update_exists(user_id) and get_standup_updates_by_user_id(user_id)[0]["updates"] # need to check if the update is not empty in case we need to insert an empty update for the day
-    print("has_update: ", has_update)
-    # give the agent conversation history
-    # TODO: do we need to conditionally change prompt based on whether or not we have access to github activity?
-    tool_prompt = """
-    You are a project manager that helps developers with their standup updates. You are given a set of tools to use to help you reply to the user's standup update.
+# reported as the last tool when a create or edit couldn't be saved, so the reply agent sends the not-saved message as is
+UPDATE_NOT_SAVED = "update_not_saved"
+# the update kept changing under the turn, even after redoing the edit once
+UPDATE_NOT_SAVED_MESSAGE = "Sorry, I couldn't save that change to your standup update because it was changed at the same time. Could you send it again?"
+# anything else went wrong writing it
+UPDATE_SAVE_FAILED_MESSAGE = "Sorry, something went wrong saving that change to your standup update. Could you try again in a moment?"
 
-    You are also given the following context:
-    channel_id: {channel_id}
-    user_id: {user_id}
-    Does the human have an existing update: {update_exists}
+# TODO: do we need to conditionally change prompt based on whether or not we have access to github activity?
+TOOL_AGENT_INSTRUCTIONS = """
+    You are a project manager that helps developers with their standup updates. You are given a set of tools to use to help you reply to the user's standup update.
 
-    You will also be given a conversation history with the user.
+    You will be given a conversation history with the user, followed by the context of their latest message: the channel_id, the user_id and whether the human has an existing update.
 
     You must use the tools provided to you to take the most appropriate actions to help the user with their standup update. You can use more than one tool if needed.
     In situations where you need to use more than one tool, you should prioritize using the create_standup_update and make_edits_to_update tools first before the ask question and friendly_conversation tools.
@@ -54,70 +55,53 @@ def execute_agent_with_user_context(message: str, user_id: str, channel_id: str)
     However, in a case where the user does not like the standup update provided by you, you can use the ask_question tool to respond to the user on what they would like to change or use the create or edit update tools to make changes depending on if an update already exists for the given day.
 
     You must use your best judgement to determine which tool to use and if more than one tool is needed.
-    Make sure to provide that tool the necessary context to respond to the user from above without changing any of the parameters like the channel_id, user_id, update_exists, and message from the user.
+    Make sure to provide that tool the necessary context to respond to the user without changing any of the parameters like the channel_id, user_id, update_exists, and message from the user.
     Also make sure to follow the tool's instructions carefully.
-    
-    """.format(channel_id=channel_id, user_id=user_id, update_exists="Yes" if has_update else "No")
-
-    test_prompt = """
-    You are a project manager that helps developers with their standup updates. You are given a set of tools to use to help you reply to the user's standup update.
-
-    You are also given the following context:
-    channel_id: {channel_id}
-    user_id: {user_id}
-    Does the human have an existing update: {update_exists}
-
-    Use only one tool to respond to the user and provide that tool the necessary context to respond to the user from above without changing any of the parameters.
-    You must analyze the conversation history carefully to determine if you have enough information to create or edit an update. Sufficient information is defined as having a status for each task.
-    It is likely that tasks and their associated statuses are in the conversation history, so use the conversation history to infer statuses for each task and the items that are in the update.
-    You MUST use the conversation history to infer statuses for each task and the items that are in the update.
-    Keep the conversation relevant to the user's standup update and only use friendly conversation if the user has provided a standup update.
-    """.format(channel_id=channel_id, user_id=user_id, message=message, update_exists="Yes" if has_update else "No")
-
-    test_prompt_2 = """
-    You are a project manager that helps developers with their standup updates. You are given a set of tools to use to help you reply to the user's standup update.
-
-    You are also given the following context:
-    channel_id: {channel_id}
-    user_id: {user_id}
-    Does the human have an existing update: {update_exists}
-
-    Use only one tool to respond to the user and provide that tool the necessary context to respond to the user from above without changing any of the parameters.
-    Make sure to follow the tool's instructions carefully and only create or edit an update if there is sufficient information from the user and conversation history to do so.
-    You should always be asking yourself if you have enough information to create or edit an update. 
-    If not, asking the user for more information about statuses and blockers should be your first priority using the ask_question tool.
-    Remember to not change any of the parameters like the channel_id, user_id, update_exists, and message from the user.
-    """.format(channel_id=channel_id, user_id=user_id, message=message, update_exists="Yes" if has_update else "No")
-
-    conversation_history = get_messages_from_db(user_id, channel_id, max_number_of_messages_to_fetch=8)
-    langchain_messages = convert_conversation_history_to_langchain_messages(conversation_history)
-
-    chat_template = [
-        *langchain_messages,
-        SystemMessage(content=tool_prompt),
-        HumanMessage(content=message),
-    ]
-   
-    tool_response = agent.invoke(chat_template)
+    """
+
+# compiled once; the instructions and the bound tool schemas are the same for every user, so they lead the prompt
+# and the per-user history, context and message come last where they don't break the provider's prefix cache
+TOOL_AGENT_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", TOOL_AGENT_INSTRUCTIONS),
+    MessagesPlaceholder("history"),
+    ("system", "Context for the user's latest message:\nchannel_id: {channel_id}\nuser_id: {user_id}\nDoes the human have an existing update: {update_exists}"),
+    ("human", "{message}")
+])
+
+async def execute_agent_with_user_context(context: TurnContext):
+    message, user_id, channel_id = context.message, context.user_id, context.channel_id
+    set_turn_context(context)
+    has_update = context.has_update and context.update["updates"] # need to check if the update is not empty in case we need to insert an empty update for the day
+    print("has_update: ", has_update)
+    messages = TOOL_AGENT_PROMPT.format_messages(
+        history=context.get_langchain_history(MAX_HISTORY_TOKENS),
+        channel_id=channel_id,
+        user_id=user_id,
+        update_exists="Yes" if has_update else "No",
+        message=message
+    )
+    tool_response = await invoke_llm("tool_agent", messages, agent)
 
     print(f"all tools used for the following message: {message} ", [tool_call["name"] for tool_call in tool_response.tool_calls])
 
-    def execute_tool_calls(tool_response):
+    async def execute_tool_calls(tool_response):
         messages = []
         tool_name = None
         for tool_call in tool_response.tool_calls:
             tool_name = tool_call["name"].lower()
+            record_tool_call(tool_name)
             selected_tool = tool_map[tool_name]
-            tool_output = selected_tool.invoke(tool_call["args"])
-            messages.append(tool_output)
+            tool_output = await selected_tool.ainvoke(tool_call["args"])
             if tool_name == "create_standup_update" or tool_name == "make_edits_to_update":
-                try:
-                    insert_item(user_id, tool_output)
-                except Exception as e:
-                    print("Error inserting item: ", e)
+                tool_output, not_saved_message = await _save_update(context, tool_output)
+                if not_saved_message:
+                    # don't let the reply agent format the old update as if the change went through
+                    messages.append(not_saved_message)
+                    return messages, UPDATE_NOT_SAVED
+            messages.append(tool_output)
         return messages, tool_name
 
-    agent_response, last_used_tool = execute_tool_calls(tool_response)
+    agent_response, last_used_tool = await execute_tool_calls(tool_response)
     # if last_used_tool == "friendly_conversation" and not has_update:
     #     print("friendly conversation and no update exists")
         # attempt to create an update if no update exists yet and there's friendly conversation because 
@@ -125,4 +109,38 @@ def execute_agent_with_user_context(message: str, user_id: str, channel_id: str)
         #     create_standup_update(user_id, channel_id)
         # except Exception as e:
         #     print("Error inserting empty update: ", e)
-    return agent_response, last_used_tool
\ No newline at end of file
+    return agent_response, last_used_tool
+
+async def _save_update(context: TurnContext, extracted_updates):
+    """
+    Write the update a create or edit tool produced over the version this turn read, and keep the context in step.
+    If someone else wrote the day's update in the meantime, the edit is redone once against their version.
+    Returns what was saved, or a question from the tool as is, along with None; or None and the message to send
+    instead if the change couldn't be saved.
+    """
+    user_id = context.user_id
+    if not isinstance(extracted_updates, dict):
+        # make_edits_to_update asks a question instead when there is no update to edit; that isn't an update to store
+        return extracted_updates, None
+    for attempt in range(2):
+        expected_version = context.update.get("version", 0) if context.update else 0
+        try:
+            # insert_item returns the stored document
+            context.set_update(await insert_item(user_id, extracted_updates, expected_version))
+            return extracted_updates, None
+        except StaleUpdateError:
+            if attempt:
+                break
+            print(f"update for {user_id} changed during the turn, redoing the edit against the latest version")
+            context.set_update(await get_standup_update(user_id))
+            # make_edits_to_update edits the update in the turn context, which now holds the latest version
+            extracted_updates = await make_edits_to_update(context.has_update, context.message, user_id, context.channel_id)
+            if not isinstance(extracted_updates, dict):
+                # the update is gone, so it asked a question instead of editing
+                break
+        except Exception as e:
+            print("Error inserting item: ", e)
+            record_handled_error("insert_item")
+            return None, UPDATE_SAVE_FAILED_MESSAGE
+    record_handled_error("stale_update")
+    return None, UPDATE_NOT_SAVED_MESSAGE